@@ -1,199 +1,194 @@
 # api/api.py
 from ninja import NinjaAPI, File, UploadedFile
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.contrib.postgres.search import SearchVector
-from .models import Document, DocumentChunk
-from .schemas import ChatIn, ChatOut, DocumentOut
-from .services import search_hybrid, get_embedding, call_llm, create_presigned_url, determine_search_depth
-from pypdf import PdfReader
+from .models import IngestionJob
+from .schemas import ChatIn, BatchChatIn, ChatOut, JobOut
+from .services import astream_llm
+from .chat import (
+    prepare_context, parse_llm_response, build_sources, AnswerParser, find_cached_answer, remember_answer,
+    agenerate_answer, map_reduce_partitions, amap_reduce_answer
+)
+from .batch import answer_batch
+from .cache import corpus_version
+from .ingest import enqueue_upload
+from .metrics import registry, span, start_timings, record_stage, REQUEST_SECONDS, ERRORS
+import json
 import time
-import re
 
 
 api = NinjaAPI(title="ConTracKt AI API")
 
-@api.post("/upload", response=DocumentOut)
+@api.post("/upload", response=JobOut)
 def upload_document(request, file: UploadedFile = File(...)):
     """
-    1. Uploads PDF to S3
-    2. Extracts text
-    3. Chunks & Embeds into PGVector
+    Queues a PDF for background ingestion and returns the job right away.
+    Parsing, S3 upload and embedding run in `manage.py ingest_worker`.
+    Poll /jobs/{id} for progress.
     """
-    start_time = time.time()
-    if file.size > 10 * 1024 * 1024:
-        raise ValueError("File too large. Maximum size is 10MB.")
-    # A. Read PDF (Ideally, move this to Celery for large files)
-    pdf_reader = PdfReader(file.file)
-    file_content = file.file.read() # Read binary for S3
-    
-    # B. Save Parent Record
-    doc = Document.objects.create(
-        title=file.name,
-        s3_key=f"uploads/{file.name}",
-        total_pages=len(pdf_reader.pages)
-    )
-    
-    # C. Chunking & Embedding Loop
-    # (Simple page-level chunking for speed)
-    chunks_to_create = []
-    
-    for i, page in enumerate(pdf_reader.pages):
-        text = page.extract_text()
-        if len(text) > 50: # Ignore empty pages
-            vec = get_embedding(text) # Call AWS Titan
-            
-            chunks_to_create.append(DocumentChunk(
-                document=doc,
-                chunk_index=i + 1,
-                text_content=text,
-                embedding=vec
-            ))
-            
-    # D. Bulk Insert (Much faster than loop save)
-    DocumentChunk.objects.bulk_create(chunks_to_create)
-    
-    # E. UPDATE SEARCH VECTORS (The Hybrid Step)
-    # We trigger a fast SQL update to populate the keyword index
-    DocumentChunk.objects.filter(document=doc).update(
-        search_vector=SearchVector('text_content')
-    )
-    
-    return doc
-
-MAX_CONTEXT_CHARS = 50000
+    if file.size > settings.MAX_UPLOAD_SIZE:
+        raise ValueError(f"File too large. Maximum size is {settings.MAX_UPLOAD_SIZE // (1024 * 1024)}MB.")
+
+    with span("upload_spool"):
+        return enqueue_upload(file)
+
+@api.get("/jobs/{job_id}", response=JobOut)
+def get_job(request, job_id: int):
+    return get_object_or_404(IngestionJob, id=job_id)
 
 @api.post("/chat", response=ChatOut)
 async def chat_endpoint(request, payload: ChatIn):
     start = time.time()
-    from asgiref.sync import sync_to_async
-    
-    # 1. DYNAMIC DEPTH ANALYSIS
-    # Ask LLM how deep we need to dig (Returns e.g., 10, 20, or 60)
-    k_value = await sync_to_async(determine_search_depth)(payload.query)
-    print(f"🧠 Query Intent Analysis: Retrieving Top-{k_value} chunks.")
-    
-    # 2. HYBRID SEARCH (OVERSAMPLING)
-    # We fetch 3x the required chunks. Why? Because if Doc A has 50 matches and Doc B has 1,
-    # a standard search might fill up with only Doc A. We need extra candidates for diversity.
-    raw_results = await sync_to_async(search_hybrid)(
-        payload.query, 
-        top_k=k_value * 3
-    )
-    
-    # 3. DIVERSITY RE-RANKING (The Fix for "Missed Files")
-    # Goal: Ensure every matching document gets at least one slot in the context.
-    # Logic: Group chunks by Document -> Pick 1 from A, 1 from B, 1 from C -> Repeat.
-    
-    grouped_results = {}
-    for res in raw_results:
-        title = res.document.title
-        if title not in grouped_results:
-            grouped_results[title] = []
-        grouped_results[title].append(res)
-        
-    final_context_list = []
-    has_more_chunks = True
-    
-    # Round-Robin Selection Loop
-    while has_more_chunks and len(final_context_list) < k_value:
-        has_more_chunks = False
-        # Sort keys to ensure deterministic order
-        for title in sorted(grouped_results.keys()):
-            if grouped_results[title]:
-                # Take the highest scoring remaining chunk from this doc
-                chunk = grouped_results[title].pop(0)
-                final_context_list.append(chunk)
-                has_more_chunks = True
-                
-                if len(final_context_list) >= k_value:
-                    break
-    
-    # 4. CONTEXT CONSTRUCTION (With Safety Pruning)
-    context_chunks = []
-    current_char_count = 0
-    
-    for c in final_context_list:
-        # Tag content so LLM knows where it came from
-        chunk_text = f"[[SOURCE: {c.document.title}]]\n{c.text_content}\n\n"
-        chunk_len = len(chunk_text)
-        
-        # STOP if we exceed the safety limit (e.g. 50,000 chars)
-        if current_char_count + chunk_len > MAX_CONTEXT_CHARS:
-            print(f"⚠️ Context limit ({MAX_CONTEXT_CHARS}) reached. Pruning remaining chunks.")
-            continue
-            
-        context_chunks.append(chunk_text)
-        current_char_count += chunk_len
-
-    context_str = "".join(context_chunks)
-    
-    # 5. CALL LLM (Now returns text with [[REASON: ...]] tags)
-    raw_llm_response = await sync_to_async(call_llm)(context_str, payload.query)
-    
-    # --- 6. INTELLIGENT PARSING LOGIC (The Fix) ---
-    clean_answer_parts = []
-    source_reasoning_map = {} # Stores "DocTitle" -> "Reason"
-    
-    # Split by Source Headers
-    segments = re.split(r'(### SOURCE: .*)', raw_llm_response)
-    current_title = None
-    
-    for seg in segments:
-        if seg.startswith("### SOURCE:"):
-            current_title = seg.replace("### SOURCE:", "").strip()
-            clean_answer_parts.append(seg) # Keep header
-        else:
-            text_body = seg.strip()
-            if not current_title or not text_body: continue
-            
-            # Filter empty blocks
-            if "[[EMPTY]]" in text_body or len(text_body) < 10:
-                if clean_answer_parts and clean_answer_parts[-1].startswith("### SOURCE:"):
-                    clean_answer_parts.pop() 
-                current_title = None
-                continue
-
-            # Extract Reasoning Tag
-            reason_match = re.search(r'\[\[REASON:(.*?)\]\]', text_body, re.DOTALL)
-            if reason_match:
-                reason_text = reason_match.group(1).strip()
-                source_reasoning_map[current_title] = reason_text
-                
-                # Clean the text for display
-                clean_text = text_body.replace(reason_match.group(0), "").strip()
-                clean_answer_parts.append(clean_text)
-            else:
-                # Fallback
-                source_reasoning_map[current_title] = "Contextual match found by AI analysis."
-                clean_answer_parts.append(text_body)
-
-    final_clean_answer = "\n".join(clean_answer_parts)
-    
-    # 7. FORMAT SOURCES (Attach AI Reason)
-    seen_urls = set()
-    sources = []
-    
-    for res in final_context_list:
-        if res.document.title in source_reasoning_map:
-            unique_key = f"{res.document.title}-{res.chunk_index}"
-            if unique_key not in seen_urls:
-                clean_snippet = res.text_content[:600].replace("\n", " ") + "..."
-                
-                # Use reason from map, or fallback to score-based logic
-                ai_reason = source_reasoning_map.get(res.document.title, "Matched relevant context.")
-                
-                sources.append({
-                    "title": res.document.title, 
-                    "page": res.chunk_index, 
-                    "score": getattr(res, 'score', 0.0), 
-                    "file_url": create_presigned_url(res.document.s3_key),
-                    "snippet": clean_snippet,
-                    "reason": ai_reason # <--- Dynamic LLM Reason
-                })
-                seen_urls.add(unique_key)
-    
+    timings = start_timings()
+
+    # One corpus version for the whole request (retrieval and answer cache keys)
+    version = await sync_to_async(corpus_version)()
+
+    # 1-4. Intent analysis, hybrid search, diversity re-ranking, context construction
+    k_value, final_context_list, context_str = await prepare_context(payload.query, payload.filter_dict(), version)
+
+    # Same chunks + near-identical question: skip the LLM
+    cached = await find_cached_answer(payload.query, final_context_list, version)
+    if cached:
+        final_clean_answer, sources = cached["answer"], cached["sources"]
+    else:
+        # 5. CALL LLM (Now returns text with [[REASON: ...]] tags); map-reduce for broad queries
+        raw_llm_response, _ = await agenerate_answer(payload.query, k_value, final_context_list, context_str)
+
+        # 6. INTELLIGENT PARSING LOGIC
+        final_clean_answer, source_reasoning_map = parse_llm_response(raw_llm_response)
+
+        # 7. FORMAT SOURCES (Attach AI Reason)
+        sources = build_sources(final_context_list, source_reasoning_map)
+        await remember_answer(payload.query, final_context_list, final_clean_answer, sources, version)
+
+    processing_time = time.time() - start
+    registry.observe(REQUEST_SECONDS, processing_time, endpoint="chat")
+
     return {
         "answer": final_clean_answer,
         "sources": sources,
-        "processing_time": time.time() - start
-    }
\ No newline at end of file
+        "processing_time": processing_time,
+        "cached": bool(cached),
+        "timings": timings if payload.include_timings else None
+    }
+
+async def _single_delta(awaitable):
+    yield await awaitable
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@api.post("/chat/stream")
+async def chat_stream_endpoint(request, payload: ChatIn):
+    """
+    Server-sent events version of /chat.
+    Events: "token" (raw LLM text as it arrives), "source" (citations for a
+    "### SOURCE:" section as soon as it closes), "done" (same body as /chat), "error".
+    """
+    async def event_stream():
+        start = time.time()
+        timings = start_timings()
+        try:
+            version = await sync_to_async(corpus_version)()
+            k_value, final_context_list, context_str = await prepare_context(payload.query, payload.filter_dict(), version)
+
+            cached = await find_cached_answer(payload.query, final_context_list, version)
+            if cached:
+                yield sse_event("done", {
+                    **cached,
+                    "processing_time": time.time() - start,
+                    "cached": True,
+                    "timings": timings if payload.include_timings else None
+                })
+                return
+
+            parser = AnswerParser()
+            sources = []
+
+            def emit_sources(closed_sections):
+                events = []
+                for title, reason in closed_sections:
+                    section_sources = build_sources(final_context_list, {title: reason})
+                    sources.extend(section_sources)
+                    events.append(sse_event("source", {"title": title, "reason": reason, "sources": section_sources}))
+                return events
+
+            # Map-reduce answers only exist once every partition is back: one "token" event
+            partitions = map_reduce_partitions(k_value, final_context_list)
+            if partitions:
+                answer_stream = _single_delta(amap_reduce_answer(final_context_list, payload.query, partitions))
+            else:
+                answer_stream = astream_llm(context_str, payload.query)
+
+            llm_start = time.perf_counter()
+            first_token = True
+            async for delta in answer_stream:
+                if first_token:
+                    record_stage("llm_first_token", time.perf_counter() - llm_start)
+                    first_token = False
+                yield sse_event("token", {"text": delta})
+                for event in emit_sources(parser.feed(delta)):
+                    yield event
+
+            for event in emit_sources(parser.close()):
+                yield event
+            record_stage("llm_stream", time.perf_counter() - llm_start)
+            await remember_answer(payload.query, final_context_list, parser.answer, sources, version)
+
+            processing_time = time.time() - start
+            registry.observe(REQUEST_SECONDS, processing_time, endpoint="chat_stream")
+            yield sse_event("done", {
+                "answer": parser.answer,
+                "sources": sources,
+                "processing_time": processing_time,
+                "cached": False,
+                "timings": timings if payload.include_timings else None
+            })
+        except Exception as e:
+            registry.inc(ERRORS, where="chat_stream")
+            print(f"CRITICAL ERROR in chat stream: {str(e)}")
+            yield sse_event("error", {"detail": f"Error calling AI: {str(e)}"})
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no" # Don't let nginx buffer the stream
+    return response
+
+@api.post("/chat/batch")
+async def chat_batch_endpoint(request, payload: BatchChatIn):
+    """
+    Answers a checklist of questions with shared retrieval (see batch.py).
+    Server-sent events: "result" per question as it finishes (/chat body plus
+    "index" and "query", or "index", "query" and "error"), then "done".
+    """
+    if len(payload.queries) > settings.BATCH_MAX_QUESTIONS:
+        raise ValueError(f"Too many questions. Maximum is {settings.BATCH_MAX_QUESTIONS} per request; use `manage.py chat_batch` for more.")
+
+    async def event_stream():
+        start = time.time()
+        try:
+            async for result in answer_batch(payload.queries, payload.filter_dict()):
+                yield sse_event("result", result)
+            processing_time = time.time() - start
+            registry.observe(REQUEST_SECONDS, processing_time, endpoint="chat_batch")
+            yield sse_event("done", {"count": len(payload.queries), "processing_time": processing_time})
+        except Exception as e:
+            registry.inc(ERRORS, where="chat_batch")
+            print(f"CRITICAL ERROR in chat batch: {str(e)}")
+            yield sse_event("error", {"detail": f"Error calling AI: {str(e)}"})
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+@api.get("/metrics")
+def metrics_endpoint(request):
+    """
+    Stage latency histograms, LLM token counts, external-call retries and errors
+    of this process, in the Prometheus text format.
+    """
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Registers the Document signal handlers that invalidate cached retrievals
+        from . import cache  # noqa: F401
+        from .db_setup import install_extensions, setup_database
+        pre_migrate.connect(install_extensions, sender=self)
+        post_migrate.connect(setup_database, sender=self)
@@ -0,0 +1,103 @@
+# api/batch.py
+# Checklist mode: many questions over the same corpus (and filters) at once.
+# Retrieval is shared (one embedding pass, one search statement); answers run
+# concurrently and are yielded as they finish.
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .cache import corpus_version
+from .services import (
+    adetermine_search_depth, aget_query_embeddings, asearch_hybrid_batch, load_chunk_embeddings
+)
+from .chat import (
+    _broad_summary_candidates, select_diverse_chunks, build_context, agenerate_answer,
+    parse_llm_response, build_sources, find_cached_answer, remember_answer
+)
+from .metrics import registry, span, ERRORS
+
+
+async def prepare_batch(queries: list, filters: dict = None, version: str = None, semaphore=None) -> list:
+    """
+    prepare_context for every query: [(k_value, final_context_list, context_str), ...].
+    Intent analysis (an LLM call each in "llm" mode) runs under `semaphore`
+    (default: BATCH_LLM_CONCURRENCY at a time).
+    """
+    semaphore = semaphore or asyncio.Semaphore(settings.BATCH_LLM_CONCURRENCY)
+
+    async def search_depth(query: str) -> int:
+        async with semaphore:
+            return await adetermine_search_depth(query)
+
+    with span("intent_analysis"):
+        k_values = await asyncio.gather(*(search_depth(q) for q in queries))
+
+    # Broad questions read the summary tier, one summary search each
+    tiered = await asyncio.gather(*(
+        _broad_summary_candidates(q, k, filters, version) for q, k in zip(queries, k_values)
+    ))
+
+    pending = [i for i, candidates in enumerate(tiered) if not candidates]
+    raw = dict(zip(pending, await asearch_hybrid_batch(
+        [queries[i] for i in pending], [k_values[i] * 3 for i in pending], filters, version
+    )))
+
+    # MMR per question: one question's candidate embeddings in memory at a time
+    # (a broad question alone has up to 1800 of them)
+    query_vecs = dict(zip(pending, await aget_query_embeddings([queries[i] for i in pending])))
+
+    prepared = []
+    for i, k_value in enumerate(k_values):
+        if tiered[i]:
+            final_context_list = tiered[i]
+        else:
+            with span("embedding_load"):
+                embeddings = await sync_to_async(load_chunk_embeddings)([res.id for res in raw[i]])
+            with span("diversity_selection"):
+                final_context_list = select_diverse_chunks(raw[i], k_value, query_vecs[i], embeddings)
+        with span("context_build"):
+            prepared.append((k_value, final_context_list, build_context(final_context_list)))
+    return prepared
+
+
+async def answer_batch(queries: list, filters: dict = None):
+    """
+    Yields one result per query as soon as its answer is ready (any order):
+    {"index", "query", "answer", "sources", "cached", "processing_time"}, or
+    {"index", "query", "error"}. At most BATCH_LLM_CONCURRENCY questions are answered
+    at a time (map-reduce questions fan out further, see MAP_REDUCE_CONCURRENCY).
+    """
+    start = time.time()
+    version = await sync_to_async(corpus_version)() # One lookup for the whole batch
+    semaphore = asyncio.Semaphore(settings.BATCH_LLM_CONCURRENCY)
+    prepared = await prepare_batch(queries, filters, version, semaphore)
+
+    async def answer_one(index: int):
+        query = queries[index]
+        k_value, final_context_list, context_str = prepared[index]
+        async with semaphore:
+            try:
+                cached = await find_cached_answer(query, final_context_list, version)
+                if cached:
+                    answer, sources = cached["answer"], cached["sources"]
+                else:
+                    raw_answer, _ = await agenerate_answer(query, k_value, final_context_list, context_str)
+                    answer, source_reasoning_map = parse_llm_response(raw_answer)
+                    sources = build_sources(final_context_list, source_reasoning_map)
+                    await remember_answer(query, final_context_list, answer, sources, version)
+            except Exception as e:
+                registry.inc(ERRORS, where="chat_batch")
+                print(f"⚠️ Batch question {index} failed: {e}")
+                return {"index": index, "query": query, "error": str(e)}
+
+        return {
+            "index": index,
+            "query": query,
+            "answer": answer,
+            "sources": sources,
+            "cached": bool(cached),
+            "processing_time": time.time() - start # Since the batch started
+        }
+
+    for result in asyncio.as_completed([answer_one(i) for i in range(len(queries))]):
+        yield await result
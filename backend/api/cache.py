@@ -0,0 +1,238 @@
+# api/cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Document, DocumentChunk, DocumentSummary
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU with a per-entry TTL.
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class QueryCache:
+    """
+    Two-level cache for the /chat hot path.
+    L1 is the in-process LRU. L2 is an optional Django cache alias
+    (settings.QUERY_CACHE_BACKEND, e.g. Redis) shared by all workers.
+    """
+    def __init__(self, max_entries: int, ttl: float, backend_alias: str = None):
+        self.local = LRUCache(max_entries, ttl)
+        self.ttl = ttl
+        self.backend_alias = backend_alias
+
+    @property
+    def shared(self):
+        return caches[self.backend_alias] if self.backend_alias else None
+
+    @staticmethod
+    def make_key(namespace: str, *parts) -> str:
+        raw = "|".join(str(p) for p in parts)
+        return f"qc:{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(key, _MISSING)
+            if value is not _MISSING:
+                self.local.set(key, value)
+                return value
+
+        return default
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value, timeout=self.ttl)
+
+    def clear(self):
+        self.local.clear()
+
+
+query_cache = QueryCache(
+    max_entries=settings.QUERY_CACHE_MAX_ENTRIES,
+    ttl=settings.QUERY_CACHE_TTL,
+    backend_alias=settings.QUERY_CACHE_BACKEND
+)
+
+
+class SemanticAnswerCache:
+    """
+    In-process LRU of /chat answers for near-duplicate questions.
+    A hit needs the exact same retrieved chunk-id set (so the LLM would see the
+    same context) and a query embedding with cosine similarity >= threshold.
+    Entries are bucketed by chunk-id set, so a lookup only compares a few vectors.
+    Everything is dropped when the corpus version changes.
+    """
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries = OrderedDict() # entry_id -> (chunk_ids, unit query vector, value)
+        self._by_chunks = {} # chunk_ids -> {entry_id, ...}
+        self._version = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vec):
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _sync_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._by_chunks.clear()
+            self._version = version
+
+    def get(self, query_vec, chunk_ids, version):
+        if self.max_entries <= 0:
+            return None
+        chunk_key = frozenset(chunk_ids)
+        vec = self._unit(query_vec)
+
+        with self._lock:
+            self._sync_version(version)
+            best_id, best_similarity = None, self.threshold
+            for entry_id in self._by_chunks.get(chunk_key, ()):
+                similarity = float(np.dot(vec, self._entries[entry_id][1]))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                return None
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][2]
+
+    def set(self, query_vec, chunk_ids, version, value):
+        if self.max_entries <= 0:
+            return
+        chunk_key = frozenset(chunk_ids)
+        vec = self._unit(query_vec)
+
+        with self._lock:
+            self._sync_version(version)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (chunk_key, vec, value)
+            self._by_chunks.setdefault(chunk_key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                old_id, (old_key, _, _) = self._entries.popitem(last=False)
+                bucket = self._by_chunks[old_key]
+                bucket.discard(old_id)
+                if not bucket:
+                    del self._by_chunks[old_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_chunks.clear()
+
+
+answer_cache = SemanticAnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    threshold=settings.ANSWER_CACHE_THRESHOLD
+)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Cache key form of a user query: case and whitespace insensitive.
+    """
+    return " ".join(query.lower().split())
+
+
+# --- Retrieval invalidation ---
+# Retrieval entries are keyed by a corpus version, so finishing an ingest or
+# deleting a Document makes every cached (query, k) -> chunk ids entry unreachable.
+
+CORPUS_VERSION_KEY = "qc:corpus_version"
+
+def corpus_version() -> str:
+    """
+    Current corpus version. With a shared backend this is a counter bumped on
+    ingest (by whichever process ingests); otherwise it is read from the DB:
+    max chunk id and max summary id (index-only) + document count, instead of a
+    full hybrid search. Summary rebuilds insert new rows, so they count too.
+    """
+    shared = query_cache.shared
+    if shared is not None:
+        version = shared.get(CORPUS_VERSION_KEY)
+        if version is None:
+            shared.add(CORPUS_VERSION_KEY, 1, timeout=None)
+            version = shared.get(CORPUS_VERSION_KEY, 1)
+        return f"v{version}"
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT (SELECT max(id) FROM {DocumentChunk._meta.db_table}), "
+            f"(SELECT count(*) FROM {Document._meta.db_table}), "
+            f"(SELECT max(id) FROM {DocumentSummary._meta.db_table})"
+        )
+        max_chunk_id, total_docs, max_summary_id = cursor.fetchone()
+    return f"d{max_chunk_id}-{total_docs}-{max_summary_id}"
+
+
+def invalidate_retrieval_cache():
+    """
+    Called once a Document's chunks are fully inserted, and on Document delete.
+    Other processes notice through corpus_version().
+    """
+    answer_cache.clear()
+    shared = query_cache.shared
+    if shared is not None:
+        try:
+            shared.incr(CORPUS_VERSION_KEY)
+        except ValueError:
+            shared.set(CORPUS_VERSION_KEY, 2, timeout=None)
+
+
+@receiver(post_delete, sender=Document)
+def _document_deleted(sender, instance, **kwargs):
+    invalidate_retrieval_cache()
@@ -0,0 +1,447 @@
+# api/chat.py
+import asyncio
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .services import (
+    asearch_hybrid, aget_query_embedding, create_presigned_urls, adetermine_search_depth,
+    load_chunk_embeddings, acall_llm, DEPLOYMENT_NAME, DEPTH_BROAD
+)
+from .cache import answer_cache
+from .chunking import encoding_for_llm, count_tokens
+from .metrics import registry, span, atimed, ANSWER_CACHE, ERRORS
+from .mmr import mmr_select
+from .summaries import retrieve_summary_tier
+
+SOURCE_HEADER = "### SOURCE:"
+GENERAL_SOURCE = "General Analysis" # The system prompt's "not in these documents" section
+EMPTY_MARKER = "[[EMPTY]]"
+# The system prompt's "no info found" answer, for map-reduce runs where no partition found anything
+NOT_FOUND_ANSWER = (
+    f"{SOURCE_HEADER} {GENERAL_SOURCE}\n[[REASON: Context missing]]\n"
+    "I apologize, but I couldn't find specific information regarding that in the uploaded documents."
+)
+REASON_PATTERN = re.compile(r'\[\[REASON:(.*?)\]\]', re.DOTALL)
+FALLBACK_REASON = "Contextual match found by AI analysis."
+
+# A header is only complete once its line ends
+_HEADER_LINE = re.compile(r'### SOURCE: ([^\n]*)\n')
+_TRAILING_HEADER = re.compile(r'### SOURCE: ([^\n]*)$')
+
+
+async def retrieve_candidates(query: str, filters: dict = None, version: str = None):
+    """
+    Intent analysis + hybrid search. Returns (k_value, candidates, from_summaries).
+    In "llm" mode the GPT depth call runs concurrently with the query embedding and
+    a speculative over-fetch, instead of in front of them.
+    Broad queries read the summary tier (already in packing order, from_summaries=True)
+    instead of k_value * 3 raw chunks, when there is one.
+    `filters` scope the search to a subset of documents (see search.FILTER_KEYS).
+    `version` is the request's corpus_version() (looked up when omitted).
+    """
+    if settings.SEARCH_DEPTH_MODE != "llm":
+        with span("intent_analysis"):
+            k_value = await adetermine_search_depth(query, mode="local")
+        tiered = await _broad_summary_candidates(query, k_value, filters, version)
+        if tiered:
+            return k_value, tiered, True
+        raw_results = await asearch_hybrid(query, top_k=k_value * 3, filters=filters, version=version)
+        return k_value, raw_results, False
+
+    speculative_top_k = settings.SEARCH_SPECULATIVE_K * 3
+    k_value, raw_results = await asyncio.gather(
+        atimed("intent_analysis", adetermine_search_depth(query, mode="llm")),
+        asearch_hybrid(query, top_k=speculative_top_k, filters=filters, version=version),
+    )
+
+    tiered = await _broad_summary_candidates(query, k_value, filters, version)
+    if tiered:
+        return k_value, tiered, True
+
+    # Broad query needs more than we speculatively fetched (embedding is cached by now)
+    if k_value * 3 > speculative_top_k and len(raw_results) >= speculative_top_k:
+        raw_results = await asearch_hybrid(query, top_k=k_value * 3, filters=filters, version=version)
+
+    return k_value, raw_results[:k_value * 3], False
+
+
+async def _broad_summary_candidates(query: str, k_value: int, filters: dict = None, version: str = None):
+    if k_value < DEPTH_BROAD or not settings.SUMMARY_TIER_ENABLED:
+        return None
+    return await retrieve_summary_tier(query, filters, version)
+
+
+def select_diverse_chunks(raw_results: list, k_value: int, query_vec, embeddings: list) -> list:
+    """
+    DIVERSITY RE-RANKING (The Fix for "Missed Files")
+    Goal: Fill the context with relevant chunks that say different things.
+    Logic: Maximal Marginal Relevance over the candidate embeddings (MMR_LAMBDA), at most
+    MMR_PER_DOCUMENT_CAP chunks per document, near-duplicates (boilerplate) dropped.
+    A chunk that repeats an already selected one scores low, so other documents get their turn.
+    """
+    picked = mmr_select(
+        query_vec,
+        embeddings,
+        [res.document_id for res in raw_results],
+        k_value,
+        lambda_=settings.MMR_LAMBDA,
+        per_group_cap=settings.MMR_PER_DOCUMENT_CAP,
+        duplicate_threshold=settings.MMR_DUPLICATE_THRESHOLD
+    )
+    return [raw_results[i] for i in picked]
+
+
+def _context_entry(c) -> str:
+    # Tag content so LLM knows where it came from
+    return f"[[SOURCE: {c.document.title}]]\n{c.text_content}\n\n"
+
+
+def build_context(final_context_list: list, token_budget: int = None) -> str:
+    """
+    CONTEXT CONSTRUCTION (With Safety Pruning)
+    Packs chunks in rank order until the token budget (LLM_CONTEXT_TOKENS,
+    counted with the deployment's tokenizer) is full.
+    """
+    token_budget = token_budget or settings.LLM_CONTEXT_TOKENS
+    encoding = encoding_for_llm(DEPLOYMENT_NAME)
+    context_chunks = []
+    used_tokens = 0
+
+    for i, c in enumerate(final_context_list):
+        chunk_text = _context_entry(c)
+        chunk_tokens = count_tokens(chunk_text, encoding)
+
+        # STOP once the next chunk doesn't fit (chunks are similar in size, so
+        # scanning the rest would only waste time)
+        if used_tokens + chunk_tokens > token_budget:
+            print(f"⚠️ Context budget ({token_budget} tokens) reached. Pruning {len(final_context_list) - i} remaining chunks.")
+            break
+
+        context_chunks.append(chunk_text)
+        used_tokens += chunk_tokens
+
+    return "".join(context_chunks)
+
+
+def partition_context(final_context_list: list, token_budget: int = None) -> list:
+    """
+    Splits the candidates into partitions that each fit one LLM context: whole documents
+    are packed together (in rank order of their best chunk); a document larger than the
+    budget spans several partitions. Returns [[chunk, ...], ...].
+    """
+    token_budget = token_budget or settings.LLM_CONTEXT_TOKENS
+    encoding = encoding_for_llm(DEPLOYMENT_NAME)
+
+    by_document = {}
+    for c in final_context_list:
+        by_document.setdefault(c.document_id, []).append(c)
+
+    partitions, current, used = [], [], 0
+    for chunks in by_document.values():
+        for c in chunks:
+            tokens = count_tokens(_context_entry(c), encoding)
+            if current and used + tokens > token_budget:
+                partitions.append(current)
+                current, used = [], 0
+            current.append(c)
+            used += tokens
+    if current:
+        partitions.append(current)
+    return partitions
+
+
+def map_reduce_partitions(k_value: int, final_context_list: list):
+    """
+    The partitions to map over when ANSWER_MODE calls for map-reduce, else None
+    ("auto": broad queries whose candidates overflow one context).
+    """
+    mode = settings.ANSWER_MODE
+    if mode == "single" or (mode == "auto" and k_value < DEPTH_BROAD):
+        return None
+    partitions = partition_context(final_context_list)
+    if mode == "auto" and len(partitions) < 2:
+        return None
+    return partitions
+
+
+def _iter_sections(raw_answer: str):
+    """
+    (title, body) per "### SOURCE:" section; text before the first header is dropped.
+    """
+    headers = list(_HEADER_LINE.finditer(raw_answer + "\n"))
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(raw_answer)
+        yield header.group(1).strip(), raw_answer[header.end():end].strip()
+
+
+def reduce_partial_answers(partials: list) -> str:
+    """
+    Merges map outputs into one "### SOURCE:" answer: one section per document (bodies
+    of a document split across partitions are joined, keeping the first [[REASON:]]).
+    "General Analysis" (nothing found) sections only survive if nothing else was found.
+    A partition without any section failed (e.g. acall_llm's "Error ..." text): it is
+    logged and counted. If every partition failed the first error is returned, and if
+    nothing was found anywhere the standard General Analysis answer.
+    """
+    merged = {}
+    failed, empty = [], 0
+    for raw in partials:
+        sections = list(_iter_sections(raw))
+        if not sections:
+            failed.append(raw.strip())
+            continue
+        found = False
+        for title, body in sections:
+            if not body or EMPTY_MARKER in body:
+                continue
+            found = True
+            if title in merged:
+                body = REASON_PATTERN.sub("", body).strip()
+            merged.setdefault(title, []).append(body)
+        empty += not found
+
+    if failed:
+        registry.inc(ERRORS, len(failed), where="map_reduce")
+        print(f"⚠️ Map-reduce: {len(failed)}/{len(partials)} partitions failed: {failed[0][:200]!r}")
+    if empty:
+        print(f"🗺️ Map-reduce: {empty}/{len(partials)} partitions had nothing relevant.")
+
+    if len(merged) > 1:
+        merged.pop(GENERAL_SOURCE, None)
+    if not merged:
+        if len(failed) == len(partials) and any(failed):
+            return next(error for error in failed if error)
+        return NOT_FOUND_ANSWER
+    return "\n\n".join(f"{SOURCE_HEADER} {title}\n" + "\n\n".join(bodies) for title, bodies in merged.items())
+
+
+async def amap_reduce_answer(final_context_list: list, query: str, partitions: list = None) -> str:
+    """
+    Map: one acall_llm per partition, at most MAP_REDUCE_CONCURRENCY in flight, so wall
+    time grows with partitions / concurrency. Reduce: reduce_partial_answers.
+    Returns raw text in the usual format (feed it to parse_llm_response).
+    """
+    partitions = partitions or partition_context(final_context_list)
+    if len(partitions) > settings.MAP_REDUCE_MAX_PARTITIONS:
+        print(f"⚠️ Map-reduce: {len(partitions)} partitions, answering from the first {settings.MAP_REDUCE_MAX_PARTITIONS}.")
+        partitions = partitions[:settings.MAP_REDUCE_MAX_PARTITIONS]
+
+    semaphore = asyncio.Semaphore(settings.MAP_REDUCE_CONCURRENCY)
+
+    async def map_partition(partition):
+        async with semaphore:
+            return await acall_llm(build_context(partition), query)
+
+    with span("llm_map"):
+        partials = await asyncio.gather(*(map_partition(p) for p in partitions))
+    with span("llm_reduce"):
+        return reduce_partial_answers(partials)
+
+
+async def agenerate_answer(query: str, k_value: int, final_context_list: list, context_str: str):
+    """
+    Step 5 of /chat: raw LLM text, from one call over context_str or map-reduce.
+    Returns (raw_answer, map_reduced).
+    """
+    partitions = map_reduce_partitions(k_value, final_context_list)
+    if partitions:
+        print(f"🗺️ Map-reduce over {len(partitions)} partitions.")
+        return await amap_reduce_answer(final_context_list, query, partitions), True
+    return await acall_llm(context_str, query), False
+
+
+async def prepare_context(query: str, filters: dict = None, version: str = None):
+    """
+    Steps 1-4 of /chat. Returns (k_value, final_context_list, context_str).
+    """
+    # 1. DYNAMIC DEPTH ANALYSIS + 2. HYBRID SEARCH (OVERSAMPLING)
+    # Depth is e.g. 10, 50 or 600 chunks. We fetch 3x the required chunks. Why? Because if
+    # Doc A has 50 matches and Doc B has 1, a standard search might fill up with only Doc A.
+    # We need extra candidates for diversity.
+    k_value, raw_results, from_summaries = await retrieve_candidates(query, filters, version)
+    print(f"🧠 Query Intent Analysis: Retrieving Top-{k_value} chunks.")
+
+    if from_summaries:
+        # Summaries first, then drill-down chunks; the token budget bounds the rest
+        print(f"📚 Broad query: answering from the summary tier ({len(raw_results)} entries).")
+        with span("context_build"):
+            context_str = build_context(raw_results)
+        return k_value, raw_results, context_str
+
+    # 3. DIVERSITY RE-RANKING
+    query_vec = await aget_query_embedding(query) # Cached by the search
+    with span("embedding_load"):
+        embeddings = await sync_to_async(load_chunk_embeddings)([res.id for res in raw_results])
+    with span("diversity_selection"):
+        final_context_list = select_diverse_chunks(raw_results, k_value, query_vec, embeddings)
+
+    # 4. CONTEXT CONSTRUCTION
+    with span("context_build"):
+        context_str = build_context(final_context_list)
+
+    return k_value, final_context_list, context_str
+
+
+class AnswerParser:
+    """
+    Incremental version of the "### SOURCE:" / "[[REASON: ...]]" parsing.
+    feed() accepts text as it streams in and returns the sections that closed,
+    as (title, reason) pairs. close() flushes the last open section.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.current_title = None
+        self.clean_answer_parts = []
+        self.source_reasoning_map = {} # Stores "DocTitle" -> "Reason"
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        closed = []
+
+        while True:
+            match = _HEADER_LINE.search(self.buffer)
+            if not match:
+                break
+            # Everything before the new header belongs to the previous section
+            section = self._close_section(self.buffer[:match.start()])
+            if section:
+                closed.append(section)
+            self._open_section(match.group(1))
+            self.buffer = self.buffer[match.end():]
+
+        return closed
+
+    def close(self) -> list:
+        closed = []
+        body = self.buffer
+        trailing = _TRAILING_HEADER.search(body)
+        if trailing:
+            section = self._close_section(body[:trailing.start()])
+            if section:
+                closed.append(section)
+            self._open_section(trailing.group(1))
+            body = ""
+
+        section = self._close_section(body)
+        if section:
+            closed.append(section)
+        self.buffer = ""
+        return closed
+
+    @property
+    def answer(self) -> str:
+        return "\n".join(self.clean_answer_parts)
+
+    def _open_section(self, title: str):
+        self.current_title = title.strip()
+        self.clean_answer_parts.append(f"{SOURCE_HEADER} {title}") # Keep header
+
+    def _close_section(self, body: str):
+        text_body = body.strip()
+        if not self.current_title or not text_body:
+            return None
+
+        title = self.current_title
+        self.current_title = None
+
+        # Filter empty blocks
+        if EMPTY_MARKER in text_body or len(text_body) < 10:
+            if self.clean_answer_parts and self.clean_answer_parts[-1].startswith(SOURCE_HEADER):
+                self.clean_answer_parts.pop()
+            return None
+
+        # Extract Reasoning Tag
+        reason_match = REASON_PATTERN.search(text_body)
+        if reason_match:
+            reason_text = reason_match.group(1).strip()
+            # Clean the text for display
+            self.clean_answer_parts.append(text_body.replace(reason_match.group(0), "").strip())
+        else:
+            # Fallback
+            reason_text = FALLBACK_REASON
+            self.clean_answer_parts.append(text_body)
+
+        self.source_reasoning_map[title] = reason_text
+        return title, reason_text
+
+
+def parse_llm_response(raw_llm_response: str):
+    """
+    INTELLIGENT PARSING LOGIC: returns (clean_answer, {title: reason}).
+    """
+    with span("response_parsing"):
+        parser = AnswerParser()
+        parser.feed(raw_llm_response)
+        parser.close()
+    return parser.answer, parser.source_reasoning_map
+
+
+def build_sources(final_context_list: list, source_reasoning_map: dict) -> list:
+    """
+    FORMAT SOURCES (Attach AI Reason) for every cited document.
+    """
+    seen_urls = set()
+    sources = []
+
+    # Sign once per distinct document, not once per cited chunk
+    file_urls = create_presigned_urls(
+        res.document.s3_key for res in final_context_list if res.document.title in source_reasoning_map
+    )
+
+    for res in final_context_list:
+        if res.document.title in source_reasoning_map:
+            unique_key = f"{res.document.title}-{res.page}"
+            if unique_key not in seen_urls:
+                clean_snippet = res.text_content[:600].replace("\n", " ") + "..."
+
+                # Use reason from map, or fallback to score-based logic
+                ai_reason = source_reasoning_map.get(res.document.title, "Matched relevant context.")
+
+                sources.append({
+                    "title": res.document.title,
+                    "page": res.page,
+                    "score": getattr(res, 'score', 0.0),
+                    "file_url": file_urls[res.document.s3_key],
+                    "snippet": clean_snippet,
+                    "reason": ai_reason # <--- Dynamic LLM Reason
+                })
+                seen_urls.add(unique_key)
+
+    return sources
+
+
+async def _answer_cache_key(query: str, final_context_list: list):
+    # The query embedding is already in the query cache from the hybrid search
+    query_vec = await aget_query_embedding(query)
+    # Summaries and chunks have separate id sequences
+    return query_vec, [(res._meta.model_name, res.id) for res in final_context_list]
+
+
+async def find_cached_answer(query: str, final_context_list: list, version: str):
+    """
+    {"answer", "sources"} of an earlier near-duplicate question with the same
+    retrieved chunks (at the same corpus `version`), or None.
+    File URLs are re-signed (the stored ones may be old).
+    """
+    if answer_cache.max_entries <= 0 or not final_context_list:
+        return None
+
+    query_vec, chunk_ids = await _answer_cache_key(query, final_context_list)
+    cached = answer_cache.get(query_vec, chunk_ids, version)
+    registry.inc(ANSWER_CACHE, result="hit" if cached else "miss")
+    if cached is None:
+        return None
+
+    s3_keys = {res.document.title: res.document.s3_key for res in final_context_list}
+    file_urls = create_presigned_urls(s3_keys.values())
+    return {
+        "answer": cached["answer"],
+        "sources": [dict(src, file_url=file_urls[s3_keys[src["title"]]]) for src in cached["sources"]],
+    }
+
+
+async def remember_answer(query: str, final_context_list: list, answer: str, sources: list, version: str):
+    if answer_cache.max_entries <= 0 or not final_context_list or not sources:
+        return # Don't cache failures or "nothing found"
+    query_vec, chunk_ids = await _answer_cache_key(query, final_context_list)
+    answer_cache.set(query_vec, chunk_ids, version, {"answer": answer, "sources": sources})
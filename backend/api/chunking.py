@@ -0,0 +1,73 @@
+# api/chunking.py
+from functools import lru_cache
+import tiktoken
+from django.conf import settings
+
+# Pages shorter than this are treated as empty (cover scans, blank pages)
+MIN_PAGE_CHARS = 50
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str):
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=None)
+def encoding_for_llm(model_name: str):
+    """
+    Tokenizer of the chat deployment. Azure deployment names are arbitrary,
+    so unknown names fall back to settings.LLM_TOKENIZER_FALLBACK.
+    """
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return get_encoding(settings.LLM_TOKENIZER_FALLBACK)
+
+
+def chunk_page(text: str, max_tokens: int = None, overlap: int = None) -> list:
+    """
+    Splits one page into token-sized windows that overlap by `overlap` tokens.
+    Returns [(char_start, char_end, chunk_text), ...]; offsets index into `text`.
+    """
+    max_tokens = max_tokens or settings.CHUNK_TOKENS
+    overlap = settings.CHUNK_OVERLAP_TOKENS if overlap is None else overlap
+    if overlap >= max_tokens:
+        raise ValueError("CHUNK_OVERLAP_TOKENS must be smaller than CHUNK_TOKENS")
+
+    encoding = get_encoding(settings.CHUNK_TOKENIZER)
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return [(0, len(text), text)]
+
+    # offsets[i] = char position where token i starts
+    decoded, offsets = encoding.decode_with_offsets(tokens)
+    offsets.append(len(decoded))
+
+    windows = []
+    step = max_tokens - overlap
+    for start in range(0, len(tokens), step):
+        end = min(start + max_tokens, len(tokens))
+        char_start, char_end = offsets[start], offsets[end]
+        windows.append((char_start, char_end, decoded[char_start:char_end]))
+        if end == len(tokens):
+            break
+
+    return windows
+
+
+def chunk_pages(pages: list) -> list:
+    """
+    [(page_number, text), ...] -> [(page_number, char_start, char_end, chunk_text), ...]
+    in document order. Empty pages are skipped.
+    """
+    chunks = []
+    for page_number, text in pages:
+        if len(text) <= MIN_PAGE_CHARS: # Ignore empty pages
+            continue
+        for char_start, char_end, chunk_text in chunk_page(text):
+            chunks.append((page_number, char_start, char_end, chunk_text))
+    return chunks
+
+
+def count_tokens(text: str, encoding) -> int:
+    return len(encoding.encode_ordinary(text))
@@ -0,0 +1,123 @@
+# api/db_setup.py
+import re
+from django.conf import settings
+from django.db import connection
+from .models import DocumentChunk
+
+CHUNK_TABLE = DocumentChunk._meta.db_table
+
+
+def _text_search_config() -> str:
+    config = settings.SEARCH_TEXT_CONFIG
+    # Interpolated into DDL below, so only allow plain identifiers (e.g. "english")
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*", config):
+        raise ValueError(f"Invalid SEARCH_TEXT_CONFIG: {config!r}")
+    return config
+
+
+def install_search_vector_trigger(**kwargs):
+    """
+    Keeps DocumentChunk.search_vector in sync at write time, so ingestion no longer
+    needs a post-insert UPDATE. Idempotent: runs after every `migrate`.
+    Also backfills rows that were inserted before the trigger existed.
+    """
+    config = _text_search_config()
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {CHUNK_TABLE}_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('{config}'::regconfig, COALESCE(NEW.text_content, ''));
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+        """)
+        cursor.execute(f"DROP TRIGGER IF EXISTS {CHUNK_TABLE}_search_vector_trg ON {CHUNK_TABLE};")
+        cursor.execute(f"""
+            CREATE TRIGGER {CHUNK_TABLE}_search_vector_trg
+            BEFORE INSERT OR UPDATE OF text_content ON {CHUNK_TABLE}
+            FOR EACH ROW EXECUTE FUNCTION {CHUNK_TABLE}_search_vector_update();
+        """)
+        cursor.execute(f"""
+            UPDATE {CHUNK_TABLE}
+            SET search_vector = to_tsvector('{config}'::regconfig, COALESCE(text_content, ''))
+            WHERE search_vector IS NULL;
+        """)
+
+
+# Compact HNSW expression indexes for VECTOR_SEARCH_MODE. Being expression indexes,
+# they cover existing rows when built and new rows automatically; no extra columns.
+# Names carry every setting the expression depends on: CREATE INDEX IF NOT EXISTS
+# only compares names, and an index whose expression no longer matches the query
+# is silently ignored (sequential scan).
+QUANTIZED_INDEXES = {
+    "halfvec": (
+        f"{CHUNK_TABLE}_halfvec_idx",
+        "(embedding::halfvec({dims})) halfvec_cosine_ops"
+    ),
+    "binary": (
+        f"{CHUNK_TABLE}_binary_idx",
+        "(binary_quantize(embedding)::bit({dims})) bit_hamming_ops"
+    ),
+    "truncated": (
+        f"{CHUNK_TABLE}_coarse{{coarse}}_idx",
+        "(subvector(embedding, 1, {coarse})::vector({coarse})) vector_cosine_ops"
+    ),
+}
+
+
+def quantized_index(mode: str) -> tuple:
+    """
+    (name, expression) of the mode's index under the current settings.
+    """
+    name, expression = QUANTIZED_INDEXES[mode]
+    values = {
+        "dims": DocumentChunk._meta.get_field('embedding').dimensions,
+        "coarse": settings.VECTOR_COARSE_DIMENSIONS,
+    }
+    return name.format(**values), expression.format(**values)
+
+
+def install_quantized_index(mode: str = None, concurrently: bool = False):
+    """
+    Builds the HNSW index the given (default: configured) vector mode searches.
+    "full" uses the model's cosine_idx, so there is nothing to build.
+    A truncated-mode index for another VECTOR_COARSE_DIMENSIONS is dropped.
+    """
+    mode = mode or settings.VECTOR_SEARCH_MODE
+    if mode not in QUANTIZED_INDEXES:
+        return None
+
+    name, expression = quantized_index(mode)
+    with connection.cursor() as cursor:
+        if mode == "truncated":
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname LIKE %s AND indexname <> %s",
+                [CHUNK_TABLE, f"{CHUNK_TABLE}\\_coarse%\\_idx", name]
+            )
+            for (stale,) in cursor.fetchall():
+                print(f"🗑️ Dropping {stale} (built for another VECTOR_COARSE_DIMENSIONS).")
+                cursor.execute(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {stale};")
+        cursor.execute(f"""
+            CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS {name}
+            ON {CHUNK_TABLE} USING hnsw ({expression})
+            WITH (m = 16, ef_construction = 64);
+        """)
+    return name
+
+
+def install_extensions(sender, **kwargs):
+    """
+    pre_migrate hook: pgvector must exist before the VectorField tables are created
+    (fresh databases, e.g. the one `manage.py benchmark` creates).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+
+
+def setup_database(sender, **kwargs):
+    """
+    post_migrate hook for the api app: installs DB objects that Django
+    migrations can't express (triggers, expression indexes).
+    """
+    install_search_vector_trigger()
+    install_quantized_index()
@@ -0,0 +1,171 @@
+# api/fakes.py
+# Local stand-ins for Bedrock (Titan), Azure OpenAI and S3, used by the
+# `benchmark` command. Deterministic, no network, optional injected latency.
+# install_fake_backends() swaps them into api.services for the current process.
+import asyncio
+import hashlib
+import re
+import time
+from types import SimpleNamespace
+import numpy as np
+
+_WORD = re.compile(r"[a-z0-9]+")
+_SOURCE_TAG = re.compile(r"\[\[SOURCE: ([^\]]+)\]\]")
+
+# Positions each word is hashed into (signed feature hashing)
+_HASHES_PER_WORD = 4
+
+
+def fake_embedding(text: str, dimensions: int) -> list:
+    """
+    Hashed bag of words, L2-normalized. Same text -> same vector, and texts that
+    share words are close, so vector search returns meaningful neighbours.
+    """
+    vec = np.zeros(dimensions, dtype=np.float32)
+    for word in _WORD.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4 * _HASHES_PER_WORD).digest()
+        for i in range(_HASHES_PER_WORD):
+            h = int.from_bytes(digest[4 * i:4 * i + 4], "little")
+            vec[h % dimensions] += 1.0 if h & 0x80000000 else -1.0
+
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        vec[0] = 1.0 # Empty text still needs a valid cosine direction
+        norm = 1.0
+    return (vec / norm).tolist()
+
+
+def fake_answer(messages: list) -> str:
+    """
+    An answer in the "### SOURCE:" / "[[REASON: ...]]" format, citing up to
+    three of the documents tagged in the context.
+    """
+    prompt = messages[-1]["content"]
+    question = prompt.rsplit("Question:", 1)[-1].strip()
+
+    titles = []
+    for title in _SOURCE_TAG.findall(prompt):
+        if title not in titles:
+            titles.append(title)
+        if len(titles) == 3:
+            break
+    if not titles:
+        return "The provided documents do not contain information about this question."
+
+    sections = [
+        f"### SOURCE: {title}\n"
+        f"This document addresses \"{question}\" in its relevant clauses. "
+        f"[[REASON: Mentions the terms asked about in {title}.]]"
+        for title in titles
+    ]
+    return "\n\n".join(sections)
+
+
+def _usage(prompt_chars: int, completion: str):
+    # ~4 characters per token is close enough for a benchmark
+    return SimpleNamespace(prompt_tokens=prompt_chars // 4, completion_tokens=len(completion) // 4)
+
+
+class FakeChatCompletions:
+    """
+    chat.completions of the (Async)AzureOpenAI client. `latency` is the total
+    completion time; streamed answers spread it over their deltas.
+    """
+    def __init__(self, latency: float, depth_prompt: str, is_async: bool):
+        self.latency = latency
+        self.depth_prompt = depth_prompt
+        self.is_async = is_async
+
+    def _complete(self, messages: list) -> str:
+        if messages[0]["content"] == self.depth_prompt:
+            return "10"
+        return fake_answer(messages)
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        answer = self._complete(messages)
+        prompt_chars = sum(len(m["content"]) for m in messages)
+
+        if not self.is_async:
+            time.sleep(self.latency)
+            return self._response(answer, prompt_chars)
+        if stream:
+            return self._stream(answer, prompt_chars)
+        return self._acreate(answer, prompt_chars)
+
+    def _response(self, answer: str, prompt_chars: int):
+        message = SimpleNamespace(content=answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=_usage(prompt_chars, answer))
+
+    async def _acreate(self, answer: str, prompt_chars: int):
+        await asyncio.sleep(self.latency)
+        return self._response(answer, prompt_chars)
+
+    async def _stream(self, answer: str, prompt_chars: int):
+        async def events():
+            pieces = [answer[i:i + 16] for i in range(0, len(answer), 16)]
+            for piece in pieces:
+                await asyncio.sleep(self.latency / len(pieces))
+                delta = SimpleNamespace(content=piece)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+            yield SimpleNamespace(choices=[], usage=_usage(prompt_chars, answer))
+        return events()
+
+
+class FakeOpenAIClient:
+    def __init__(self, latency: float, depth_prompt: str, is_async: bool):
+        self.chat = SimpleNamespace(completions=FakeChatCompletions(latency, depth_prompt, is_async))
+
+
+class FakeS3Client:
+    """
+    The parts of the boto3 S3 client we use. Uploads read the whole file (so disk
+    I/O is still measured) and then sleep `latency` seconds.
+    """
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.uploaded = {} # key -> size in bytes
+
+    def upload_file(self, filename, bucket, key, Config=None):
+        size = 0
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                size += len(block)
+        time.sleep(self.latency)
+        self.uploaded[key] = size
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None):
+        self.uploaded[key] = len(fileobj.read())
+        time.sleep(self.latency)
+
+    def generate_presigned_url(self, operation, Params=None, ExpiresIn=3600):
+        return f"https://fake-s3.local/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+def install_fake_backends(embed_latency: float = 0.0, llm_latency: float = 0.0, s3_latency: float = 0.0) -> dict:
+    """
+    Replaces the Titan calls, both Azure OpenAI clients and the S3 client in
+    api.services. Latencies are seconds per call. Returns the installed fakes.
+    """
+    from . import services
+
+    dimensions = services.EMBEDDING_DIMENSIONS
+
+    def invoke_titan(text: str) -> list:
+        time.sleep(embed_latency)
+        return fake_embedding(text, dimensions)
+
+    async def ainvoke_titan(text: str) -> list:
+        await asyncio.sleep(embed_latency)
+        return fake_embedding(text, dimensions)
+
+    fakes = {
+        "s3": FakeS3Client(s3_latency),
+        "llm": FakeOpenAIClient(llm_latency, services.DEPTH_SYSTEM_PROMPT, is_async=True),
+        "llm_sync": FakeOpenAIClient(llm_latency, services.DEPTH_SYSTEM_PROMPT, is_async=False),
+    }
+    services._invoke_titan = invoke_titan
+    services._ainvoke_titan = ainvoke_titan
+    services.azure_async_client = fakes["llm"]
+    services.azure_client = fakes["llm_sync"]
+    services.s3_client = fakes["s3"]
+    return fakes
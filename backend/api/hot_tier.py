@@ -0,0 +1,296 @@
+# api/hot_tier.py
+# Optional in-process vector tier for corpora that fit in RAM (HOT_TIER_ENABLED).
+# Every chunk embedding (L2-normalized, float32 or float16) sits in a flat file
+# under HOT_TIER_DIR, memory-mapped by each worker, so the OS page cache holds
+# one copy for all of them. Searches are exact: one matrix-vector product.
+#
+# Files: meta.json (generation, rows, max chunk id, dims, dtype, stale) plus
+# ids-<gen>.bin, docs-<gen>.bin (int64) and vectors-<gen>.bin (rows x dims).
+# The writer (ingest worker, `manage.py hot_tier`) appends chunks newer than
+# max_id, then swaps meta.json atomically; readers only look at `rows` rows and
+# remap when meta.json changes. Deletes mark the tier stale (readers fall back
+# to Postgres) until the next sync rebuilds it under a new generation.
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Document, DocumentChunk
+from .metrics import registry, span, ERRORS
+
+CHUNK_TABLE = DocumentChunk._meta.db_table
+DIMENSIONS = DocumentChunk._meta.get_field('embedding').dimensions
+
+# Filters the tier can apply itself; anything else goes to Postgres
+SUPPORTED_FILTERS = {"document_ids"}
+
+_SYNC_BATCH = 4096
+_SEARCH_BLOCK = 65536 # float16 rows upcast per step (bounds the temporary copy)
+
+
+def _path(name: str) -> str:
+    return os.path.join(settings.HOT_TIER_DIR, name)
+
+
+def _files(generation: int) -> dict:
+    return {
+        "ids": _path(f"ids-{generation}.bin"),
+        "docs": _path(f"docs-{generation}.bin"),
+        "vectors": _path(f"vectors-{generation}.bin"),
+    }
+
+
+def read_meta():
+    try:
+        with open(_path("meta.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_meta(meta: dict):
+    tmp = _path("meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _path("meta.json")) # Readers see the old or the new file, never half of one
+
+
+@contextmanager
+def _writer_lock():
+    os.makedirs(settings.HOT_TIER_DIR, exist_ok=True)
+    with open(_path("lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX) # One writer across ingest workers
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# --- Writer ---
+
+def _append_rows(files: dict, after_id: int, dtype: str) -> tuple:
+    """
+    Appends every chunk with id > after_id to the generation's files.
+    Returns (rows appended, max id seen).
+    """
+    rows, max_id = 0, after_id
+    chunks = (
+        DocumentChunk.objects
+        .filter(id__gt=after_id)
+        .order_by('id')
+        .values_list('id', 'document_id', 'embedding')
+    )
+    with open(files["ids"], "ab") as ids_out, open(files["docs"], "ab") as docs_out, \
+            open(files["vectors"], "ab") as vectors_out:
+        batch = []
+
+        def flush():
+            ids = np.array([row[0] for row in batch], dtype=np.int64)
+            vectors = np.asarray([row[2] for row in batch], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            ids.tofile(ids_out)
+            np.array([row[1] for row in batch], dtype=np.int64).tofile(docs_out)
+            (vectors / norms).astype(dtype).tofile(vectors_out)
+            batch.clear()
+            return len(ids), int(ids[-1])
+
+        for row in chunks.iterator(chunk_size=_SYNC_BATCH):
+            batch.append(row)
+            if len(batch) == _SYNC_BATCH:
+                added, max_id = flush()
+                rows += added
+        if batch:
+            added, max_id = flush()
+            rows += added
+
+        for out in (ids_out, docs_out, vectors_out):
+            out.flush()
+            os.fsync(out.fileno()) # Data is on disk before meta.json points at it
+    return rows, max_id
+
+
+def _chunks_up_to(max_id: int = None) -> int:
+    with connection.cursor() as cursor:
+        if max_id is None:
+            cursor.execute(f"SELECT count(*) FROM {CHUNK_TABLE}")
+        else:
+            cursor.execute(f"SELECT count(*) FROM {CHUNK_TABLE} WHERE id <= %s", [max_id])
+        return cursor.fetchone()[0]
+
+
+def _rebuild(old_meta) -> dict:
+    generation = (old_meta or {}).get("generation", 0) + 1
+    dtype = settings.HOT_TIER_DTYPE
+    meta = {"generation": generation, "rows": 0, "max_id": 0, "dims": DIMENSIONS, "dtype": dtype, "stale": True}
+
+    # Past HOT_TIER_MAX_ROWS the corpus no longer counts as "hot": stay on Postgres
+    if _chunks_up_to() <= settings.HOT_TIER_MAX_ROWS:
+        files = _files(generation)
+        for path in files.values():
+            open(path, "wb").close()
+        rows, max_id = _append_rows(files, 0, dtype)
+        meta.update(rows=rows, max_id=max_id, stale=False)
+    _write_meta(meta)
+
+    # Readers that still map the old generation keep their open pages (POSIX)
+    if old_meta:
+        for path in _files(old_meta["generation"]).values():
+            if os.path.exists(path):
+                os.remove(path)
+    return meta
+
+
+def sync(rebuild: bool = False) -> dict:
+    """
+    Brings the tier up to date with DocumentChunk and returns its meta.
+    Incremental (new chunk ids only) unless rebuild=True, the tier is stale,
+    or rows committed out of id order / deleted since the last sync.
+    """
+    with _writer_lock(), span("hot_tier_sync"):
+        meta = read_meta()
+        if (rebuild or meta is None or meta["stale"]
+                or meta["dims"] != DIMENSIONS or meta["dtype"] != settings.HOT_TIER_DTYPE):
+            return _rebuild(meta)
+
+        files = _files(meta["generation"])
+        # Drop whatever an interrupted sync appended past the committed rows
+        row_bytes = {"ids": 8, "docs": 8, "vectors": meta["dims"] * np.dtype(meta["dtype"]).itemsize}
+        for name, path in files.items():
+            os.truncate(path, meta["rows"] * row_bytes[name])
+
+        added, max_id = _append_rows(files, meta["max_id"], meta["dtype"])
+        rows = meta["rows"] + added
+        # A slower ingest may have committed ids below the old max_id, or chunks were deleted
+        if rows > settings.HOT_TIER_MAX_ROWS or _chunks_up_to(max_id) != rows:
+            return _rebuild(meta)
+
+        meta = dict(meta, rows=rows, max_id=max_id)
+        _write_meta(meta)
+        return meta
+
+
+def mark_stale():
+    """
+    Readers fall back to Postgres until the next sync() rebuilds the tier.
+    """
+    with _writer_lock():
+        meta = read_meta()
+        if meta and not meta["stale"]:
+            _write_meta(dict(meta, stale=True))
+
+
+def sync_or_mark_stale():
+    """
+    sync() for the ingest path, which must not fail a stored document: if the
+    sync fails, the tier is marked stale so searches use Postgres meanwhile.
+    """
+    try:
+        sync()
+    except Exception as e:
+        registry.inc(ERRORS, where="hot_tier_sync")
+        print(f"⚠️ Could not sync the hot tier: {e}")
+        try:
+            mark_stale()
+        except OSError as e:
+            print(f"⚠️ Could not mark the hot tier stale: {e}")
+
+
+@receiver(post_delete, sender=Document)
+def _document_deleted(sender, instance, **kwargs):
+    if settings.HOT_TIER_ENABLED:
+        mark_stale()
+
+
+# --- Reader ---
+
+class HotTier:
+    """
+    Read side, one per process. search() returns None whenever it can't
+    answer exactly (disabled, missing or stale tier, unsupported filters).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._arrays = None # (ids, document_ids, vectors) or None
+
+    def _current(self):
+        try:
+            stat = os.stat(_path("meta.json"))
+            stamp = (stat.st_mtime_ns, stat.st_ino)
+        except FileNotFoundError:
+            stamp = None
+
+        with self._lock:
+            if stamp != self._stamp:
+                self._arrays = self._map(read_meta() if stamp else None)
+                self._stamp = stamp
+            return self._arrays
+
+    @staticmethod
+    def _map(meta):
+        if not meta or meta["stale"] or meta["rows"] == 0 or meta["dims"] != DIMENSIONS:
+            return None
+        rows, files = meta["rows"], _files(meta["generation"])
+        try:
+            return (
+                np.memmap(files["ids"], dtype=np.int64, mode="r", shape=(rows,)),
+                np.memmap(files["docs"], dtype=np.int64, mode="r", shape=(rows,)),
+                np.memmap(files["vectors"], dtype=meta["dtype"], mode="r", shape=(rows, meta["dims"])),
+            )
+        except (FileNotFoundError, ValueError):
+            return None # Replaced by a rebuild in between; the next search remaps
+
+    def search(self, query_vec, k: int, filters: dict = None):
+        """
+        Exact nearest chunks: [(chunk_id, cosine distance), ...], nearest first, or None.
+        """
+        if not settings.HOT_TIER_ENABLED:
+            return None
+        return self.top_k(query_vec, k, filters)
+
+    def top_k(self, query_vec, k: int, filters: dict = None):
+        """
+        search() regardless of HOT_TIER_ENABLED (for benchmarks).
+        """
+        if set(filters or {}) - SUPPORTED_FILTERS:
+            return None
+        arrays = self._current()
+        if arrays is None:
+            return None
+        ids, document_ids, vectors = arrays
+
+        with span("hot_tier_search"):
+            query = np.asarray(query_vec, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1.0)
+            if vectors.dtype == np.float32:
+                scores = vectors @ query
+            else:
+                scores = np.empty(len(vectors), dtype=np.float32)
+                for start in range(0, len(vectors), _SEARCH_BLOCK):
+                    block = vectors[start:start + _SEARCH_BLOCK]
+                    scores[start:start + len(block)] = block.astype(np.float32) @ query
+
+            if filters:
+                scores[~np.isin(document_ids, filters["document_ids"])] = -np.inf
+
+            k = min(k, len(scores))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(int(ids[i]), float(1.0 - scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def size_bytes(self) -> int:
+        arrays = self._current()
+        return sum(a.nbytes for a in arrays) if arrays else 0
+
+
+hot_tier = HotTier()
@@ -0,0 +1,436 @@
+# api/ingest.py
+import hashlib
+import os
+import queue
+import threading
+import uuid
+import time
+import traceback
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from pypdf import PdfReader
+from .models import Document, DocumentChunk, IngestionJob
+from .services import get_embeddings, upload_to_s3, s3_key_for
+from .cache import invalidate_retrieval_cache
+from .chunking import chunk_pages, count_tokens, get_encoding
+from .pdf_extract import iter_page_texts
+from .summaries import build_summaries, load_document_chunks
+from . import hot_tier
+from .metrics import registry, span, start_timings, record_stage, ERRORS
+
+# Write progress counters every N pages instead of once per page
+PROGRESS_EVERY = 10
+
+# Chunks per embedding-stage batch (each batch is embedded with EMBEDDING_CONCURRENCY requests in flight)
+EMBED_BATCH_CHUNKS = 64
+
+# Embedded batches waiting for the insert stage (back-pressure on extraction)
+INSERT_QUEUE_BATCHES = 4
+
+_DONE = object()
+_ABORT = object()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def enqueue_upload(file) -> IngestionJob:
+    """
+    Spools an uploaded file to INGEST_SPOOL_DIR and queues it for a worker.
+    A byte-identical PDF that is already a Document completes immediately.
+    (Documents only get their file_hash once fully ingested, see ingest_document.)
+    """
+    os.makedirs(settings.INGEST_SPOOL_DIR, exist_ok=True)
+    spool_path = os.path.join(settings.INGEST_SPOOL_DIR, f"{uuid.uuid4().hex}.pdf")
+
+    digest = hashlib.sha256()
+    with open(spool_path, 'wb') as out:
+        for part in file.chunks():
+            digest.update(part)
+            out.write(part)
+    file_hash = digest.hexdigest()
+
+    existing = Document.objects.filter(file_hash=file_hash).first()
+    if existing:
+        os.remove(spool_path)
+        print(f"♻️ Duplicate upload of '{existing.title}' (doc {existing.pk}). Skipping ingestion.")
+        return IngestionJob.objects.create(
+            filename=file.name,
+            file_hash=file_hash,
+            status=IngestionJob.STATUS_DONE,
+            document=existing,
+            pages_total=existing.total_pages,
+            pages_parsed=existing.total_pages,
+            pages_embedded=existing.chunks.count(),
+            finished_at=timezone.now()
+        )
+
+    return IngestionJob.objects.create(
+        filename=file.name,
+        source_path=spool_path,
+        file_hash=file_hash,
+    )
+
+
+def claim_next_job():
+    """
+    Atomically marks the oldest queued job as running and returns it.
+    SKIP LOCKED lets any number of workers poll the same table safely.
+    Running jobs whose lease expired (worker crashed or was killed) are claimed
+    again from scratch, or failed after INGEST_MAX_ATTEMPTS.
+    """
+    while True:
+        now = timezone.now()
+        expired = now - timedelta(seconds=settings.INGEST_JOB_LEASE)
+        with transaction.atomic():
+            job = (
+                IngestionJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=IngestionJob.STATUS_QUEUED)
+                    | Q(status=IngestionJob.STATUS_RUNNING, heartbeat_at__lt=expired)
+                    | Q(status=IngestionJob.STATUS_RUNNING, heartbeat_at__isnull=True, started_at__lt=expired)
+                )
+                .order_by('created_at')
+                .first()
+            )
+            if job is None:
+                return None
+
+            if job.status == IngestionJob.STATUS_RUNNING:
+                print(f"⚠️ Job {job.pk} ({job.filename}) lost its worker (attempt {job.attempts}).")
+                # Start over: the crashed attempt may have left a partial document
+                _delete_partial_document(job)
+                job.document = None
+                if job.attempts >= settings.INGEST_MAX_ATTEMPTS:
+                    _fail_abandoned(job, now)
+                    continue
+
+            job.status = IngestionJob.STATUS_RUNNING
+            job.attempts += 1
+            job.started_at = now
+            job.heartbeat_at = now
+            job.pages_parsed = job.pages_embedded = 0
+            job.save(update_fields=[
+                'status', 'attempts', 'started_at', 'heartbeat_at', 'document', 'pages_parsed', 'pages_embedded'
+            ])
+            return job
+
+
+def _delete_partial_document(job: IngestionJob):
+    """
+    Deletes the document this job started but didn't finish. A document gets its
+    file_hash only once fully ingested, so a finished one (or the existing document
+    a duplicate upload points to) is never deleted.
+    """
+    if job.document_id:
+        Document.objects.filter(pk=job.document_id, file_hash='').delete()
+
+
+def _fail_abandoned(job: IngestionJob, now):
+    job.status = IngestionJob.STATUS_FAILED
+    job.error = f"Worker stopped responding {job.attempts} times; giving up."
+    job.finished_at = now
+    job.save(update_fields=['status', 'error', 'finished_at', 'document'])
+    registry.inc(ERRORS, where="ingestion")
+    if os.path.exists(job.source_path):
+        os.remove(job.source_path)
+
+
+class _Heartbeat:
+    """
+    Renews a running job's lease from a background thread while the job runs,
+    so long stages (embedding, summarizing) don't need to report in themselves.
+    """
+    def __init__(self, job: IngestionJob):
+        self.job = job
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"heartbeat-{job.pk}", daemon=True)
+
+    def _run(self):
+        try:
+            while not self.stopped.wait(settings.INGEST_JOB_LEASE / 3):
+                IngestionJob.objects.filter(pk=self.job.pk, status=IngestionJob.STATUS_RUNNING).update(
+                    heartbeat_at=timezone.now()
+                )
+        finally:
+            connection.close() # This thread's own DB connection
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def _set_progress(job, **fields):
+    IngestionJob.objects.filter(pk=job.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(job, name, value)
+
+
+def ingest_document(job: IngestionJob) -> Document:
+    """
+    The actual ingestion pipeline (previously inline in /upload):
+    1. Uploads PDF to S3 (multipart, in the background)
+    2. Extracts text
+    3. Chunks & Embeds into PGVector
+    """
+    # Same bytes may have been queued twice before either finished
+    if job.file_hash:
+        existing = Document.objects.filter(file_hash=job.file_hash).first()
+        if existing:
+            _set_progress(
+                job,
+                document=existing,
+                pages_total=existing.total_pages,
+                pages_parsed=existing.total_pages,
+                pages_embedded=existing.chunks.count()
+            )
+            return existing
+
+    # A. Count pages in the spool file. Given an open file, pypdf seeks to the
+    # objects it needs (given a path, it would read the whole file into memory).
+    # Text extraction reopens it per worker, see pdf_extract.py.
+    with open(job.source_path, "rb") as pdf_file:
+        page_count = len(PdfReader(pdf_file).pages)
+    _set_progress(job, pages_total=page_count)
+
+    # B. Save Parent Record. file_hash is set last: until then no duplicate upload
+    # can match (and point to) a document that isn't searchable yet
+    doc = Document.objects.create(
+        title=job.filename,
+        s3_key=s3_key_for(job.filename),
+        total_pages=page_count
+    )
+    _set_progress(job, document=doc)
+
+    # The S3 (multipart) upload streams the same file in the background
+    # while we parse, embed and insert
+    # (copy_context: stage timings from the helper threads land in this job's breakdown)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="s3-upload") as uploader:
+        upload = uploader.submit(copy_context().run, _timed_upload, job.source_path, job.filename)
+
+        def finish():
+            upload.result() # Re-raises upload errors, failing the job
+            # Commits with the chunks: a hashed document is always complete
+            Document.objects.filter(pk=doc.pk).update(file_hash=job.file_hash)
+
+        # C + D. Parse, embed and insert; the chunks commit once finish() returns
+        _parse_embed_and_insert(job, doc, page_count, before_commit=finish)
+    doc.file_hash = job.file_hash
+
+    # Summary tier for broad queries. Optional: the document is searchable without it
+    # (backfill later with `manage.py summarize_documents --missing`)
+    if settings.SUMMARY_TIER_ENABLED:
+        try:
+            with span("summarize"):
+                build_summaries(doc, load_document_chunks(doc))
+        except Exception as e:
+            registry.inc(ERRORS, where="summarize")
+            print(f"⚠️ Could not summarize '{doc.title}': {e}")
+
+    # In-process vector tier: append the new chunks (API workers remap on their next search)
+    if settings.HOT_TIER_ENABLED:
+        hot_tier.sync_or_mark_stale()
+
+    # E. New chunks are searchable now, so cached /chat retrievals are stale
+    invalidate_retrieval_cache()
+
+    return doc
+
+
+def _timed_upload(path: str, filename: str) -> str:
+    with span("s3_upload"):
+        return upload_to_s3(path, filename)
+
+
+def _timed_embeddings(texts: list, on_progress=None) -> list:
+    with span("embedding"):
+        return get_embeddings(texts, on_progress=on_progress)
+
+
+def iter_document_chunks(path: str, page_count: int):
+    """
+    Yields (page_no, [(page_no, char_start, char_end, text), ...]) in page order,
+    as the extraction pool finishes each page. Shared by the worker and bulk_ingest.
+    Time spent waiting on the pool counts as "pdf_extract".
+    """
+    page_texts = iter_page_texts(
+        path,
+        page_count,
+        workers=settings.PDF_EXTRACT_WORKERS,
+        page_timeout=settings.PDF_PAGE_TIMEOUT
+    )
+    while True:
+        wait_start = time.perf_counter()
+        item = next(page_texts, None)
+        if item is None:
+            break
+        record_stage("pdf_extract", time.perf_counter() - wait_start)
+
+        page_no, text = item
+        # Pages are split into overlapping token windows (CHUNK_TOKENS / CHUNK_OVERLAP_TOKENS)
+        with span("chunking"):
+            page_chunks = chunk_pages([(page_no, text)])
+        yield page_no, page_chunks
+
+
+def build_chunk_rows(doc: Document, chunks: list, vectors: list, start: int = 0) -> list:
+    """
+    Unsaved DocumentChunks for (page_no, char_start, char_end, text) chunks + vectors.
+    `start` is the number of the document's chunks before these.
+    """
+    encoding = get_encoding(settings.CHUNK_TOKENIZER)
+    return [
+        DocumentChunk(
+            document=doc,
+            chunk_index=start + i + 1,
+            page_number=page_no,
+            char_start=char_start,
+            char_end=char_end,
+            token_count=count_tokens(text, encoding),
+            text_content=text,
+            embedding=vec
+        )
+        for i, ((page_no, char_start, char_end, text), vec) in enumerate(zip(chunks, vectors))
+    ]
+
+
+def _write_chunks(doc: Document, batches: queue.Queue, before_commit) -> int:
+    """
+    D. Insert stage, on its own thread and DB connection. Writes each embedded batch
+    as it arrives and lets it go, all in one transaction: the document's chunks become
+    searchable together, and a failed job leaves none behind. Returns the row count.
+    """
+    written = 0
+    try:
+        with transaction.atomic():
+            while True:
+                item = batches.get()
+                if item is _DONE:
+                    break
+                if item is _ABORT:
+                    raise RuntimeError("Ingestion aborted")
+                chunks, vectors = item
+                rows = build_chunk_rows(doc, chunks, vectors.result(), start=written)
+                # search_vector (the keyword index) is filled by a DB trigger, see db_setup.py
+                with span("db_insert"):
+                    DocumentChunk.objects.bulk_create(rows, batch_size=EMBED_BATCH_CHUNKS)
+                written += len(rows)
+            before_commit()
+        return written
+    finally:
+        connection.close()
+
+
+def _put(batches: queue.Queue, item, writer):
+    # Blocks while the insert stage is behind, unless it died (re-raises its error)
+    while True:
+        try:
+            batches.put(item, timeout=1)
+            return
+        except queue.Full:
+            if writer.done():
+                writer.result()
+                raise RuntimeError("Insert stage stopped")
+
+
+def _parse_embed_and_insert(job: IngestionJob, doc: Document, page_count: int, before_commit) -> int:
+    """
+    C. Chunking & Embedding, feeding D. Insert. Returns the number of chunks.
+    Pages are extracted on a process pool and stream in, in page order. Each
+    EMBED_BATCH_CHUNKS worth of chunks goes to the embedding stage, then to the
+    insert stage, while extraction continues; at most INSERT_QUEUE_BATCHES wait,
+    so memory stays flat however large the document is.
+    """
+    batches = queue.Queue(maxsize=INSERT_QUEUE_BATCHES)
+    pending = [] # (page_no, char_start, char_end, text) not yet sent to the embedding stage
+    last_page = 0
+
+    def on_embedded(batch):
+        def report(done):
+            if done % PROGRESS_EVERY == 0:
+                # Progress is reported in pages: the page of the latest embedded chunk
+                _set_progress(job, pages_embedded=batch[done - 1][0])
+        return report
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-stage") as embedder, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-insert") as inserter:
+        writer = inserter.submit(copy_context().run, _write_chunks, doc, batches, before_commit)
+
+        def submit_batch():
+            batch = list(pending)
+            pending.clear()
+            vectors = embedder.submit(
+                copy_context().run, _timed_embeddings, [text for _, _, _, text in batch],
+                on_progress=on_embedded(batch)
+            )
+            _put(batches, (batch, vectors), writer)
+
+        try:
+            for page_no, page_chunks in iter_document_chunks(job.source_path, page_count):
+                pending.extend(page_chunks)
+                if page_chunks:
+                    last_page = page_no
+
+                if len(pending) >= EMBED_BATCH_CHUNKS:
+                    submit_batch()
+                if page_no % PROGRESS_EVERY == 0:
+                    _set_progress(job, pages_parsed=page_no)
+
+            if pending:
+                submit_batch()
+            _set_progress(job, pages_parsed=page_count)
+            _put(batches, _DONE, writer)
+        except BaseException:
+            if not writer.done():
+                _put(batches, _ABORT, writer) # Rolls the insert back
+            raise
+        # Chunks seen before (boilerplate, earlier revisions) come from the embedding cache
+        written = writer.result()
+
+    if last_page:
+        _set_progress(job, pages_embedded=last_page)
+    return written
+
+
+def run_job(job: IngestionJob) -> IngestionJob:
+    """
+    Runs one claimed job and records the outcome. Never raises.
+    """
+    timings = start_timings()
+    try:
+        with _Heartbeat(job):
+            ingest_document(job)
+        _set_progress(job, status=IngestionJob.STATUS_DONE, timings=timings, finished_at=timezone.now())
+    except Exception as e:
+        registry.inc(ERRORS, where="ingestion")
+        print(f"❌ Ingestion failed for job {job.pk} ({job.filename}): {e}")
+        traceback.print_exc()
+        # Drop the half-ingested document so it never shows up in search
+        _delete_partial_document(job)
+        _set_progress(
+            job,
+            status=IngestionJob.STATUS_FAILED,
+            error=str(e),
+            timings=timings,
+            finished_at=timezone.now()
+        )
+    finally:
+        if os.path.exists(job.source_path):
+            os.remove(job.source_path)
+
+    return job
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from api.cache import LRUCache, query_cache, answer_cache
+from api.fakes import install_fake_backends
+from api.ingest import claim_next_job, run_job
+from api.metrics import registry
+from api.models import IngestionJob
+from api.pdf_extract import _reset_pool
+from api.services import presigned_url_cache
+
+# Vocabulary of the synthetic contracts and questions
+PARTIES = ["Acme Corp", "Globex Ltd", "Initech LLC", "Umbrella GmbH", "Stark Industries", "Wayne Enterprises",
+           "Hooli Inc", "Vandelay Imports", "Soylent Co", "Tyrell Systems"]
+TOPICS = {
+    "termination": "Either party may terminate this Agreement upon {n} days written notice to the other party.",
+    "payment": "Invoices are payable within {n} days of receipt; late payments accrue interest at {p} percent per month.",
+    "liability": "The aggregate liability of {a} shall not exceed {n} thousand dollars in any contract year.",
+    "confidentiality": "{a} shall keep all Confidential Information of {b} secret for {n} years after disclosure.",
+    "indemnification": "{a} shall indemnify and hold harmless {b} against third party claims arising from negligence.",
+    "renewal": "This Agreement renews automatically for successive terms of {n} months unless cancelled.",
+    "governing law": "This Agreement is governed by the laws of the State of {s} without regard to conflict rules.",
+    "warranty": "{a} warrants that the services will be performed in a professional manner for {n} days.",
+    "force majeure": "Neither party is liable for delays caused by events beyond its reasonable control for {n} days.",
+    "assignment": "{a} may not assign this Agreement without the prior written consent of {b}.",
+}
+STATES = ["Delaware", "New York", "California", "Texas", "Washington"]
+QUESTIONS = [
+    "What is the {topic} clause in the agreement with {party}?",
+    "Summarize the {topic} terms across all contracts.",
+    "Compare the {topic} provisions of {party} and {other}.",
+    "How many days does {party} have under the {topic} section?",
+]
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct))]
+
+
+def _latency_summary(seconds: list) -> dict:
+    ms = sorted(s * 1000 for s in seconds)
+    return {
+        "count": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 2) if ms else 0.0,
+        "p50_ms": round(_percentile(ms, 0.50), 2),
+        "p95_ms": round(_percentile(ms, 0.95), 2),
+        "p99_ms": round(_percentile(ms, 0.99), 2),
+        "max_ms": round(ms[-1], 2) if ms else 0.0,
+    }
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: list) -> bytes:
+    """
+    Minimal text PDF (one Helvetica content stream per page) that pypdf can extract.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None, # Pages tree, filled in once the kids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for text in pages:
+        lines, line = [], ""
+        for word in text.split():
+            if len(line) + len(word) > 95:
+                lines.append(line)
+                line = ""
+            line = f"{line} {word}" if line else word
+        lines.append(line)
+
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({_pdf_escape(l)}) Tj T*" for l in lines) + " ET"
+        stream = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def synthetic_corpus(docs: int, pages: int, rng: random.Random) -> list:
+    """
+    [(filename, pdf_bytes), ...] of contract-like documents, ~400 words per page.
+    """
+    corpus = []
+    for d in range(docs):
+        a, b = rng.sample(PARTIES, 2)
+        page_texts = []
+        for p in range(pages):
+            sentences = [f"Agreement between {a} and {b}. Section {p + 1}."]
+            while sum(len(s.split()) for s in sentences) < 400:
+                topic = rng.choice(list(TOPICS))
+                clause = TOPICS[topic].format(
+                    a=rng.choice((a, b)), b=rng.choice((a, b)), n=rng.randint(5, 120),
+                    p=rng.randint(1, 5), s=rng.choice(STATES)
+                )
+                sentences.append(f"{topic.title()}. {clause}")
+            page_texts.append(" ".join(sentences))
+        corpus.append((f"bench_{d:04d}_{a.split()[0]}_{b.split()[0]}.pdf", make_pdf(page_texts)))
+    return corpus
+
+
+def synthetic_questions(count: int, rng: random.Random) -> list:
+    questions = []
+    for _ in range(count):
+        party, other = rng.sample(PARTIES, 2)
+        template = rng.choice(QUESTIONS)
+        questions.append(template.format(topic=rng.choice(list(TOPICS)), party=party, other=other))
+    return questions
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline benchmark: fake Bedrock / Azure OpenAI / S3 backends, a synthetic corpus in a "
+        "throwaway test database, /upload ingest throughput and /chat latency under concurrent load."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--docs', type=int, default=20, help="Synthetic documents to ingest.")
+        parser.add_argument('--pages', type=int, default=10, help="Pages per document.")
+        parser.add_argument('--ingest-workers', type=int, default=2, help="Concurrent ingest workers.")
+        parser.add_argument('--requests', type=int, default=200, help="/chat requests to measure.")
+        parser.add_argument('--concurrency', type=int, default=10, help="/chat requests in flight.")
+        parser.add_argument('--warmup', type=int, default=5, help="Unmeasured /chat requests first.")
+        parser.add_argument('--embed-latency-ms', type=float, default=20, help="Injected latency per embedding call.")
+        parser.add_argument('--llm-latency-ms', type=float, default=800, help="Injected latency per LLM completion.")
+        parser.add_argument('--s3-latency-ms', type=float, default=50, help="Injected latency per S3 upload.")
+        parser.add_argument('--query-cache', action='store_true', help="Keep the in-process query cache on.")
+        parser.add_argument('--answer-cache', action='store_true', help="Keep the semantic answer cache on.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true', help="Keep the test database afterwards.")
+        parser.add_argument('--json', dest='json_path', help="Write the report as JSON to this path ('-' = stdout).")
+
+    def handle(self, *args, **options):
+        install_fake_backends(
+            embed_latency=options['embed_latency_ms'] / 1000,
+            llm_latency=options['llm_latency_ms'] / 1000,
+            s3_latency=options['s3_latency_ms'] / 1000
+        )
+        # Never read from / bump the shared (production) query cache
+        query_cache.backend_alias = None
+        query_cache.local = LRUCache(query_cache.local.max_entries if options['query_cache'] else 0, query_cache.ttl)
+        # Repeated synthetic questions would otherwise skip the LLM and flatter the numbers
+        answer_cache.clear()
+        if not options['answer_cache']:
+            answer_cache.max_entries = 0
+        presigned_url_cache.clear()
+        registry.clear()
+
+        rng = random.Random(options['seed'])
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            report = {
+                "config": {key: options[key] for key in (
+                    'docs', 'pages', 'ingest_workers', 'requests', 'concurrency', 'embed_latency_ms',
+                    'llm_latency_ms', 's3_latency_ms', 'query_cache', 'answer_cache', 'seed'
+                )},
+                "upload": self._bench_upload(synthetic_corpus(options['docs'], options['pages'], rng), options),
+                "chat": asyncio.run(self._bench_chat(synthetic_questions(options['requests'], rng), options)),
+                "metrics": registry.render(),
+            }
+        finally:
+            _reset_pool()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        upload, chat = report["upload"], report["chat"]
+        self.stdout.write(
+            f"📥 Ingested {upload['documents']} docs / {upload['pages']} pages in {upload['ingest_seconds']}s "
+            f"({upload['pages_per_second']} pages/s, {upload['failed']} failed)"
+        )
+        self.stdout.write(
+            f"💬 /chat x{chat['latency']['count']} @ {options['concurrency']}: "
+            f"p50 {chat['latency']['p50_ms']}ms, p95 {chat['latency']['p95_ms']}ms, "
+            f"p99 {chat['latency']['p99_ms']}ms, {chat['requests_per_second']} req/s"
+        )
+
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"📝 Report written to {options['json_path']}")
+
+    def _bench_upload(self, corpus: list, options: dict) -> dict:
+        client = Client()
+        request_seconds = []
+
+        start = time.perf_counter()
+        for filename, data in corpus:
+            request_start = time.perf_counter()
+            response = client.post("/api/upload", {"file": SimpleUploadedFile(filename, data, "application/pdf")})
+            request_seconds.append(time.perf_counter() - request_start)
+            if response.status_code != 200:
+                raise RuntimeError(f"/upload returned {response.status_code}: {response.content[:200]!r}")
+        upload_seconds = time.perf_counter() - start
+
+        def worker():
+            try:
+                while (job := claim_next_job()) is not None:
+                    run_job(job)
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['ingest_workers'])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ingest_seconds = time.perf_counter() - start
+
+        jobs = list(IngestionJob.objects.all())
+        pages = sum(job.pages_total for job in jobs if job.status == IngestionJob.STATUS_DONE)
+        stage_seconds = {}
+        for job in jobs:
+            for stage, seconds in job.timings.items():
+                stage_seconds[stage] = round(stage_seconds.get(stage, 0.0) + seconds, 3)
+
+        return {
+            "documents": len(corpus),
+            "pages": pages,
+            "failed": sum(job.status == IngestionJob.STATUS_FAILED for job in jobs),
+            "upload_request": _latency_summary(request_seconds),
+            "upload_seconds": round(upload_seconds, 3),
+            "ingest_seconds": round(ingest_seconds, 3),
+            "documents_per_second": round(len(corpus) / ingest_seconds, 3),
+            "pages_per_second": round(pages / ingest_seconds, 2),
+            "stage_seconds_total": stage_seconds,
+        }
+
+    async def _bench_chat(self, questions: list, options: dict) -> dict:
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        latencies, stage_samples, errors = [], {}, 0
+
+        async def ask(question: str, measure: bool):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/api/chat",
+                    {"query": question, "include_timings": True},
+                    content_type="application/json"
+                )
+                elapsed = time.perf_counter() - start
+            if not measure:
+                return
+            if response.status_code != 200:
+                errors += 1
+                return
+            latencies.append(elapsed)
+            for stage, seconds in (response.json().get("timings") or {}).items():
+                stage_samples.setdefault(stage, []).append(seconds)
+
+        for question in questions[:options['warmup']]:
+            await ask(question, measure=False)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(ask(q, measure=True) for q in questions))
+        wall_seconds = time.perf_counter() - start
+
+        # The thread that ran the ORM calls holds a connection to the test database
+        await sync_to_async(connections.close_all)()
+
+        return {
+            "latency": _latency_summary(latencies),
+            "errors": errors,
+            "wall_seconds": round(wall_seconds, 3),
+            "requests_per_second": round(len(latencies) / wall_seconds, 2),
+            "stages": {stage: _latency_summary(samples) for stage, samples in sorted(stage_samples.items())},
+        }
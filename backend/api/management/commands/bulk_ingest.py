@@ -0,0 +1,239 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from pypdf import PdfReader
+from api.cache import invalidate_retrieval_cache
+from api import hot_tier
+from api.ingest import build_chunk_rows, file_sha256, iter_document_chunks
+from api.models import Document, DocumentChunk
+from api.services import get_embeddings, upload_to_s3, s3_key_for
+
+_DONE = object()
+
+
+class Stats:
+    """Thread-safe throughput counters for the progress line"""
+    def __init__(self):
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.pages = 0
+        self.embeds = 0
+        self.docs = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def line(self) -> str:
+        elapsed = max(time.time() - self.start, 1e-6)
+        return (
+            f"{self.docs} docs ({self.skipped} skipped, {self.failed} failed) | "
+            f"{self.pages} pages, {self.pages / elapsed:.1f} pages/s | "
+            f"{self.embeds} embeds, {self.embeds / elapsed:.1f} embeds/s | {elapsed:.0f}s"
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-ingests a directory of PDFs (or a manifest file with one path per line). "
+        "Pipelines parse -> embed -> insert and checkpoints each document, so a rerun resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory of PDFs, or a manifest file listing PDF paths.")
+        parser.add_argument(
+            '--checkpoint',
+            help="Checkpoint file (JSON lines). Default: <source>.checkpoint.jsonl"
+        )
+        parser.add_argument('--queue-size', type=int, default=4, help="Documents buffered between stages.")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows per bulk_create batch.")
+        parser.add_argument('--retry-failed', action='store_true', help="Retry documents that failed last run.")
+        parser.add_argument('--skip-summaries', action='store_true',
+                            help="Don't build the summary tier (run `summarize_documents --missing` later).")
+
+    def handle(self, *args, **options):
+        paths = self._collect_paths(options['source'])
+        checkpoint_path = options['checkpoint'] or f"{options['source'].rstrip(os.sep)}.checkpoint.jsonl"
+        done_paths = self._load_checkpoint(checkpoint_path, options['retry_failed'])
+
+        todo = [p for p in paths if p not in done_paths]
+        self.stdout.write(
+            f"📚 {len(paths)} PDFs found, {len(paths) - len(todo)} already checkpointed, {len(todo)} to ingest."
+        )
+
+        self.stats = Stats()
+        self.inserted = [] # Document ids of this run
+        self.batch_size = options['batch_size']
+        parsed = queue.Queue(maxsize=options['queue_size'])
+        embedded = queue.Queue(maxsize=options['queue_size'])
+        self.checkpoint = open(checkpoint_path, 'a')
+
+        try:
+            with ThreadPoolExecutor(max_workers=settings.S3_MAX_CONCURRENCY, thread_name_prefix="s3-upload") as uploader:
+                stages = [
+                    threading.Thread(target=self._parse_stage, args=(todo, uploader, parsed), daemon=True),
+                    threading.Thread(target=self._embed_stage, args=(parsed, embedded), daemon=True),
+                ]
+                for stage in stages:
+                    stage.start()
+
+                # Insert stage runs here, on the main thread
+                self._insert_stage(embedded)
+        finally:
+            self.checkpoint.close()
+
+        # One hot tier sync for the whole run instead of one per document
+        if settings.HOT_TIER_ENABLED and self.stats.docs:
+            meta = hot_tier.sync()
+            self.stdout.write(f"🔥 Hot tier: {meta['rows']} chunks{' (stale, over HOT_TIER_MAX_ROWS)' if meta['stale'] else ''}.")
+
+        # Summary tier after the pipeline, so LLM calls don't hold up the inserts.
+        # Broad queries use chunk retrieval until every document in scope has one.
+        if settings.SUMMARY_TIER_ENABLED and self.inserted and not options['skip_summaries']:
+            call_command('summarize_documents', document_ids=self.inserted, stdout=self.stdout, stderr=self.stderr)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Done: {self.stats.line()}"))
+
+    # --- Inputs & checkpoints ---
+
+    def _collect_paths(self, source: str) -> list:
+        if os.path.isdir(source):
+            return sorted(
+                os.path.abspath(os.path.join(root, name))
+                for root, _, files in os.walk(source)
+                for name in files
+                if name.lower().endswith('.pdf')
+            )
+        if os.path.isfile(source):
+            with open(source) as manifest:
+                base = os.path.dirname(os.path.abspath(source))
+                return [
+                    os.path.abspath(os.path.join(base, line.strip()))
+                    for line in manifest
+                    if line.strip() and not line.startswith('#')
+                ]
+        raise CommandError(f"{source} is neither a directory nor a manifest file.")
+
+    def _load_checkpoint(self, checkpoint_path: str, retry_failed: bool) -> set:
+        done = set()
+        if not os.path.exists(checkpoint_path):
+            return done
+        with open(checkpoint_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # Torn last line from a crash
+                if entry['status'] == 'failed' and retry_failed:
+                    done.discard(entry['path'])
+                else:
+                    done.add(entry['path'])
+        return done
+
+    def _record(self, path: str, status: str, **extra):
+        self.checkpoint.write(json.dumps({"path": path, "status": status, **extra}) + "\n")
+        self.checkpoint.flush()
+        os.fsync(self.checkpoint.fileno())
+
+    # --- Pipeline stages ---
+
+    def _parse_stage(self, paths: list, uploader, out_queue):
+        seen_hashes = set() # Byte-identical copies within this run
+        for path in paths:
+            try:
+                file_hash = file_sha256(path)
+                existing = Document.objects.filter(file_hash=file_hash).first()
+                if existing or file_hash in seen_hashes:
+                    out_queue.put({"path": path, "skip": existing.pk if existing else None})
+                    continue
+                seen_hashes.add(file_hash)
+
+                title = os.path.basename(path)
+                with open(path, "rb") as pdf_file: # A path would make pypdf read the whole file
+                    page_count = len(PdfReader(pdf_file).pages)
+                # S3 upload runs in the background until the insert stage needs it
+                upload = uploader.submit(upload_to_s3, path, title)
+
+                chunks = []
+                for _, page_chunks in iter_document_chunks(path, page_count):
+                    chunks.extend(page_chunks)
+                self.stats.add(pages=page_count)
+
+                out_queue.put({
+                    "path": path,
+                    "title": title,
+                    "file_hash": file_hash,
+                    "page_count": page_count,
+                    "chunks": chunks,
+                    "upload": upload,
+                })
+            except Exception as e:
+                out_queue.put({"path": path, "error": f"parse: {e}"})
+        out_queue.put(_DONE)
+
+    def _embed_stage(self, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                out_queue.put(_DONE)
+                return
+            if "chunks" in item:
+                try:
+                    item["vectors"] = get_embeddings([text for _, _, _, text in item["chunks"]])
+                    self.stats.add(embeds=len(item["chunks"]))
+                except Exception as e:
+                    item = {"path": item["path"], "error": f"embed: {e}"}
+            out_queue.put(item)
+
+    def _insert_stage(self, in_queue):
+        last_report = time.time()
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                return
+
+            path = item["path"]
+            if "skip" in item:
+                self.stats.add(skipped=1)
+                self._record(path, "done", document_id=item["skip"], duplicate=True)
+            elif "error" in item:
+                self.stats.add(failed=1)
+                self._record(path, "failed", error=item["error"])
+                self.stderr.write(f"❌ {path}: {item['error']}")
+            else:
+                try:
+                    item["upload"].result()
+                    # Document + chunks land together, so a crash never leaves a partial document
+                    with transaction.atomic():
+                        doc = Document.objects.create(
+                            title=item["title"],
+                            s3_key=s3_key_for(item["title"]),
+                            total_pages=item["page_count"],
+                            file_hash=item["file_hash"]
+                        )
+                        DocumentChunk.objects.bulk_create(
+                            build_chunk_rows(doc, item["chunks"], item["vectors"]),
+                            batch_size=self.batch_size
+                        )
+                    invalidate_retrieval_cache()
+                    self.inserted.append(doc.pk)
+                    self.stats.add(docs=1)
+                    self._record(path, "done", document_id=doc.pk, file_hash=item["file_hash"])
+                except Exception as e:
+                    self.stats.add(failed=1)
+                    self._record(path, "failed", error=f"insert: {e}")
+                    self.stderr.write(f"❌ {path}: insert: {e}")
+
+            if time.time() - last_report >= 5:
+                self.stdout.write(f"⏱️ {self.stats.line()}")
+                last_report = time.time()
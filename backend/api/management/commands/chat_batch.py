@@ -0,0 +1,58 @@
+import asyncio
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.batch import answer_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Answers a checklist of questions offline (same pipeline as /chat/batch) and "
+        "writes one JSON line per question to --output as answers finish."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('questions', help="Text file with one question per line (# comments allowed), or a JSON list.")
+        parser.add_argument('--output', required=True, help="JSON Lines file for the results.")
+        parser.add_argument('--document', type=int, action='append', dest='document_ids',
+                            help="Only search this document id (repeatable). Default: all documents.")
+        parser.add_argument('--title-prefix', help="Only search documents whose title starts with this.")
+        parser.add_argument('--batch-size', type=int, default=settings.BATCH_MAX_QUESTIONS,
+                            help="Questions retrieved together (default: BATCH_MAX_QUESTIONS).")
+
+    def handle(self, *args, **options):
+        queries = self._read_questions(options['questions'])
+        if not queries:
+            raise CommandError("No questions found.")
+        filters = {"document_ids": options['document_ids'], "title_prefix": options['title_prefix']}
+
+        start = time.time()
+        failed = asyncio.run(self._run(queries, filters, options['output'], max(1, options['batch_size'])))
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Answered {len(queries) - failed}/{len(queries)} questions in {time.time() - start:.1f}s "
+            f"-> {options['output']}"
+        ))
+
+    def _read_questions(self, path: str) -> list:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if text.lstrip().startswith("["):
+            return [str(q).strip() for q in json.loads(text) if str(q).strip()]
+        lines = (line.strip() for line in text.splitlines())
+        return [line for line in lines if line and not line.startswith("#")]
+
+    async def _run(self, queries: list, filters: dict, output: str, batch_size: int) -> int:
+        failed = 0
+        with open(output, "w", encoding="utf-8") as out:
+            for offset in range(0, len(queries), batch_size):
+                async for result in answer_batch(queries[offset:offset + batch_size], filters):
+                    result["index"] += offset
+                    out.write(json.dumps(result, default=str) + "\n")
+                    out.flush() # Partial results survive an interrupted run
+                    if "error" in result:
+                        failed += 1
+                        self.stdout.write(self.style.ERROR(f"❌ [{result['index']}] {result['error']}"))
+                    else:
+                        self.stdout.write(f"💬 [{result['index']}] {len(result['sources'])} sources")
+        return failed
@@ -0,0 +1,35 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api import hot_tier
+
+
+class Command(BaseCommand):
+    help = (
+        "Syncs the memory-mapped hot vector tier (HOT_TIER_DIR) with DocumentChunk. The ingest "
+        "worker does this after each document; use it after deletes, bulk loads or setting changes. "
+        "Compare it with pgvector using `vector_report --hot`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Rewrite the tier from scratch.")
+        parser.add_argument('--status', action='store_true', help="Only print the current state.")
+
+    def handle(self, *args, **options):
+        if not options['status']:
+            start = time.time()
+            hot_tier.sync(rebuild=options['rebuild'])
+            self.stdout.write(f"🔥 Synced in {time.time() - start:.1f}s.")
+
+        meta = hot_tier.read_meta()
+        if meta is None:
+            self.stdout.write("No hot tier yet.")
+            return
+        size_mb = meta['rows'] * meta['dims'] * (2 if meta['dtype'] == 'float16' else 4) / (1024 * 1024)
+        state = "stale (Postgres serves searches)" if meta['stale'] else "ready"
+        self.stdout.write(
+            f"Generation {meta['generation']}: {meta['rows']} chunks (max id {meta['max_id']}), "
+            f"{meta['dims']} x {meta['dtype']}, {size_mb:.1f} MB, {state}."
+        )
+        if not settings.HOT_TIER_ENABLED:
+            self.stdout.write(self.style.WARNING("HOT_TIER_ENABLED is off: searches don't use it."))
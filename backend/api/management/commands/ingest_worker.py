@@ -0,0 +1,40 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.ingest import claim_next_job, run_job
+from api.models import IngestionJob
+
+
+class Command(BaseCommand):
+    help = "Processes queued /upload ingestion jobs. Run several to scale ingest throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue, then exit.")
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.INGEST_POLL_INTERVAL,
+            help="Seconds to sleep when the queue is empty."
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"📥 Ingest worker started (poll every {options['poll_interval']}s)")
+
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            start = time.time()
+            self.stdout.write(f"⚙️ Job {job.pk}: {job.filename}")
+            run_job(job)
+
+            if job.status == IngestionJob.STATUS_DONE:
+                self.stdout.write(self.style.SUCCESS(
+                    f"✅ Job {job.pk}: {job.pages_embedded} pages embedded in {time.time() - start:.1f}s"
+                ))
+            else:
+                self.stdout.write(self.style.ERROR(f"❌ Job {job.pk} failed: {job.error}"))
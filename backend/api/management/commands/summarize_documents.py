@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand
+from api.cache import invalidate_retrieval_cache
+from api.models import Document
+from api.summaries import build_summaries, load_document_chunks
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds (or rebuilds) the summary tier used by broad queries. The ingest worker does this "
+        "for new uploads; use it for documents ingested earlier, or whose summaries failed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help="Only documents without summaries.")
+        parser.add_argument('--document', type=int, action='append', dest='document_ids',
+                            help="Document id (repeatable). Default: all documents.")
+
+    def handle(self, *args, **options):
+        docs = Document.objects.order_by('id')
+        if options['document_ids']:
+            docs = docs.filter(id__in=options['document_ids'])
+        if options['missing']:
+            docs = docs.filter(summaries__isnull=True)
+
+        done = 0
+        for doc in docs.distinct():
+            start = time.time()
+            try:
+                rows = build_summaries(doc, load_document_chunks(doc))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"❌ {doc.title}: {e}"))
+                continue
+            done += 1
+            self.stdout.write(f"📝 {doc.title}: {len(rows)} summaries in {time.time() - start:.1f}s")
+
+        # The DB-derived corpus version includes the max summary id, so it moves by itself;
+        # the shared-backend counter doesn't, and this process's answer cache needs clearing
+        if done:
+            invalidate_retrieval_cache()
+        self.stdout.write(self.style.SUCCESS(f"✅ Summarized {done} documents."))
@@ -0,0 +1,120 @@
+import json
+import statistics
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from api.hot_tier import hot_tier, sync as sync_hot_tier
+from api.db_setup import QUANTIZED_INDEXES, install_quantized_index, quantized_index
+from api.search import CHUNK_TABLE, VECTOR_MODES, run_vector_query, to_pgvector
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the compact (halfvec / binary) vector indexes and compares recall@k and latency "
+        "of each VECTOR_SEARCH_MODE (and optionally the in-process hot tier) against an exact scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=",".join(VECTOR_MODES), help="Comma separated modes to compare.")
+        parser.add_argument('--samples', type=int, default=50, help="Number of sample queries.")
+        parser.add_argument('--k', type=int, default=20, help="Neighbours per query (the vector branch depth).")
+        parser.add_argument('--oversample', type=int, default=None, help="Override VECTOR_RERANK_OVERSAMPLE.")
+        parser.add_argument('--build', action='store_true', help="Build missing compact indexes (CONCURRENTLY) first.")
+        parser.add_argument('--hot', action='store_true', help="Also sync and measure the hot tier (api/hot_tier.py).")
+        parser.add_argument('--json', dest='json_path', help="Also write the report as JSON to this path.")
+
+    def handle(self, *args, **options):
+        modes = [m.strip() for m in options['modes'].split(",") if m.strip()]
+        unknown = set(modes) - set(VECTOR_MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+
+        if options['build']:
+            for mode in modes:
+                name = install_quantized_index(mode, concurrently=True)
+                if name:
+                    self.stdout.write(f"🔨 Index {name} ready.")
+
+        queries = self._sample_queries(options['samples'])
+        if not queries:
+            raise CommandError("No embeddings in the database to sample queries from.")
+
+        k = options['k']
+        truth = [set(self._exact_ids(q, k)) for q in queries]
+
+        report = {"samples": len(queries), "k": k, "modes": {}}
+        for mode in modes:
+            row = self._measure(
+                queries, truth, lambda q: run_vector_query(q, k, mode=mode, oversample=options['oversample'])
+            )
+            row.update(index=self._index_name(mode), index_size_mb=self._index_size_mb(mode))
+            report["modes"][mode] = row
+
+        if options['hot']:
+            meta = sync_hot_tier()
+            if meta['stale']:
+                self.stdout.write(self.style.WARNING("Hot tier skipped: corpus is over HOT_TIER_MAX_ROWS."))
+            else:
+                hot_tier.top_k(queries[0], k) # Map the files before timing
+                row = self._measure(queries, truth, lambda q: hot_tier.top_k(q, k))
+                row.update(
+                    index=f"{settings.HOT_TIER_DIR} ({meta['dtype']})",
+                    index_size_mb=round(hot_tier.size_bytes() / (1024 * 1024), 1)
+                )
+                report["modes"]["hot"] = row
+
+        self._print_report(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def _measure(self, queries: list, truth: list, search) -> dict:
+        latencies, recalls = [], []
+        for q, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = search(q)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(expected & {chunk_id for chunk_id, _ in found}) / max(len(expected), 1))
+
+        latencies.sort()
+        return {
+            "recall_at_k": round(statistics.mean(recalls), 4),
+            "latency_ms_p50": round(latencies[len(latencies) // 2], 2),
+            "latency_ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        }
+
+    def _sample_queries(self, n: int) -> list:
+        # Stored chunk vectors stand in for query vectors (same distribution, no Bedrock calls)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT embedding::text FROM {CHUNK_TABLE} ORDER BY random() LIMIT %s", [n])
+            return [json.loads(row[0]) for row in cursor.fetchall()]
+
+    def _exact_ids(self, query_vec, k: int) -> list:
+        # Ground truth: force a sequential scan so no index approximates anything
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_indexscan = off")
+            cursor.execute("SET LOCAL enable_bitmapscan = off")
+            cursor.execute(
+                f"SELECT id FROM {CHUNK_TABLE} ORDER BY embedding <=> %s::vector LIMIT %s",
+                [to_pgvector(query_vec), k]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _index_name(self, mode: str) -> str:
+        return quantized_index(mode)[0] if mode in QUANTIZED_INDEXES else "cosine_idx"
+
+    def _index_size_mb(self, mode: str):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_relation_size(to_regclass(%s))", [self._index_name(mode)])
+            size = cursor.fetchone()[0]
+        return round(size / (1024 * 1024), 1) if size is not None else None
+
+    def _print_report(self, report: dict):
+        self.stdout.write(f"\n📊 Vector search modes: {report['samples']} queries, k={report['k']}")
+        self.stdout.write(f"{'mode':<10}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}{'index MB':>10}")
+        for mode, row in report["modes"].items():
+            size = row['index_size_mb'] if row['index_size_mb'] is not None else "missing"
+            self.stdout.write(
+                f"{mode:<10}{row['recall_at_k']:>10}{row['latency_ms_p50']:>10}{row['latency_ms_p95']:>10}{size:>10}"
+            )
@@ -0,0 +1,167 @@
+# api/metrics.py
+# In-process latency histograms and counters (exposed on /metrics in the
+# Prometheus text format) and per-request stage timings.
+# Numbers are per process: with several workers, scrape each one.
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds. Covers cache hits (ms) up to long LLM answers / big uploads
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+STAGE_SECONDS = "contrackt_stage_seconds"
+REQUEST_SECONDS = "contrackt_request_seconds"
+LLM_TOKENS = "contrackt_llm_tokens_total"
+EXTERNAL_RETRIES = "contrackt_external_retries_total"
+ERRORS = "contrackt_errors_total"
+ANSWER_CACHE = "contrackt_answer_cache_total"
+
+_HELP = {
+    STAGE_SECONDS: "Duration of one pipeline stage.",
+    REQUEST_SECONDS: "End-to-end duration of an API request.",
+    LLM_TOKENS: "Azure OpenAI tokens, by call and kind (prompt/completion).",
+    EXTERNAL_RETRIES: "Retried calls to external services.",
+    ERRORS: "Failures, by where they happened.",
+    ANSWER_CACHE: "Semantic answer cache lookups, by result (hit/miss).",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms keyed by (name, sorted labels).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        if not amount:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value:g}")
+
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram.total:.6f}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+registry = MetricsRegistry()
+
+# {stage: seconds} of the request being served. asyncio tasks and sync_to_async
+# copy the context, so they all add to the same dict.
+_stage_timings = ContextVar("stage_timings", default=None)
+
+
+def start_timings() -> dict:
+    timings = {}
+    _stage_timings.set(timings)
+    return timings
+
+
+def record_stage(stage: str, seconds: float):
+    """
+    Feeds the stage histogram and the current request's breakdown.
+    A stage that runs several times in one request (e.g. re-fetch) adds up.
+    """
+    registry.observe(STAGE_SECONDS, seconds, stage=stage)
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+async def atimed(stage: str, awaitable):
+    """
+    span() for one awaitable, e.g. a branch of asyncio.gather.
+    """
+    with span(stage):
+        return await awaitable
+
+
+def record_llm_usage(call: str, usage):
+    """
+    Token counters from an OpenAI `usage` object (may be None).
+    """
+    if usage is None:
+        return
+    registry.inc(LLM_TOKENS, usage.prompt_tokens or 0, call=call, kind="prompt")
+    registry.inc(LLM_TOKENS, usage.completion_tokens or 0, call=call, kind="completion")
@@ -0,0 +1,56 @@
+# api/mmr.py
+# Maximal Marginal Relevance over candidate embeddings (NumPy only, no Django).
+import numpy as np
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(query_vec, embeddings, group_ids, k: int, lambda_: float = 0.7,
+               per_group_cap: int = 0, duplicate_threshold: float = 1.0) -> list:
+    """
+    Picks up to k rows of `embeddings` (n x d), returning their indices in pick order.
+    Each step takes argmax of  lambda_ * sim(query, c) - (1 - lambda_) * max sim(c, picked).
+    - per_group_cap: at most this many picks per group_ids value (0 = no cap)
+    - duplicate_threshold: candidates at least this similar to a pick are dropped
+    """
+    n = len(embeddings)
+    if n == 0 or k <= 0:
+        return []
+
+    candidates = _normalize(np.asarray(embeddings, dtype=np.float32))
+    query = _normalize(np.asarray(query_vec, dtype=np.float32))
+    relevance = candidates @ query
+    # One BLAS call up front; every step below is then O(n)
+    similarity = candidates @ candidates.T
+
+    group_ids = np.asarray(group_ids)
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.full(n, -1.0, dtype=np.float32)
+    picks_per_group = {}
+    picked = []
+
+    while len(picked) < k and available.any():
+        if picked:
+            scores = lambda_ * relevance - (1.0 - lambda_) * max_similarity
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+
+        picked.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+        # Near-duplicates of what we just took (boilerplate pages) add nothing
+        available &= similarity[best] < duplicate_threshold
+
+        if per_group_cap:
+            group = group_ids[best]
+            picks_per_group[group] = picks_per_group.get(group, 0) + 1
+            if picks_per_group[group] >= per_group_cap:
+                available &= group_ids != group
+
+    return picked
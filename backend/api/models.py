@@ -1,4 +1,5 @@
 # api/models.py
+from django.conf import settings
 from django.db import models
 from pgvector.django import VectorField, HnswIndex
 from django.contrib.postgres.search import SearchVectorField
@@ -10,16 +11,23 @@ class Document(models.Model):
     s3_key = models.CharField(max_length=1024) # Path in S3
     uploaded_at = models.DateTimeField(auto_now_add=True)
     total_pages = models.IntegerField(default=0)
+    file_hash = models.CharField(max_length=64, blank=True, default='', db_index=True) # sha256 of the PDF bytes
     
     def __str__(self):
         return self.title
 
 class DocumentChunk(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
-    chunk_index = models.IntegerField()
+    chunk_index = models.IntegerField() # Position in the document (was the page number before token chunking)
     text_content = models.TextField()
+
+    # Token-window chunking: source page and character span of this chunk within it
+    page_number = models.IntegerField(null=True)
+    char_start = models.IntegerField(default=0)
+    char_end = models.IntegerField(null=True)
+    token_count = models.IntegerField(default=0)
     
-    embedding = VectorField(dimensions=1024) 
+    embedding = VectorField(dimensions=settings.EMBEDDING_DIMENSIONS) 
     
     # 1. ADD THIS FIELD (Stores keyword tokens)
     search_vector = SearchVectorField(null=True)
@@ -35,4 +43,95 @@ class DocumentChunk(models.Model):
             ),
             # 2. ADD THIS INDEX (Makes keyword search fast)
             GinIndex(fields=['search_vector'], name='keyword_idx'),
-        ]
\ No newline at end of file
+        ]
+
+    @property
+    def page(self) -> int:
+        """Page to cite. Page-level chunks from before token chunking have no page_number."""
+        return self.page_number or self.chunk_index
+
+class DocumentSummary(models.Model):
+    """Summary tier for broad queries: one per document plus one per section (run of pages)"""
+    LEVEL_DOCUMENT = 'document'
+    LEVEL_SECTION = 'section'
+    LEVEL_CHOICES = [
+        (LEVEL_DOCUMENT, 'Document'),
+        (LEVEL_SECTION, 'Section'),
+    ]
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='summaries')
+    level = models.CharField(max_length=16, choices=LEVEL_CHOICES)
+    section_index = models.IntegerField(default=0) # 0 for the document summary
+    page_start = models.IntegerField(null=True)
+    page_end = models.IntegerField(null=True)
+    text_content = models.TextField()
+    token_count = models.IntegerField(default=0)
+
+    embedding = VectorField(dimensions=settings.EMBEDDING_DIMENSIONS)
+
+    class Meta:
+        indexes = [
+            HnswIndex(
+                name='summary_cosine_idx',
+                fields=['embedding'],
+                m=16,
+                ef_construction=64,
+                opclasses=['vector_cosine_ops']
+            ),
+        ]
+
+    @property
+    def page(self) -> int:
+        """Page to cite: first page of the section (1 for a document summary)."""
+        return self.page_start or 1
+
+    def __str__(self):
+        return f"{self.document.title} [{self.level} {self.section_index}]"
+
+class EmbeddingCache(models.Model):
+    """Content-addressed Titan embeddings, so repeated pages are only embedded once"""
+    content_hash = models.CharField(max_length=64, unique=True) # sha256(model | dims | normalized text)
+    model_id = models.CharField(max_length=100)
+    dimensions = models.IntegerField()
+    embedding = VectorField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.model_id}/{self.dimensions}: {self.content_hash[:12]}"
+
+class IngestionJob(models.Model):
+    """Queued /upload request, processed by the `ingest_worker` command"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    filename = models.CharField(max_length=255)
+    source_path = models.CharField(max_length=1024) # Spooled PDF on local disk
+    file_hash = models.CharField(max_length=64, blank=True, default='') # sha256 of the PDF bytes
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+
+    # Progress counters (polled by /jobs/{id})
+    pages_total = models.IntegerField(default=0)
+    pages_parsed = models.IntegerField(default=0)
+    pages_embedded = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    timings = models.JSONField(default=dict, blank=True) # Seconds per ingestion stage
+
+    # Lease: a running job whose heartbeat is older than INGEST_JOB_LEASE is reclaimed
+    attempts = models.IntegerField(default=0)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
@@ -0,0 +1,124 @@
+# api/pdf_extract.py
+# PDF text extraction on a process pool. pypdf's extract_text() is pure Python
+# and CPU-bound, so threads don't help; processes scale with cores.
+# This module has no Django imports so spawned pool workers load it cheaply.
+import multiprocessing
+import threading
+from collections import deque
+from pypdf import PdfReader
+
+# Per-worker-process reader cache: each worker opens the spooled PDF once.
+# pypdf gets an open file, not the path: with a path it reads the whole file
+# into memory, with a file it seeks to the objects it needs.
+_readers = {} # path -> (file, PdfReader)
+
+# Shared by every ingest thread of the process (benchmark ingests concurrently)
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+
+def extract_page_text(path: str, page_index: int):
+    entry = _readers.get(path)
+    if entry is None:
+        # One document at a time per worker
+        for pdf_file, _ in _readers.values():
+            pdf_file.close()
+        _readers.clear()
+        pdf_file = open(path, "rb")
+        entry = _readers[path] = (pdf_file, PdfReader(pdf_file))
+    return entry[1].pages[page_index].extract_text() or ""
+
+
+def _get_pool(workers: int):
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size != workers:
+            if _pool is not None:
+                _pool.terminate()
+                _pool.join()
+            # spawn, not fork: the ingest worker has live threads (S3 upload, embedding)
+            _pool = multiprocessing.get_context("spawn").Pool(processes=workers)
+            _pool_size = workers
+        return _pool
+
+
+def _reset_pool(pool=None):
+    """
+    Kills the pool, including workers stuck on a pathological page.
+    With `pool`, only if that is still the current one (another thread may
+    have replaced it already).
+    """
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or (pool is not None and pool is not _pool):
+            return
+        stale = _pool
+        _pool = None
+        _pool_size = 0
+    stale.terminate()
+    stale.join()
+
+
+def iter_page_texts(path: str, page_count: int, workers: int, page_timeout: float):
+    """
+    Yields (page_number, text) in page order while later pages are still being
+    extracted. A page that errors yields "". On the pool (workers > 1), so does a
+    page that takes longer than page_timeout seconds; in-process extraction
+    (workers <= 1) has no way to interrupt a page, so page_timeout doesn't apply.
+    """
+    if workers <= 1:
+        with open(path, "rb") as pdf_file:
+            for i, page in enumerate(PdfReader(pdf_file).pages):
+                try:
+                    text = page.extract_text() or ""
+                except Exception as e:
+                    print(f"⚠️ Page {i + 1} could not be extracted: {e}")
+                    text = ""
+                yield i + 1, text
+        return
+
+    max_in_flight = workers * 4 # Bounded, so results stream instead of piling up
+    pending = deque() # (page index, pool, AsyncResult)
+    next_index = 0
+
+    def submit(index: int):
+        while True:
+            pool = _get_pool(workers)
+            try:
+                pending.append((index, pool, pool.apply_async(extract_page_text, (path, index))))
+                return
+            except ValueError: # "Pool not running": another thread just reset it
+                _reset_pool(pool)
+
+    while next_index < page_count or pending:
+        while next_index < page_count and len(pending) < max_in_flight:
+            submit(next_index)
+            next_index += 1
+
+        index, pool, result = pending.popleft()
+        try:
+            text = result.get(timeout=page_timeout)
+        except multiprocessing.TimeoutError:
+            retry = [i for i, _, _ in pending]
+            if pool is _pool:
+                print(f"⚠️ Page {index + 1} took longer than {page_timeout}s to extract. Skipping it.")
+                text = ""
+                # Its worker stays stuck on the page: replace the pool right away
+                _reset_pool(pool)
+            else:
+                # Another thread replaced the pool under us: this page never ran to the end
+                text = None
+                retry.insert(0, index)
+
+            # Pages still in flight died with the old pool: resubmit them to the new one
+            pending.clear()
+            for i in retry:
+                submit(i)
+            if text is None:
+                continue
+        except Exception as e:
+            print(f"⚠️ Page {index + 1} could not be extracted: {e}")
+            text = ""
+
+        yield index + 1, text
@@ -1,6 +1,6 @@
 # api/schemas.py
 from ninja import Schema
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 class DocumentOut(Schema):
@@ -10,10 +10,30 @@ class DocumentOut(Schema):
     uploaded_at: datetime
     total_pages: int
 
+class SearchFilters(Schema):
+    """Optional scope of a chat: only these contracts are searched"""
+    document_ids: Optional[List[int]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+    title_prefix: Optional[str] = None
+
 class ChatIn(Schema):
     """Schema for user question"""
     query: str
+    filters: Optional[SearchFilters] = None
+    include_timings: bool = False # Per-stage seconds in the response
+
+    def filter_dict(self) -> dict:
+        return self.filters.model_dump(exclude_none=True) if self.filters else {}
     
+class BatchChatIn(Schema):
+    """Schema for a checklist of questions over the same documents"""
+    queries: List[str]
+    filters: Optional[SearchFilters] = None
+
+    def filter_dict(self) -> dict:
+        return self.filters.model_dump(exclude_none=True) if self.filters else {}
+
 class SourceNode(Schema):
     """Sub-schema for citing sources"""
     title: str
@@ -27,4 +47,20 @@ class ChatOut(Schema):
     """Schema for AI response"""
     answer: str
     sources: List[SourceNode]
-    processing_time: float
\ No newline at end of file
+    processing_time: float
+    cached: bool = False # Served from the semantic answer cache
+    timings: Optional[Dict[str, float]] = None
+
+class JobOut(Schema):
+    """Schema for polling a background ingestion job"""
+    id: int
+    filename: str
+    status: str
+    document_id: Optional[int] = None
+    pages_total: int
+    pages_parsed: int
+    pages_embedded: int
+    error: Optional[str] = None
+    timings: Dict[str, float] = {}
+    created_at: datetime
+    finished_at: Optional[datetime] = None
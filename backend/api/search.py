@@ -0,0 +1,383 @@
+# api/search.py
+import re
+from functools import lru_cache
+from django.conf import settings
+from django.db import connection, transaction
+from .models import Document, DocumentChunk, DocumentSummary
+from .metrics import span
+from .hot_tier import hot_tier
+
+CHUNK_TABLE = DocumentChunk._meta.db_table
+DOCUMENT_TABLE = Document._meta.db_table
+SUMMARY_TABLE = DocumentSummary._meta.db_table
+VECTOR_DIMENSIONS = DocumentChunk._meta.get_field('embedding').dimensions
+
+VECTOR_MODES = ("full", "halfvec", "binary", "truncated")
+
+# Optional search scope. Applied in the WHERE of both branches, so the HNSW scan
+# itself skips out-of-scope chunks (with iterative scans it keeps going until it has enough).
+FILTER_KEYS = ("document_ids", "uploaded_after", "uploaded_before", "title_prefix")
+_FILTER_CONDITIONS = {
+    "document_ids": "id = ANY(%(filter_document_ids)s)",
+    "uploaded_after": "uploaded_at >= %(filter_uploaded_after)s",
+    "uploaded_before": "uploaded_at < %(filter_uploaded_before)s",
+    "title_prefix": "title ILIKE %(filter_title_prefix)s",
+}
+
+# Vector candidate generation per VECTOR_SEARCH_MODE. The compact modes walk a
+# small HNSW expression index (see db_setup.py) for candidate_k = vector_k * oversample
+# candidates, then re-rank those exactly against the full-precision embeddings.
+# "truncated" is coarse-to-fine: the first {coarse} dimensions only, cosine on a
+# prefix needs no re-normalization.
+_VECTOR_BRANCHES = {
+    "full": """
+    SELECT id, embedding <=> %(query_vec)s::vector AS distance
+    FROM {chunk_table}{where}
+    ORDER BY distance
+    LIMIT %(vector_k)s""",
+    "halfvec": """
+    SELECT id, embedding <=> %(query_vec)s::vector AS distance
+    FROM (
+        SELECT id, embedding
+        FROM {chunk_table}{where}
+        ORDER BY embedding::halfvec({dims}) <=> %(query_vec)s::halfvec({dims})
+        LIMIT %(candidate_k)s
+    ) candidates
+    ORDER BY distance
+    LIMIT %(vector_k)s""",
+    "binary": """
+    SELECT id, embedding <=> %(query_vec)s::vector AS distance
+    FROM (
+        SELECT id, embedding
+        FROM {chunk_table}{where}
+        ORDER BY binary_quantize(embedding)::bit({dims}) <~> binary_quantize(%(query_vec)s::vector)
+        LIMIT %(candidate_k)s
+    ) candidates
+    ORDER BY distance
+    LIMIT %(vector_k)s""",
+    "truncated": """
+    SELECT id, embedding <=> %(query_vec)s::vector AS distance
+    FROM (
+        SELECT id, embedding
+        FROM {chunk_table}{where}
+        ORDER BY subvector(embedding, 1, {coarse})::vector({coarse})
+            <=> subvector(%(query_vec)s::vector, 1, {coarse})::vector({coarse})
+        LIMIT %(candidate_k)s
+    ) candidates
+    ORDER BY distance
+    LIMIT %(vector_k)s""",
+    # Already ranked in process by the hot tier (hot_tier.py, filters applied there)
+    "hot": """
+    SELECT * FROM unnest(%(hot_ids)s::bigint[], %(hot_distances)s::float8[]) AS hits(id, distance)""",
+}
+
+
+def normalize_filters(filters: dict = None) -> dict:
+    """
+    Drops empty filters. Unknown keys are an error, not silently ignored.
+    """
+    filters = {key: value for key, value in (filters or {}).items() if value not in (None, "", [])}
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown search filters {sorted(unknown)}. Expected some of {FILTER_KEYS}.")
+    return filters
+
+
+def filter_params(filters: dict) -> dict:
+    params = {f"filter_{key}": value for key, value in filters.items()}
+    if "document_ids" in filters:
+        params["filter_document_ids"] = [int(x) for x in filters["document_ids"]]
+    if "title_prefix" in filters:
+        prefix = filters["title_prefix"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params["filter_title_prefix"] = prefix + "%"
+    return params
+
+
+def scope_sql(filter_keys: tuple) -> str:
+    """
+    "document_id IN (...)" for the given filter names, or "" when unscoped.
+    """
+    if not filter_keys:
+        return ""
+    conditions = " AND ".join(_FILTER_CONDITIONS[key] for key in filter_keys)
+    return f"document_id IN (SELECT id FROM {DOCUMENT_TABLE} WHERE {conditions})"
+
+
+def vector_branch_sql(mode: str, filter_keys: tuple = ()) -> str:
+    if mode not in _VECTOR_BRANCHES:
+        raise ValueError(f"Unknown VECTOR_SEARCH_MODE {mode!r}. Expected one of {VECTOR_MODES}.")
+    scope = scope_sql(filter_keys)
+    return _VECTOR_BRANCHES[mode].format(
+        chunk_table=CHUNK_TABLE,
+        dims=VECTOR_DIMENSIONS,
+        coarse=settings.VECTOR_COARSE_DIMENSIONS,
+        where=f"\n        WHERE {scope}" if scope else ""
+    )
+
+
+# Vector ranking, keyword ranking and Reciprocal Rank Fusion in one statement.
+# Each branch ranks its own candidates with row_number(); the FULL OUTER JOIN
+# keeps chunks found by only one branch (their missing side contributes 0).
+# The keyword branch matches through the GIN keyword_idx (@@) first and only
+# computes ts_rank for the matched rows.
+@lru_cache(maxsize=None)
+def hybrid_sql(mode: str, filter_keys: tuple = ()) -> str:
+    scope = scope_sql(filter_keys)
+    keyword_scope = f" AND {scope}" if scope else ""
+    return f"""
+WITH vector_hits AS ({vector_branch_sql(mode, filter_keys)}
+),
+vector_ranked AS (
+    SELECT id, row_number() OVER (ORDER BY distance) AS rank
+    FROM vector_hits
+),
+keyword_hits AS (
+    SELECT id, ts_rank(search_vector, q) AS kw_rank
+    FROM {CHUNK_TABLE}, websearch_to_tsquery(%(ts_config)s::regconfig, %(query_text)s) q
+    WHERE search_vector @@ q{keyword_scope}
+    ORDER BY kw_rank DESC
+    LIMIT %(keyword_k)s
+),
+keyword_ranked AS (
+    SELECT id, row_number() OVER (ORDER BY kw_rank DESC) AS rank
+    FROM keyword_hits
+),
+fused AS (
+    SELECT
+        COALESCE(v.id, k.id) AS id,
+        COALESCE(1.0 / (%(rrf_k)s + v.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + k.rank), 0) AS score
+    FROM vector_ranked v
+    FULL OUTER JOIN keyword_ranked k ON v.id = k.id
+)
+SELECT
+    c.id, c.chunk_index, c.page_number, c.char_start, c.char_end, c.text_content,
+    d.id, d.title, d.s3_key, d.uploaded_at, d.total_pages,
+    f.score
+FROM fused f
+JOIN {CHUNK_TABLE} c ON c.id = f.id
+JOIN {DOCUMENT_TABLE} d ON d.id = c.document_id
+ORDER BY f.score DESC, c.id
+LIMIT %(top_k)s
+"""
+
+
+# Parameters every query of a batch statement shares; the rest get a _<index> suffix
+_SHARED_PARAMS = ("ts_config", "rrf_k", "filter_")
+_PARAM = re.compile(r"%\((\w+)\)s")
+
+
+@lru_cache(maxsize=64)
+def batch_hybrid_sql(mode: str, filter_keys: tuple, size: int) -> str:
+    """
+    `size` hybrid searches in one statement (UNION ALL), each row tagged with
+    query_index. Query i reads its parameters as %(name_i)s.
+    """
+    single = hybrid_sql(mode, filter_keys)
+    parts = []
+    for i in range(size):
+        body = _PARAM.sub(
+            lambda m: m.group(0) if m.group(1).startswith(_SHARED_PARAMS) else f"%({m.group(1)}_{i})s",
+            single
+        )
+        parts.append(f"SELECT {i} AS query_index, q{i}.* FROM ({body}) q{i}")
+    return "\nUNION ALL\n".join(parts)
+
+
+def to_pgvector(vec) -> str:
+    """
+    Text literal for a raw-SQL vector parameter (cast with ::vector).
+    """
+    return "[" + ",".join(str(float(x)) for x in vec) + "]"
+
+
+def ef_search_for(index_limit: int) -> int:
+    """
+    hnsw.ef_search for a scan that must return index_limit rows. The pgvector
+    default (40) silently caps any larger LIMIT at ~40 rows.
+    """
+    ef_search = max(settings.HNSW_EF_SEARCH_MIN, index_limit * settings.HNSW_EF_SEARCH_FACTOR)
+    return min(ef_search, settings.HNSW_EF_SEARCH_MAX)
+
+
+def configure_hnsw(cursor, index_limit: int):
+    """
+    Transaction-local (SET LOCAL) HNSW settings; call inside transaction.atomic().
+    """
+    if settings.HNSW_ITERATIVE_SCAN == "off":
+        cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(ef_search_for(index_limit))])
+    else:
+        cursor.execute(
+            "SELECT set_config('hnsw.ef_search', %s, true), set_config('hnsw.iterative_scan', %s, true)",
+            [str(ef_search_for(index_limit)), settings.HNSW_ITERATIVE_SCAN]
+        )
+
+
+def run_vector_query(query_vec, k: int, mode: str = None, oversample: int = None, filters: dict = None) -> list:
+    """
+    Vector branch on its own: [(chunk_id, exact cosine distance), ...], nearest first.
+    Without an explicit mode the hot tier answers when it can.
+    """
+    if mode is None:
+        hits = hot_tier.search(query_vec, k, normalize_filters(filters))
+        if hits is not None:
+            return hits
+    mode = mode or settings.VECTOR_SEARCH_MODE
+    oversample = oversample or settings.VECTOR_RERANK_OVERSAMPLE
+    filters = normalize_filters(filters)
+    params = {
+        "query_vec": to_pgvector(query_vec),
+        "vector_k": k,
+        "candidate_k": k * oversample,
+        **filter_params(filters),
+    }
+    index_limit = k if mode == "full" else k * oversample
+    with span("vector_search"), transaction.atomic(), connection.cursor() as cursor:
+        configure_hnsw(cursor, index_limit)
+        cursor.execute(vector_branch_sql(mode, tuple(sorted(filters))), params)
+        return [(chunk_id, float(distance)) for chunk_id, distance in cursor.fetchall()]
+
+
+def run_summary_query(query_vec, k: int, filters: dict = None) -> list:
+    """
+    Nearest DocumentSummaries (summary_cosine_idx): [(summary_id, cosine distance), ...].
+    """
+    filters = normalize_filters(filters)
+    scope = scope_sql(tuple(sorted(filters)))
+    sql = f"""
+    SELECT id, embedding <=> %(query_vec)s::vector AS distance
+    FROM {SUMMARY_TABLE}{f" WHERE {scope}" if scope else ""}
+    ORDER BY distance
+    LIMIT %(k)s"""
+    params = {"query_vec": to_pgvector(query_vec), "k": k, **filter_params(filters)}
+    with span("summary_search"), transaction.atomic(), connection.cursor() as cursor:
+        configure_hnsw(cursor, k)
+        cursor.execute(sql, params)
+        return [(summary_id, float(distance)) for summary_id, distance in cursor.fetchall()]
+
+
+def count_unsummarized(filters: dict = None) -> int:
+    """
+    In-scope documents without a summary tier (not built yet, or building it failed).
+    """
+    filters = normalize_filters(filters)
+    conditions = [f"NOT EXISTS (SELECT 1 FROM {SUMMARY_TABLE} s WHERE s.document_id = d.id)"]
+    conditions += [_FILTER_CONDITIONS[key] for key in sorted(filters)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT count(*) FROM {DOCUMENT_TABLE} d WHERE {' AND '.join(conditions)}",
+            filter_params(filters)
+        )
+        return cursor.fetchone()[0]
+
+
+def run_hybrid_query(query_vec, query_text: str, top_k: int, vector_k: int, keyword_k: int, rrf_k: int = 60,
+                     mode: str = None, oversample: int = None, filters: dict = None) -> list:
+    """
+    One search statement: returns DocumentChunks (with .document and .score attached),
+    best RRF score first. `filters` (see FILTER_KEYS) scope both branches.
+    Without an explicit mode the hot tier ranks the vector branch when it can.
+    """
+    filters = normalize_filters(filters)
+    hot_hits = hot_tier.search(query_vec, vector_k, filters) if mode is None else None
+    if hot_hits is not None:
+        mode = "hot"
+    mode = mode or settings.VECTOR_SEARCH_MODE
+    oversample = oversample or settings.VECTOR_RERANK_OVERSAMPLE
+    params = {
+        "query_vec": to_pgvector(query_vec),
+        "query_text": query_text,
+        "ts_config": settings.SEARCH_TEXT_CONFIG,
+        "vector_k": vector_k,
+        "candidate_k": vector_k * oversample,
+        "keyword_k": keyword_k,
+        "rrf_k": rrf_k,
+        "top_k": top_k,
+        **filter_params(filters),
+        **_hot_params(hot_hits),
+    }
+    index_limit = vector_k if mode == "full" else vector_k * oversample
+    # Vector branch, keyword branch and fusion are one statement, so they are timed together
+    with span("hybrid_search"), transaction.atomic(), connection.cursor() as cursor:
+        if mode != "hot":
+            configure_hnsw(cursor, index_limit)
+        cursor.execute(hybrid_sql(mode, tuple(sorted(filters))), params)
+        rows = cursor.fetchall()
+
+    return [_chunk_from_row(row) for row in rows]
+
+
+def run_hybrid_queries(searches: list, rrf_k: int = 60, mode: str = None, oversample: int = None,
+                       filters: dict = None) -> list:
+    """
+    run_hybrid_query for many questions in one round trip. `searches` is
+    [(query_vec, query_text, top_k, vector_k, keyword_k), ...]; returns one result
+    list per search, in order. Mode and filters are shared by the whole batch, and
+    so is hnsw.ef_search (sized for the deepest vector branch).
+    """
+    if not searches:
+        return []
+    filters = normalize_filters(filters)
+    hot_hits = [None] * len(searches)
+    if mode is None:
+        hot_hits = [hot_tier.search(query_vec, vector_k, filters) for query_vec, _, _, vector_k, _ in searches]
+        if None in hot_hits:
+            hot_hits = [None] * len(searches) # One statement, one vector branch kind
+        else:
+            mode = "hot"
+    mode = mode or settings.VECTOR_SEARCH_MODE
+    oversample = oversample or settings.VECTOR_RERANK_OVERSAMPLE
+    params = {"ts_config": settings.SEARCH_TEXT_CONFIG, "rrf_k": rrf_k, **filter_params(filters)}
+    for i, (query_vec, query_text, top_k, vector_k, keyword_k) in enumerate(searches):
+        params.update({
+            f"query_vec_{i}": to_pgvector(query_vec),
+            f"query_text_{i}": query_text,
+            f"vector_k_{i}": vector_k,
+            f"candidate_k_{i}": vector_k * oversample,
+            f"keyword_k_{i}": keyword_k,
+            f"top_k_{i}": top_k,
+        })
+        params.update({f"{name}_{i}": value for name, value in _hot_params(hot_hits[i]).items()})
+    vector_k = max(search[3] for search in searches)
+    index_limit = vector_k if mode == "full" else vector_k * oversample
+    with span("hybrid_search"), transaction.atomic(), connection.cursor() as cursor:
+        if mode != "hot":
+            configure_hnsw(cursor, index_limit)
+        cursor.execute(batch_hybrid_sql(mode, tuple(sorted(filters)), len(searches)), params)
+        rows = cursor.fetchall()
+
+    results = [[] for _ in searches]
+    for query_index, *row in rows:
+        results[query_index].append(_chunk_from_row(row))
+    for chunks in results:
+        # UNION ALL doesn't promise to keep each branch's ORDER BY
+        chunks.sort(key=lambda c: (-c.score, c.id))
+    return results
+
+
+def _hot_params(hits) -> dict:
+    if hits is None:
+        return {}
+    return {"hot_ids": [chunk_id for chunk_id, _ in hits], "hot_distances": [distance for _, distance in hits]}
+
+
+def _chunk_from_row(row) -> DocumentChunk:
+    (chunk_id, chunk_index, page_number, char_start, char_end, text_content,
+     doc_id, title, s3_key, uploaded_at, total_pages, score) = row
+    chunk = DocumentChunk(
+        id=chunk_id,
+        document_id=doc_id,
+        chunk_index=chunk_index,
+        page_number=page_number,
+        char_start=char_start,
+        char_end=char_end,
+        text_content=text_content
+    )
+    chunk.document = Document(
+        id=doc_id,
+        title=title,
+        s3_key=s3_key,
+        uploaded_at=uploaded_at,
+        total_pages=total_pages
+    )
+    chunk.score = float(score)
+    return chunk
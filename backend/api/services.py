@@ -1,17 +1,27 @@
 # api/services.py
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
+import copy
+import hashlib
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from django.contrib.postgres.search import SearchQuery, SearchRank
-from django.db.models import F
 from django.conf import settings
-from pgvector.django import CosineDistance
-from .models import DocumentChunk
+from .models import DocumentChunk, EmbeddingCache
+from .cache import query_cache, normalize_query, corpus_version, LRUCache
+from .search import run_hybrid_query, run_hybrid_queries, normalize_filters
+from .metrics import registry, span, record_llm_usage, EXTERNAL_RETRIES, ERRORS
 import re
-from openai import AzureOpenAI
+import asyncio
+import httpx
+from urllib.parse import quote
+from asgiref.sync import sync_to_async
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from openai import AzureOpenAI, AsyncAzureOpenAI, DefaultAsyncHttpxClient
 
 # 1. Initialize AWS Clients
 my_config = Config(
@@ -27,116 +37,223 @@ session = boto3.Session(
 )
 
 s3_client = session.client('s3', config=my_config)
-bedrock_client = session.client('bedrock-runtime')
+
+# Bedrock gets a connection pool big enough for the parallel embedding workers,
+# otherwise urllib3 would serialize requests on its default 10 connections.
+bedrock_client = session.client(
+    'bedrock-runtime',
+    config=Config(
+        retries={'max_attempts': 3},
+        max_pool_connections=max(10, settings.EMBEDDING_CONCURRENCY)
+    )
+)
 
 # --- Helper Functions ---
 
+# Large PDFs go up as parallel multipart uploads, read part by part from disk
+s3_transfer_config = TransferConfig(
+    multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=settings.S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=settings.S3_MAX_CONCURRENCY,
+    use_threads=True
+)
+
+def s3_key_for(filename: str) -> str:
+    clean_filename = filename.replace(" ", "_").replace("(", "").replace(")", "")
+    return f"uploads/{clean_filename}"
+
 def upload_to_s3(file_obj, filename):
     """
-    Uploads a file object to S3.
+    Uploads a file object (or a path on disk) to S3.
+    Paths are streamed from disk, never loaded into memory.
     """
+    s3_key = s3_key_for(filename)
+
+    if isinstance(file_obj, (str, os.PathLike)):
+        s3_client.upload_file(
+            os.fspath(file_obj),
+            settings.AWS_S3_BUCKET_NAME,
+            s3_key,
+            Config=s3_transfer_config
+        )
+        return s3_key
+
     # Ensure cursor is at the start
-    clean_filename = filename.replace(" ", "_").replace("(", "").replace(")", "")
-    
     file_obj.seek(0)
-    s3_key = f"uploads/{clean_filename}"
     
     s3_client.upload_fileobj(
         file_obj, 
         settings.AWS_S3_BUCKET_NAME, 
-        s3_key
+        s3_key,
+        Config=s3_transfer_config
     )
     return s3_key
 
-def get_embedding(text: str) -> list:
+TITAN_MODEL_ID = "amazon.titan-embed-text-v2:0"
+EMBEDDING_DIMENSIONS = settings.EMBEDDING_DIMENSIONS
+MAX_EMBED_CHARS = 8000
+
+def normalize_embed_text(text: str) -> str:
     """
-    Generates vector embedding using Amazon Titan v2.
+    Collapses whitespace and truncates to avoid token limits.
+    This is exactly what gets sent to Titan (and what the cache key hashes).
+    Ingested chunks are token-sized, so truncation should only hit odd inputs.
     """
-    # Start with a clean/truncated text to avoid token limits
-    cleaned_text = text[:8000] 
-    
+    normalized = " ".join(text.split())
+    if len(normalized) > MAX_EMBED_CHARS:
+        print(f"⚠️ Embedding input truncated from {len(normalized)} to {MAX_EMBED_CHARS} chars.")
+    return normalized[:MAX_EMBED_CHARS]
+
+def embedding_cache_key(text: str) -> str:
+    """
+    Content hash for the embedding cache: model + dimensions + normalized text.
+    """
+    raw = f"{TITAN_MODEL_ID}|{EMBEDDING_DIMENSIONS}|{normalize_embed_text(text)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def _titan_body(text: str) -> str:
+    return json.dumps({
+        "inputText": normalize_embed_text(text),
+        "dimensions": EMBEDDING_DIMENSIONS,
+        "normalize": True
+    })
+
+def _invoke_titan(text: str) -> list:
     response = bedrock_client.invoke_model(
-        modelId="amazon.titan-embed-text-v2:0",
+        modelId=TITAN_MODEL_ID,
         contentType="application/json",
         accept="application/json",
-        body=json.dumps({
-            "inputText": cleaned_text,
-            "dimensions": 1024,
-            "normalize": True
-        })
+        body=_titan_body(text)
     )
+    # botocore retries throttling on its own; count how often it had to
+    registry.inc(EXTERNAL_RETRIES, response['ResponseMetadata'].get('RetryAttempts', 0), service="bedrock", reason="botocore")
     body = json.loads(response['body'].read())
     return body['embedding']
 
-def search_vector_db(query_text: str, top_k: int = 5):
+def _store_embeddings(entries: dict):
     """
-    Semantically searches the Postgres DB using pgvector
+    Persists {content_hash: vector} into the cache. Races with other workers are fine.
     """
-    query_vec = get_embedding(query_text)
-    
-    # FIX IS HERE: .select_related('document')
-    # This fetches the Document title immediately, preventing the async error later.
-    results = DocumentChunk.objects.select_related('document').annotate(
-        distance=CosineDistance('embedding', query_vec)
-    ).order_by('distance')[:top_k]
-    
-    return results
-
+    EmbeddingCache.objects.bulk_create(
+        [
+            EmbeddingCache(
+                content_hash=key,
+                model_id=TITAN_MODEL_ID,
+                dimensions=EMBEDDING_DIMENSIONS,
+                embedding=vec
+            )
+            for key, vec in entries.items()
+        ],
+        ignore_conflicts=True
+    )
 
-def search_hybrid(query_text: str, top_k: int = 15):
+def get_embeddings(texts: list, max_workers: int = None, on_progress=None) -> list:
     """
-    Performs Hybrid Search with RRF Fusion
+    Embeds many texts with a bounded pool of in-flight Titan requests.
+    Results come back in the same order as the input texts.
+    Cached and repeated texts (boilerplate pages) are only embedded once.
+    `on_progress(done_count)` is called after each embedding completes.
     """
-    # 1. Run Vector Search
-    vector_results = search_vector_db(query_text, top_k=20)
-    
-    # 2. Run Keyword Search
-    keyword_results = DocumentChunk.objects.annotate(
-        rank=SearchRank(F('search_vector'), SearchQuery(query_text))
-    ).filter(rank__gt=0).order_by('-rank')[:20]
-
-    # 3. Apply Reciprocal Rank Fusion (RRF)
-    k_constant = 60
-    rrf_scores = {}
-
-    for rank, item in enumerate(vector_results):
-        if item.id not in rrf_scores: rrf_scores[item.id] = 0
-        rrf_scores[item.id] += 1 / (k_constant + rank + 1)
-
-    for rank, item in enumerate(keyword_results):
-        if item.id not in rrf_scores: rrf_scores[item.id] = 0
-        rrf_scores[item.id] += 1 / (k_constant + rank + 1)
-
-    # 4. Sort IDs by Score
-    sorted_ids = sorted(rrf_scores, key=rrf_scores.get, reverse=True)[:top_k]
+    if not texts:
+        return []
+
+    keys = [embedding_cache_key(t) for t in texts]
+
+    # 1. One lookup for the whole batch
+    found = {
+        row_key: list(vec)
+        for row_key, vec in EmbeddingCache.objects.filter(content_hash__in=set(keys)).values_list('content_hash', 'embedding')
+    }
+
+    # 2. Embed each distinct missing text once
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+
+    # How many input texts resolve to each missing key (for progress reporting)
+    fan_out = {}
+    for key in keys:
+        if key in missing:
+            fan_out[key] = fan_out.get(key, 0) + 1
+
+    done = len(texts) - sum(fan_out.values())
+    if on_progress and done: on_progress(done)
+
+    missing_keys = list(missing)
+    fresh = {}
+
+    if missing_keys:
+        workers = max_workers or settings.EMBEDDING_CONCURRENCY
+        workers = max(1, min(workers, len(missing_keys)))
+
+        # executor.map keeps input order, so key N always lines up with vector N
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as pool:
+            vectors = pool.map(_invoke_titan, [missing[k] for k in missing_keys])
+            for key, vec in zip(missing_keys, vectors):
+                fresh[key] = vec
+                done += fan_out[key]
+                if on_progress: on_progress(done)
+
+    # 3. Remember new vectors for the next revision of this contract
+    if fresh:
+        _store_embeddings(fresh)
+        found.update(fresh)
+
+    return [found[key] for key in keys]
+
+def load_chunk_embeddings(chunk_ids: list) -> list:
+    """
+    Embeddings of the given chunks, in the same order (one query).
+    """
+    vectors = dict(DocumentChunk.objects.filter(id__in=chunk_ids).values_list('id', 'embedding'))
+    return [vectors[chunk_id] for chunk_id in chunk_ids]
 
-    # 5. Fetch Objects & ATTACH SCORES (The Fix)
-    candidates = DocumentChunk.objects.filter(id__in=sorted_ids).select_related('document')
+def _load_scored_chunks(scored_ids: list) -> list:
+    """
+    Fetches chunks for [(id, score), ...] in one query, keeping rank order.
+    """
+    candidates = (
+        DocumentChunk.objects
+        .filter(id__in=[_id for _id, _ in scored_ids])
+        .select_related('document')
+        .defer('embedding', 'search_vector')
+    )
     candidate_map = {c.id: c for c in candidates}
     
     final_results = []
-    for _id in sorted_ids:
+    for _id, score in scored_ids:
         if _id in candidate_map:
             chunk = candidate_map[_id]
             # --- CRITICAL FIX: Attach the score dynamically ---
-            chunk.score = rrf_scores[_id] 
+            chunk.score = score
             final_results.append(chunk)
 
     return final_results
 
-# api/services.py (Update this function)
+# Signed URLs are reused until well before they expire (SigV4 signing is not free
+# when a broad answer cites hundreds of chunks)
+presigned_url_cache = LRUCache(
+    max_entries=settings.PRESIGNED_URL_CACHE_SIZE,
+    ttl=settings.PRESIGNED_URL_CACHE_TTL
+)
 
-    
 def create_presigned_url(object_key: str, expiration: int = 3600) -> str:
     """
     Generates a temporary, viewable (pre-signed) URL.
     Adapted to work with the 's3_key' stored in Postgres.
+    Served from presigned_url_cache while the cached URL has plenty of life left.
     """
     # 1. Validation
     if not object_key:
         print(f"⚠️ Cannot generate pre-signed URL: Key is missing.")
         return None
 
+    cache_key = (object_key, expiration)
+    cached = presigned_url_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     # 2. Check S3 Client
     # We use the global 's3_client' we initialized at the top of services.py
     if s3_client is None:
@@ -154,15 +271,27 @@ def create_presigned_url(object_key: str, expiration: int = 3600) -> str:
             },
             ExpiresIn=expiration
         )
+        # Never hand out a cached URL within PRESIGNED_URL_MIN_REMAINING seconds of expiry
+        ttl = min(presigned_url_cache.ttl, expiration - settings.PRESIGNED_URL_MIN_REMAINING)
+        if ttl > 0:
+            presigned_url_cache.set(cache_key, url, ttl=ttl)
         return url
         
     except ClientError as e:
+        registry.inc(ERRORS, where="url_signing")
         print(f"❌ Failed to generate pre-signed URL for {object_key}. Error: {e}")
         return None
     except Exception as e:
         print(f"❌ An unexpected error occurred generating pre-signed URL: {e}")
         return None
     
+def create_presigned_urls(object_keys, expiration: int = 3600) -> dict:
+    """
+    Signs each distinct key once. Returns {s3_key: url}.
+    """
+    with span("url_signing"):
+        return {key: create_presigned_url(key, expiration) for key in set(object_keys)}
+
 # --- NEW: Dedicated LLM Client Setup ---
 # Initialize a separate session for the LLM using the new specific keys
 azure_client = AzureOpenAI(
@@ -175,13 +304,12 @@ azure_client = AzureOpenAI(
 # e.g., "gpt-5-deployment" or "my-gpt-model"
 DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-5") 
 
-def call_llm(context_text: str, user_query: str) -> str:
-    # 1. TIME INJECTION
-    current_date = datetime.now().strftime("%A, %B %d, %Y")
-    
+def build_llm_messages(context_text: str, user_query: str) -> list:
     """
-    Calls Azure OpenAI (GPT Chat Model)
+    System prompt + context/question messages shared by acall_llm and astream_llm.
     """
+    # 1. TIME INJECTION
+    current_date = datetime.now().strftime("%A, %B %d, %Y")
     
     # 2. System Prompt (Cleaned up for Chat API)
     # We don't need the <|begin_of_text|> tags anymore; the Chat API handles roles natively.
@@ -217,83 +345,411 @@ def call_llm(context_text: str, user_query: str) -> str:
     """
 
     # 3. Message Construction
-    messages = [
+    return [
         {"role": "system", "content": system_instruction},
         {"role": "user", "content": f"Context:\n{context_text}\n\nQuestion: {user_query}"}
     ]
 
+SUMMARY_SYSTEM_PROMPT = """
+    You write summaries of contracts for a search index. Be factual and dense: keep the
+    parties, dates, amounts, durations, obligations, termination and liability terms.
+    Plain prose, no preamble, no markdown headers.
+"""
+
+def summarize_text(prompt: str, max_tokens: int = 400) -> str:
+    """
+    One summary completion (ingest time, so the sync client).
+    """
+    response = azure_client.chat.completions.create(
+        model=DEPLOYMENT_NAME,
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.0,
+        max_tokens=max_tokens
+    )
+    record_llm_usage("summary", response.usage)
+    return (response.choices[0].message.content or "").strip()
+
+# Retrieval depths for the three intent categories (shared by both classifier modes)
+DEPTH_FACT = 10
+DEPTH_COMPARE = 50
+DEPTH_BROAD = 600
+
+# Broad means corpus scope ("all contracts", "across our agreements", "which contracts"),
+# not just a quantifier: "how many days notice..." or "which of the parties..." are facts
+_DOCS = r"(contracts|documents|files|agreements|pdfs)"
+_DETERMINER = r"((the|our|my|these|those)\s+)?"
+_BROAD_PATTERN = re.compile(
+    rf"\b((all|each|every)\s+(of\s+)?{_DETERMINER}{_DOCS}"
+    rf"|(each|every)\s+(contract|document|file|agreement|pdf)"
+    rf"|across\s+(all\s+)?{_DETERMINER}{_DOCS}"
+    rf"|which\s+(of\s+)?{_DETERMINER}{_DOCS}"
+    rf"|how\s+many\s+{_DOCS}"
+    rf"|(any|none)\s+of\s+(the|our|my|these|those)\s+{_DOCS})\b",
+    re.IGNORECASE
+)
+# "List / summarize" only counts as broad over the collection, not one named contract
+_AGGREGATE_PATTERN = re.compile(r"\b(list|enumerate|summar\w*|overview)\b", re.IGNORECASE)
+_COLLECTION_PATTERN = re.compile(rf"\b(the|our|my|these|those)\s+{_DOCS}\b", re.IGNORECASE)
+# ... or over every item of a kind ("list all auto-renewal clauses"), unless one named
+# document is the scope ("summarize all liability caps in the Acme contract")
+_AGGREGATE_ALL_PATTERN = re.compile(r"\b(list|enumerate|summar\w*|overview)\b.*?\b(all|every|each)\b", re.IGNORECASE)
+_SINGLE_DOCUMENT_PATTERN = re.compile(
+    r"\b(the|this|that)\s+(\w+\s+){0,3}?(contract|document|file|agreement|pdf)\b", re.IGNORECASE
+)
+_COMPARE_PATTERN = re.compile(
+    r"\b(compare|comparison|contrast|versus|vs\.?|difference|differences|differ|similarit(y|ies))\b",
+    re.IGNORECASE
+)
+
+def classify_search_depth(user_query: str) -> int:
+    """
+    Local (regex) version of adetermine_search_depth. Same categories as the
+    LLM prompt, but runs in microseconds with no network round trip.
+    """
+    if _BROAD_PATTERN.search(user_query):
+        return DEPTH_BROAD
+    if _AGGREGATE_PATTERN.search(user_query) and _COLLECTION_PATTERN.search(user_query):
+        return DEPTH_BROAD
+    if _AGGREGATE_ALL_PATTERN.search(user_query) and not _SINGLE_DOCUMENT_PATTERN.search(user_query):
+        return DEPTH_BROAD
+    if _COMPARE_PATTERN.search(user_query):
+        return DEPTH_COMPARE
+    return DEPTH_FACT
+
+DEPTH_SYSTEM_PROMPT = """
+    You are a Search Optimization Engine. Analyze the user's query and output ONLY a single integer representing the optimal number of document chunks ('top_k') to retrieve.
+
+    RULES:
+    - If the query seeks a specific fact (e.g., "What is the date?", "Who is..."), output {fact}.
+    - If the query asks for a comparison (e.g., "Compare X and Y"), output {compare}.
+    - If the query is broad, exhaustive, or asks for lists (e.g., "List all...", "Summary of..."), output {broad}.
+    
+    Output ONLY the integer. No text.
+    """.format(fact=DEPTH_FACT, compare=DEPTH_COMPARE, broad=DEPTH_BROAD)
+
+def _parse_depth_answer(answer: str):
+    # Extract number safely
+    match = re.search(r'\d+', (answer or "").strip())
+    if match:
+        return max(5, min(int(match.group()), 1000))
+    return None
+
+# --- Async Service Layer (used by the /chat endpoints) ---
+# Network calls are awaited on shared connection pools instead of holding a
+# thread-pool slot for the whole round trip. Only the short Postgres queries
+# still hop to a thread (Django's DB layer is sync underneath).
+#
+# S3 is not in here: create_presigned_url only signs locally, no I/O.
+
+_async_limits = httpx.Limits(
+    max_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS
+)
+
+# The openai client retries 408/409/429/5xx itself (max_retries); count those responses
+_AZURE_RETRYABLE = {408, 409, 429, 500, 502, 503, 504}
+
+async def _count_azure_retries(response: httpx.Response):
+    if response.status_code in _AZURE_RETRYABLE:
+        registry.inc(EXTERNAL_RETRIES, service="azure_openai", reason=f"http_{response.status_code}")
+
+azure_async_client = AsyncAzureOpenAI(
+    azure_endpoint=os.getenv("AZURE_OPENAI_END_POINT"),
+    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+    api_version="2024-12-01-preview",
+    http_client=DefaultAsyncHttpxClient(limits=_async_limits, event_hooks={"response": [_count_azure_retries]})
+)
+
+# Bedrock has no async SDK in our stack, so we sign requests with botocore's
+# SigV4 (same credentials as bedrock_client) and send them with httpx.
+bedrock_http = httpx.AsyncClient(limits=_async_limits, timeout=httpx.Timeout(30.0))
+BEDROCK_INVOKE_URL = f"{bedrock_client.meta.endpoint_url}/model/{quote(TITAN_MODEL_ID, safe='')}/invoke"
+BEDROCK_MAX_ATTEMPTS = 3
+
+async def _ainvoke_titan(text: str) -> list:
+    body = _titan_body(text)
+
+    for attempt in range(1, BEDROCK_MAX_ATTEMPTS + 1):
+        request = AWSRequest(
+            method="POST",
+            url=BEDROCK_INVOKE_URL,
+            data=body,
+            headers={"Content-Type": "application/json", "Accept": "application/json"}
+        )
+        credentials = session.get_credentials().get_frozen_credentials()
+        SigV4Auth(credentials, "bedrock", bedrock_client.meta.region_name).add_auth(request)
+
+        response = await bedrock_http.post(BEDROCK_INVOKE_URL, content=body, headers=dict(request.headers.items()))
+
+        # Throttling / transient errors: back off and retry, like botocore would
+        if response.status_code in (429, 500, 502, 503, 504) and attempt < BEDROCK_MAX_ATTEMPTS:
+            registry.inc(EXTERNAL_RETRIES, service="bedrock", reason=f"http_{response.status_code}")
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            continue
+
+        response.raise_for_status()
+        return response.json()['embedding']
+
+async def aget_embedding(text: str) -> list:
+    """
+    Titan v2 embedding of one text. Identical (normalized) text is served
+    from the EmbeddingCache table (async ORM).
+    """
+    key = embedding_cache_key(text)
+    cached = await EmbeddingCache.objects.filter(content_hash=key).values_list('embedding', flat=True).afirst()
+    if cached is not None:
+        return list(cached)
+
+    vec = await _ainvoke_titan(text)
+    await sync_to_async(_store_embeddings)({key: vec})
+    return vec
+
+async def aget_query_embedding(query_text: str) -> list:
+    key = query_cache.make_key("embedding", normalize_query(query_text))
+    vec = query_cache.get(key)
+    if vec is None:
+        with span("query_embedding"):
+            vec = await aget_embedding(query_text)
+        query_cache.set(key, vec)
+    return vec
+
+def hybrid_depths(top_k: int) -> tuple:
+    """
+    (vector_k, keyword_k) for a search that returns top_k chunks. Each branch ranks
+    at least top_k candidates (HYBRID_VECTOR_K / HYBRID_KEYWORD_K are the floor), so
+    broad searches get deep branches, and hnsw.ef_search grows with them.
+    """
+    return max(settings.HYBRID_VECTOR_K, top_k), max(settings.HYBRID_KEYWORD_K, top_k)
+
+
+async def asearch_hybrid(query_text: str, top_k: int = 15, vector_k: int = None, keyword_k: int = None,
+                         filters: dict = None, version: str = None):
+    """
+    Performs Hybrid Search with RRF Fusion, in a single SQL round trip.
+    vector_k / keyword_k are the candidate depths of each branch (default: hybrid_depths(top_k)).
+    Fused (id, score) lists are cached per (query, depths, filters, corpus version);
+    pass the request's corpus_version() as `version` to save the lookup.
+    """
+    default_vector_k, default_keyword_k = hybrid_depths(top_k)
+    vector_k = vector_k or default_vector_k
+    keyword_k = keyword_k or default_keyword_k
+    filters = normalize_filters(filters)
+
+    version = version or await sync_to_async(corpus_version)()
+    cache_key = query_cache.make_key(
+        "retrieval", normalize_query(query_text), top_k, vector_k, keyword_k, sorted(filters.items()), version
+    )
+    cached = query_cache.get(cache_key)
+    if cached is not None:
+        with span("chunk_load"):
+            return await sync_to_async(_load_scored_chunks)(cached)
+
+    query_vec = await aget_query_embedding(query_text)
+
+    results = await sync_to_async(run_hybrid_query)(
+        query_vec,
+        query_text,
+        top_k=top_k,
+        vector_k=vector_k,
+        keyword_k=keyword_k,
+        rrf_k=settings.HYBRID_RRF_K,
+        filters=filters
+    )
+
+    query_cache.set(cache_key, [(c.id, c.score) for c in results])
+    return results
+
+async def aget_query_embeddings(query_texts: list) -> list:
+    """
+    aget_query_embedding for many queries: query cache, then one EmbeddingCache
+    lookup, then concurrent Titan calls (EMBEDDING_CONCURRENCY) for the rest.
+    Vectors come back in input order.
+    """
+    cache_keys = [query_cache.make_key("embedding", normalize_query(q)) for q in query_texts]
+    vectors = [query_cache.get(key) for key in cache_keys]
+    missing = {}
+    for query, vec in zip(query_texts, vectors):
+        if vec is None:
+            missing.setdefault(embedding_cache_key(query), query)
+
+    if missing:
+        with span("query_embedding"):
+            found = {
+                key: list(vec)
+                async for key, vec in EmbeddingCache.objects
+                .filter(content_hash__in=list(missing))
+                .values_list('content_hash', 'embedding')
+            }
+            fresh_keys = [key for key in missing if key not in found]
+            semaphore = asyncio.Semaphore(settings.EMBEDDING_CONCURRENCY)
+
+            async def embed(key):
+                async with semaphore:
+                    return await _ainvoke_titan(missing[key])
+
+            fresh = dict(zip(fresh_keys, await asyncio.gather(*(embed(key) for key in fresh_keys))))
+            if fresh:
+                await sync_to_async(_store_embeddings)(fresh)
+                found.update(fresh)
+
+        for i, (query, vec) in enumerate(zip(query_texts, vectors)):
+            if vec is None:
+                vectors[i] = found[embedding_cache_key(query)]
+                query_cache.set(cache_keys[i], vectors[i])
+    return vectors
+
+async def asearch_hybrid_batch(query_texts: list, top_ks: list, filters: dict = None, version: str = None) -> list:
+    """
+    asearch_hybrid for many queries: one embedding pass, one search statement for
+    every query not in the retrieval cache, one chunk load for those that were.
+    Returns one result list per query, in order.
+    """
+    depths = [hybrid_depths(top_k) for top_k in top_ks]
+    filters = normalize_filters(filters)
+
+    version = version or await sync_to_async(corpus_version)()
+    cache_keys = [
+        query_cache.make_key("retrieval", normalize_query(q), top_k, vector_k, keyword_k, sorted(filters.items()), version)
+        for q, top_k, (vector_k, keyword_k) in zip(query_texts, top_ks, depths)
+    ]
+    cached = [query_cache.get(key) for key in cache_keys]
+    results = [None] * len(query_texts)
+
+    hits = [i for i, scored in enumerate(cached) if scored is not None]
+    if hits:
+        with span("chunk_load"):
+            loaded = await sync_to_async(_load_scored_chunks)(
+                list({_id: 0.0 for i in hits for _id, _ in cached[i]}.items())
+            )
+        chunk_map = {c.id: c for c in loaded}
+        for i in hits:
+            results[i] = []
+            for _id, score in cached[i]:
+                if _id in chunk_map:
+                    chunk = copy.copy(chunk_map[_id]) # Same chunk, per-query score
+                    chunk.score = score
+                    results[i].append(chunk)
+
+    misses = [i for i, scored in enumerate(cached) if scored is None]
+    if misses:
+        query_vecs = await aget_query_embeddings([query_texts[i] for i in misses])
+        searched = await sync_to_async(run_hybrid_queries)(
+            [(vec, query_texts[i], top_ks[i], *depths[i]) for i, vec in zip(misses, query_vecs)],
+            rrf_k=settings.HYBRID_RRF_K,
+            filters=filters
+        )
+        for i, chunks in zip(misses, searched):
+            query_cache.set(cache_keys[i], [(c.id, c.score) for c in chunks])
+            results[i] = chunks
+
+    return results
+
+async def adetermine_search_depth(user_query: str, mode: str = None) -> int:
+    """
+    Uses Azure OpenAI to dynamically decide retrieval depth.
+    With mode "local" (settings.SEARCH_DEPTH_MODE) the regex classifier is used instead.
+    Successful answers are cached per normalized query.
+    """
+    if (mode or settings.SEARCH_DEPTH_MODE) == "local":
+        return classify_search_depth(user_query)
+
+    cache_key = query_cache.make_key("depth", normalize_query(user_query))
+    cached = query_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        response = azure_client.chat.completions.create(
+        response = await azure_async_client.chat.completions.create(
+            model=DEPLOYMENT_NAME,
+            messages=[
+                {"role": "system", "content": DEPTH_SYSTEM_PROMPT},
+                {"role": "user", "content": user_query}
+            ],
+            temperature=0.0, # Deterministic
+            max_tokens=10
+        )
+        record_llm_usage("intent", response.usage)
+
+        k = _parse_depth_answer(response.choices[0].message.content)
+        if k is not None:
+            query_cache.set(cache_key, k)
+            return k
+        return 20
+
+    except Exception as e:
+        registry.inc(ERRORS, where="intent_analysis")
+        print(f"⚠️ Intent Error (Azure): {e}")
+        return 20
+
+async def acall_llm(context_text: str, user_query: str) -> str:
+    """
+    Calls Azure OpenAI (GPT Chat Model). An empty answer is retried once with half the context.
+    """
+    messages = build_llm_messages(context_text, user_query)
+
+    with span("llm_call"):
+        return await _acall_llm(messages, context_text, user_query)
+
+async def _acall_llm(messages: list, context_text: str, user_query: str) -> str:
+    try:
+        response = await azure_async_client.chat.completions.create(
             model=DEPLOYMENT_NAME,
             messages=messages,
             temperature=0.1,
             max_tokens=2048,
             top_p=0.9
         )
-        
+        record_llm_usage("answer", response.usage)
+
         answer = response.choices[0].message.content.strip()
 
-        # --- FALLBACK RETRY LOGIC (Same as before but adapted) ---
         # If response is empty, retry with half context
         if not answer:
             print("⚠️ Empty response from Azure. Retrying with shorter context...")
+            registry.inc(EXTERNAL_RETRIES, service="azure_openai", reason="empty_answer")
             half_context = context_text[:len(context_text)//2]
-            
+
             messages[1]['content'] = f"Context:\n{half_context}\n\nQuestion: {user_query}"
-            
-            response = azure_client.chat.completions.create(
+
+            response = await azure_async_client.chat.completions.create(
                 model=DEPLOYMENT_NAME,
                 messages=messages,
                 temperature=0.1,
                 max_tokens=2048
             )
+            record_llm_usage("answer", response.usage)
             answer = response.choices[0].message.content.strip()
-            
+
             if not answer:
                 return "Error: The query and documents are too large for the model to process at once. Please ask a more specific question."
 
         return answer
 
     except Exception as e:
-        print(f"CRITICAL ERROR in call_llm (Azure): {str(e)}")
+        registry.inc(ERRORS, where="llm_call")
+        print(f"CRITICAL ERROR in acall_llm (Azure): {str(e)}")
         return f"Error calling AI: System is currently overloaded. {str(e)}"
 
-
-def determine_search_depth(user_query: str) -> int:
+async def astream_llm(context_text: str, user_query: str):
     """
-    Uses Azure OpenAI to dynamically decide retrieval depth.
-    """
-    system_instruction = """
-    You are a Search Optimization Engine. Analyze the user's query and output ONLY a single integer representing the optimal number of document chunks ('top_k') to retrieve.
-
-    RULES:
-    - If the query seeks a specific fact (e.g., "What is the date?", "Who is..."), output 10.
-    - If the query asks for a comparison (e.g., "Compare X and Y"), output 50.
-    - If the query is broad, exhaustive, or asks for lists (e.g., "List all...", "Summary of..."), output 600.
-    
-    Output ONLY the integer. No text.
+    Streaming variant of acall_llm: yields text deltas as Azure OpenAI produces them.
     """
-
-    try:
-        response = azure_client.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=[
-                {"role": "system", "content": system_instruction},
-                {"role": "user", "content": user_query}
-            ],
-            temperature=0.0, # Deterministic
-            max_tokens=10
-        )
-        
-        answer = response.choices[0].message.content.strip()
-        
-        # Extract number safely
-        match = re.search(r'\d+', answer)
-        if match:
-            k = int(match.group())
-            return max(5, min(k, 1000))
-        return 20 
-        
-    except Exception as e:
-        print(f"⚠️ Intent Error (Azure): {e}")
-        return 20
\ No newline at end of file
+    stream = await azure_async_client.chat.completions.create(
+        model=DEPLOYMENT_NAME,
+        messages=build_llm_messages(context_text, user_query),
+        temperature=0.1,
+        max_tokens=2048,
+        top_p=0.9,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    async for event in stream:
+        # Azure sends a first chunk with prompt filter results and no choices,
+        # and (with include_usage) a last one with only the token counts
+        if event.choices and event.choices[0].delta and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
+        if getattr(event, "usage", None):
+            record_llm_usage("answer_stream", event.usage)
@@ -0,0 +1,199 @@
+# api/summaries.py
+# Summary tier: per-section and per-document summaries written at ingest time,
+# embedded like chunks. Broad queries read this tier instead of ~1800 raw chunks.
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .models import DocumentChunk, DocumentSummary
+from .cache import query_cache, corpus_version
+from .services import summarize_text, get_embeddings, aget_query_embedding, asearch_hybrid
+from .search import run_summary_query, count_unsummarized, normalize_filters
+from .chunking import get_encoding, count_tokens
+
+SECTION_SUMMARY_TOKENS = 300
+DOCUMENT_SUMMARY_TOKENS = 600
+
+
+def split_sections(chunks: list, max_tokens: int = None) -> list:
+    """
+    Groups DocumentChunks (document order) into runs of about max_tokens source tokens.
+    """
+    max_tokens = max_tokens or settings.SUMMARY_SECTION_TOKENS
+    sections, current, used = [], [], 0
+    for chunk in chunks:
+        if current and used + chunk.token_count > max_tokens:
+            sections.append(current)
+            current, used = [], 0
+        current.append(chunk)
+        used += chunk.token_count
+    if current:
+        sections.append(current)
+    return sections
+
+
+def _section_prompt(title: str, section: list) -> str:
+    text = "\n\n".join(chunk.text_content for chunk in section)
+    return (
+        f"Summarize pages {section[0].page}-{section[-1].page} of the contract \"{title}\" "
+        f"in at most 150 words.\n\n{text}"
+    )
+
+
+def _document_prompt(title: str, section_summaries: list) -> str:
+    # Bounded by the chat context budget, so a 1000-page contract still fits one call
+    encoding = get_encoding(settings.CHUNK_TOKENIZER)
+    parts, used = [], 0
+    for i, summary in enumerate(section_summaries):
+        tokens = count_tokens(summary, encoding)
+        if used + tokens > settings.LLM_CONTEXT_TOKENS:
+            break
+        parts.append(f"Section {i + 1}: {summary}")
+        used += tokens
+    return (
+        f"These are summaries of consecutive sections of the contract \"{title}\". "
+        f"Write one summary of the whole contract in at most 300 words.\n\n" + "\n\n".join(parts)
+    )
+
+
+def load_document_chunks(doc) -> list:
+    """
+    A document's DocumentChunks in document order, without the vectors.
+    """
+    return list(
+        DocumentChunk.objects
+        .filter(document=doc)
+        .order_by('chunk_index')
+        .defer('embedding', 'search_vector')
+    )
+
+
+def build_summaries(doc, chunks: list) -> list:
+    """
+    Writes the summary tier of one document: a summary per section, then one of the
+    whole document built from those (a single-section document only gets the latter).
+    `chunks` are its DocumentChunks in document order. Returns the saved rows.
+    """
+    sections = split_sections(chunks)
+    if not sections:
+        return []
+
+    with ThreadPoolExecutor(max_workers=settings.SUMMARY_CONCURRENCY, thread_name_prefix="summarize") as pool:
+        section_texts = list(pool.map(
+            lambda section: summarize_text(_section_prompt(doc.title, section), SECTION_SUMMARY_TOKENS),
+            sections
+        ))
+
+    if len(sections) == 1:
+        document_text, section_texts = section_texts[0], []
+    else:
+        document_text = summarize_text(_document_prompt(doc.title, section_texts), DOCUMENT_SUMMARY_TOKENS)
+
+    encoding = get_encoding(settings.CHUNK_TOKENIZER)
+    vectors = get_embeddings([document_text] + section_texts)
+    rows = [
+        DocumentSummary(
+            document=doc,
+            level=DocumentSummary.LEVEL_DOCUMENT,
+            section_index=0,
+            page_start=1,
+            page_end=doc.total_pages,
+            text_content=document_text,
+            token_count=count_tokens(document_text, encoding),
+            embedding=vectors[0]
+        )
+    ]
+    for i, (section, text, vec) in enumerate(zip(sections, section_texts, vectors[1:])):
+        rows.append(DocumentSummary(
+            document=doc,
+            level=DocumentSummary.LEVEL_SECTION,
+            section_index=i + 1,
+            page_start=section[0].page,
+            page_end=section[-1].page,
+            text_content=text,
+            token_count=count_tokens(text, encoding),
+            embedding=vec
+        ))
+
+    DocumentSummary.objects.filter(document=doc).delete() # Rebuilds replace the old tier
+    return DocumentSummary.objects.bulk_create(rows)
+
+
+def _load_summaries(hits: list) -> tuple:
+    """
+    (document summaries, section summaries) for [(id, distance), ...], best first.
+    Every document with a hit gets its document summary, even if only a section matched.
+    """
+    scores = {summary_id: 1.0 - distance for summary_id, distance in hits}
+    found = (
+        DocumentSummary.objects
+        .filter(id__in=scores)
+        .select_related('document')
+        .defer('embedding')
+    )
+    sections, overviews = [], {}
+    doc_order = {} # Documents by their best hit, insertion-ordered
+    for summary in sorted(found, key=lambda s: scores[s.id], reverse=True):
+        summary.score = scores[summary.id]
+        doc_order.setdefault(summary.document_id, None)
+        if summary.level == DocumentSummary.LEVEL_DOCUMENT:
+            overviews[summary.document_id] = summary
+        else:
+            sections.append(summary)
+
+    missing = [doc_id for doc_id in doc_order if doc_id not in overviews]
+    if missing:
+        extra = (
+            DocumentSummary.objects
+            .filter(document_id__in=missing, level=DocumentSummary.LEVEL_DOCUMENT)
+            .select_related('document')
+            .defer('embedding')
+        )
+        for summary in extra:
+            summary.score = 0.0
+            overviews[summary.document_id] = summary
+
+    return [overviews[doc_id] for doc_id in doc_order if doc_id in overviews], sections
+
+
+async def _unsummarized(filters: dict, version: str) -> int:
+    version = version or await sync_to_async(corpus_version)()
+    cache_key = query_cache.make_key("unsummarized", sorted(filters.items()), version)
+    count = query_cache.get(cache_key)
+    if count is None:
+        count = await sync_to_async(count_unsummarized)(filters)
+        query_cache.set(cache_key, count)
+    return count
+
+
+async def retrieve_summary_tier(query: str, filters: dict = None, version: str = None):
+    """
+    Context candidates for a broad query, in packing order: document summaries,
+    matching section summaries, then the best chunks of the top documents.
+    None when the tier doesn't cover every document in scope (not built yet, or
+    partly), so callers fall back to chunks instead of silently missing documents.
+    """
+    filters = normalize_filters(filters)
+    missing = await _unsummarized(filters, version)
+    if missing:
+        print(f"📚 {missing} documents in scope have no summaries: using chunk retrieval.")
+        return None
+
+    query_vec = await aget_query_embedding(query)
+    hits = await sync_to_async(run_summary_query)(query_vec, settings.SUMMARY_TOP_K, filters=filters)
+    if not hits:
+        return None
+
+    overviews, sections = await sync_to_async(_load_summaries)(hits)
+
+    # Drill down: raw chunks only for the few documents that matter most
+    drill_docs = [summary.document_id for summary in overviews[:settings.SUMMARY_DRILL_DOCUMENTS]]
+    chunks = []
+    if drill_docs:
+        chunks = await asearch_hybrid(
+            query,
+            top_k=settings.SUMMARY_DRILL_CHUNKS,
+            filters={**(filters or {}), "document_ids": drill_docs},
+            version=version
+        )
+
+    return overviews + sections + chunks
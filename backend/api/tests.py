@@ -1,3 +1,831 @@
-from django.test import TestCase
+import asyncio
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from unittest import mock
+import httpx
+import numpy as np
+from django.core.cache import caches
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from .cache import LRUCache, QueryCache, SemanticAnswerCache, normalize_query
+from .chunking import chunk_page, chunk_pages, count_tokens, get_encoding, MIN_PAGE_CHARS
+from .chat import (
+    AnswerParser, parse_llm_response, reduce_partial_answers, FALLBACK_REASON, GENERAL_SOURCE, NOT_FOUND_ANSWER
+)
+from . import batch, hot_tier, ingest, services
+from .db_setup import quantized_index
+from .ingest import _delete_partial_document
+from .metrics import ERRORS, EXTERNAL_RETRIES, STAGE_SECONDS, MetricsRegistry, span, start_timings
+from .models import Document, IngestionJob
+from .mmr import mmr_select
+from . import pdf_extract
+from .search import batch_hybrid_sql, ef_search_for, hybrid_sql, run_hybrid_queries, VECTOR_MODES
+from .services import (
+    classify_search_depth, create_presigned_url, embedding_cache_key, get_embeddings, hybrid_depths, presigned_url_cache,
+    DEPTH_FACT, DEPTH_COMPARE, DEPTH_BROAD
+)
 
-# Create your tests here.
+
+class ClassifySearchDepthTests(SimpleTestCase):
+    def test_fact_questions_stay_narrow(self):
+        for query in [
+            "How many days notice is required to terminate the Acme agreement?",
+            "Which of the parties is responsible for insurance?",
+            "Which party pays the invoices that are due every month?",
+            "How many days does Globex have under the warranty section?",
+            "What is the termination clause in the agreement with Initech?",
+            "List the payment terms in the Acme contract.",
+            "Summarize the indemnification clause of the Umbrella agreement.",
+            "Is the fee payable across state lines?",
+            "Does each party keep its own intellectual property?",
+            "Summarize all liability caps in the Acme contract.",
+            "List every termination right in this agreement.",
+            "List each payment milestone of the Globex Services Agreement.",
+        ]:
+            with self.subTest(query=query):
+                self.assertEqual(classify_search_depth(query), DEPTH_FACT)
+
+    def test_corpus_scope_is_broad(self):
+        for query in [
+            "Summarize the termination terms across all contracts.",
+            "List all contracts with an auto-renewal clause.",
+            "Which contracts mention force majeure?",
+            "Which of our agreements are governed by Delaware law?",
+            "How many agreements expire this year?",
+            "Does every contract have a confidentiality clause?",
+            "Give me an overview of our contracts.",
+            "Are any of the documents missing a signature page?",
+            "List all auto-renewal clauses.",
+            "Summary of all payment obligations",
+            "Summarize all liability caps",
+            "List every party we have signed with",
+            "Enumerate each governing law clause.",
+        ]:
+            with self.subTest(query=query):
+                self.assertEqual(classify_search_depth(query), DEPTH_BROAD)
+
+    def test_comparisons(self):
+        self.assertEqual(classify_search_depth("Compare the warranty of Acme and Globex."), DEPTH_COMPARE)
+        self.assertEqual(classify_search_depth("Compare the warranty across all contracts."), DEPTH_BROAD)
+
+
+@override_settings(HYBRID_VECTOR_K=20, HYBRID_KEYWORD_K=20, HNSW_EF_SEARCH_MIN=40,
+                   HNSW_EF_SEARCH_FACTOR=2, HNSW_EF_SEARCH_MAX=1000)
+class HybridDepthTests(SimpleTestCase):
+    def test_shallow_search_keeps_the_configured_depths(self):
+        self.assertEqual(hybrid_depths(15), (20, 20))
+
+    def test_deep_search_deepens_both_branches(self):
+        for top_k in (150, 300, 600):
+            with self.subTest(top_k=top_k):
+                self.assertEqual(hybrid_depths(top_k), (top_k, top_k))
+
+    def test_ef_search_follows_the_vector_depth(self):
+        self.assertEqual(ef_search_for(hybrid_depths(15)[0]), 40)
+        self.assertEqual(ef_search_for(hybrid_depths(150)[0]), 300)
+        self.assertEqual(ef_search_for(hybrid_depths(600)[0]), 1000)
+
+
+class GetEmbeddingsTests(SimpleTestCase):
+    def run_embeddings(self, texts, cached=(), max_workers=4):
+        calls = []
+
+        def titan(text):
+            calls.append(text)
+            # Later texts finish first, so completion order differs from input order
+            time.sleep(0.001 * (10 - len(calls) % 10))
+            return [float(len(text))]
+
+        progress = []
+        rows = [(embedding_cache_key(text), [-1.0]) for text in cached]
+        with mock.patch("api.services.EmbeddingCache.objects") as cache_rows, \
+                mock.patch("api.services._invoke_titan", side_effect=titan), \
+                mock.patch("api.services._store_embeddings") as store:
+            cache_rows.filter.return_value.values_list.return_value = rows
+            vectors = get_embeddings(texts, max_workers=max_workers, on_progress=progress.append)
+        return vectors, calls, progress, store
+
+    def test_results_follow_input_order(self):
+        texts = [f"clause {'x' * i}" for i in range(12)]
+        vectors, calls, progress, store = self.run_embeddings(texts)
+        self.assertEqual(vectors, [[float(len(text))] for text in texts])
+        self.assertEqual(sorted(calls), sorted(texts))
+        self.assertEqual(progress, list(range(1, 13)))
+        self.assertEqual(len(store.call_args.args[0]), 12)
+
+    def test_repeated_and_cached_texts_are_embedded_once(self):
+        texts = ["header", "body one", "header", "cached", "body  two", "header"]
+        vectors, calls, progress, store = self.run_embeddings(texts, cached=["cached"])
+        self.assertEqual(sorted(calls), ["body  two", "body one", "header"])
+        self.assertEqual(vectors, [[6.0], [8.0], [6.0], [-1.0], [9.0], [6.0]])
+        self.assertEqual(progress[0], 1) # The cache hit is reported up front
+        self.assertEqual(progress[-1], len(texts))
+        self.assertEqual(len(store.call_args.args[0]), 3)
+
+    def test_everything_cached(self):
+        vectors, calls, progress, store = self.run_embeddings(["a", "b"], cached=["a", "b"])
+        self.assertEqual(vectors, [[-1.0], [-1.0]])
+        self.assertEqual(calls, [])
+        self.assertEqual(progress, [2])
+        store.assert_not_called()
+
+
+@mock.patch("api.services.asyncio.sleep", new_callable=mock.AsyncMock)
+class BedrockInvokeTests(SimpleTestCase):
+    def invoke(self, *statuses):
+        request = httpx.Request("POST", services.BEDROCK_INVOKE_URL)
+        responses = [
+            httpx.Response(status, json={"embedding": [0.5]} if status == 200 else {}, request=request)
+            for status in statuses
+        ]
+        self.metrics = MetricsRegistry()
+        self.post = mock.AsyncMock(side_effect=responses)
+        with mock.patch.object(services.bedrock_http, "post", new=self.post), \
+                mock.patch("api.services.registry", self.metrics):
+            return asyncio.run(services._ainvoke_titan("clause"))
+
+    def test_requests_are_signed(self, sleep):
+        self.assertEqual(self.invoke(200), [0.5])
+        headers = self.post.call_args.kwargs["headers"]
+        self.assertTrue(headers["Authorization"].startswith("AWS4-HMAC-SHA256 "))
+        self.assertIn("/bedrock/aws4_request", headers["Authorization"])
+        self.assertIn("X-Amz-Date", headers)
+        self.assertEqual(self.post.call_args.kwargs["content"], services._titan_body("clause"))
+        sleep.assert_not_called()
+
+    def test_throttling_is_retried_with_backoff(self, sleep):
+        self.assertEqual(self.invoke(429, 503, 200), [0.5])
+        self.assertEqual(self.post.await_count, 3)
+        self.assertEqual([c.args[0] for c in sleep.await_args_list], [0.5, 1.0])
+        # Every attempt is signed again (fresh X-Amz-Date)
+        self.assertTrue(all("Authorization" in c.kwargs["headers"] for c in self.post.await_args_list))
+        rendered = self.metrics.render()
+        self.assertIn(f'{EXTERNAL_RETRIES}{{reason="http_429",service="bedrock"}} 1', rendered)
+        self.assertIn(f'{EXTERNAL_RETRIES}{{reason="http_503",service="bedrock"}} 1', rendered)
+
+    def test_gives_up_after_the_last_attempt(self, sleep):
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.invoke(*[503] * services.BEDROCK_MAX_ATTEMPTS)
+        self.assertEqual(self.post.await_count, services.BEDROCK_MAX_ATTEMPTS)
+        self.assertEqual(sleep.await_count, services.BEDROCK_MAX_ATTEMPTS - 1)
+
+    def test_client_errors_are_not_retried(self, sleep):
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.invoke(400)
+        self.assertEqual(self.post.await_count, 1)
+        sleep.assert_not_called()
+
+
+class MetricsRenderTests(SimpleTestCase):
+    def test_counters(self):
+        metrics = MetricsRegistry()
+        metrics.inc(ERRORS, where="search")
+        metrics.inc(ERRORS, 2, where="search")
+        metrics.inc(ERRORS, where='say "hi"\n')
+        metrics.inc(ERRORS, 0, where="never") # Zero increments don't create a series
+        self.assertEqual(metrics.render().splitlines(), [
+            f"# HELP {ERRORS} Failures, by where they happened.",
+            f"# TYPE {ERRORS} counter",
+            f'{ERRORS}{{where="say \\"hi\\"\\n"}} 1',
+            f'{ERRORS}{{where="search"}} 3',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics = MetricsRegistry()
+        for seconds in (0.003, 0.02, 0.02, 400):
+            metrics.observe(STAGE_SECONDS, seconds, stage="search")
+        lines = metrics.render().splitlines()
+        self.assertEqual(lines[:2], [f"# HELP {STAGE_SECONDS} Duration of one pipeline stage.", f"# TYPE {STAGE_SECONDS} histogram"])
+        self.assertIn(f'{STAGE_SECONDS}_bucket{{stage="search",le="0.005"}} 1', lines)
+        self.assertIn(f'{STAGE_SECONDS}_bucket{{stage="search",le="0.025"}} 3', lines)
+        self.assertIn(f'{STAGE_SECONDS}_bucket{{stage="search",le="300"}} 3', lines)
+        self.assertEqual(lines[-3:], [
+            f'{STAGE_SECONDS}_bucket{{stage="search",le="+Inf"}} 4',
+            f'{STAGE_SECONDS}_sum{{stage="search"}} 400.043000',
+            f'{STAGE_SECONDS}_count{{stage="search"}} 4',
+        ])
+
+    def test_empty_registry(self):
+        self.assertEqual(MetricsRegistry().render(), "\n")
+
+    def test_spans_add_up_per_request(self):
+        timings = start_timings()
+        with mock.patch("api.metrics.time.perf_counter", side_effect=[1.0, 1.5, 2.0, 2.25]):
+            with span("search"):
+                pass
+            with span("search"):
+                pass
+        self.assertEqual(timings, {"search": 0.75})
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a") # "b" is now the oldest
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_entries_expire_after_ttl(self):
+        cache = LRUCache(max_entries=10, ttl=60)
+        with mock.patch("api.cache.time.monotonic", return_value=1000.0):
+            cache.set("a", 1)
+            cache.set("b", 2, ttl=120)
+        with mock.patch("api.cache.time.monotonic", return_value=1061.0):
+            self.assertEqual(cache.get("a", "gone"), "gone")
+            self.assertEqual(cache.get("b"), 2)
+
+    def test_falsy_values_are_hits(self):
+        cache = LRUCache(max_entries=10, ttl=60)
+        cache.set("empty", [])
+        self.assertEqual(cache.get("empty", "miss"), [])
+
+
+@override_settings(PRESIGNED_URL_MIN_REMAINING=900)
+class PresignedUrlCacheTests(SimpleTestCase):
+    def setUp(self):
+        presigned_url_cache.clear()
+        self.addCleanup(presigned_url_cache.clear)
+        patcher = mock.patch("api.services.s3_client")
+        self.s3 = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.s3.generate_presigned_url.side_effect = lambda op, Params, ExpiresIn: f"{Params['Key']}?n={self.s3.generate_presigned_url.call_count}"
+
+    def sign_at(self, now, key="a.pdf", expiration=3600):
+        with mock.patch("api.cache.time.monotonic", return_value=now):
+            return create_presigned_url(key, expiration)
+
+    def test_reused_until_the_cache_ttl(self):
+        # Cache TTL (2700s) is shorter than 3600 - 900, so it wins
+        self.assertEqual(self.sign_at(1000.0), "a.pdf?n=1")
+        self.assertEqual(self.sign_at(1000.0 + presigned_url_cache.ttl - 1), "a.pdf?n=1")
+        self.assertEqual(self.sign_at(1000.0 + presigned_url_cache.ttl + 1), "a.pdf?n=2")
+
+    def test_short_lived_urls_expire_before_the_url_does(self):
+        self.assertEqual(self.sign_at(1000.0, expiration=1200), "a.pdf?n=1")
+        self.assertEqual(self.sign_at(1299.0, expiration=1200), "a.pdf?n=1")
+        # 300s cache lifetime: never hand out a URL with less than 900s left
+        self.assertEqual(self.sign_at(1301.0, expiration=1200), "a.pdf?n=2")
+
+    def test_urls_too_short_to_cache_are_signed_every_time(self):
+        self.sign_at(1000.0, expiration=600)
+        self.sign_at(1000.0, expiration=600)
+        self.assertEqual(self.s3.generate_presigned_url.call_count, 2)
+
+    def test_expiration_is_part_of_the_key(self):
+        self.sign_at(1000.0, expiration=3600)
+        self.sign_at(1000.0, expiration=7200)
+        self.assertEqual(self.s3.generate_presigned_url.call_count, 2)
+        self.assertEqual(self.s3.generate_presigned_url.call_args.kwargs["ExpiresIn"], 7200)
+
+
+class QueryCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_keys_depend_on_namespace_and_parts(self):
+        self.assertEqual(QueryCache.make_key("embedding", "q"), QueryCache.make_key("embedding", "q"))
+        self.assertNotEqual(QueryCache.make_key("embedding", "q"), QueryCache.make_key("depth", "q"))
+        self.assertNotEqual(QueryCache.make_key("retrieval", "q", 10), QueryCache.make_key("retrieval", "q", 20))
+
+    def test_local_only(self):
+        cache = QueryCache(max_entries=10, ttl=60)
+        self.assertIsNone(cache.shared)
+        cache.set("k", [1, 2])
+        self.assertEqual(cache.get("k"), [1, 2])
+        cache.clear()
+        self.assertIsNone(cache.get("k"))
+
+    def test_shared_backend_refills_local(self):
+        writer = QueryCache(max_entries=10, ttl=60, backend_alias="default")
+        reader = QueryCache(max_entries=10, ttl=60, backend_alias="default")
+        writer.set("k", 42)
+        self.assertEqual(reader.get("k"), 42) # From the shared alias...
+        caches["default"].clear()
+        self.assertEqual(reader.get("k"), 42) # ...and now from its own L1
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  What IS\tthe  Term? "), "what is the term?")
+
+
+class SemanticAnswerCacheTests(SimpleTestCase):
+    CHUNKS = [("documentchunk", 1), ("documentchunk", 2)]
+
+    def setUp(self):
+        self.cache = SemanticAnswerCache(max_entries=2, threshold=0.95)
+        self.cache.set([1.0, 0.0], self.CHUNKS, "v1", "answer")
+
+    def test_near_duplicate_question_hits(self):
+        self.assertEqual(self.cache.get([0.99, 0.05], self.CHUNKS, "v1"), "answer")
+        self.assertEqual(self.cache.get([3.0, 0.0], list(reversed(self.CHUNKS)), "v1"), "answer")
+
+    def test_different_question_misses(self):
+        self.assertIsNone(self.cache.get([0.6, 0.8], self.CHUNKS, "v1"))
+
+    def test_different_context_misses(self):
+        self.assertIsNone(self.cache.get([1.0, 0.0], self.CHUNKS[:1], "v1"))
+
+    def test_new_corpus_version_drops_everything(self):
+        self.assertIsNone(self.cache.get([1.0, 0.0], self.CHUNKS, "v2"))
+        self.assertIsNone(self.cache.get([1.0, 0.0], self.CHUNKS, "v1"))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set([0.0, 1.0], self.CHUNKS, "v1", "second")
+        self.cache.get([1.0, 0.0], self.CHUNKS, "v1")
+        self.cache.set([1.0, 0.0], self.CHUNKS[:1], "v1", "third")
+        self.assertEqual(self.cache.get([1.0, 0.0], self.CHUNKS, "v1"), "answer")
+        self.assertIsNone(self.cache.get([0.0, 1.0], self.CHUNKS, "v1"))
+
+    def test_disabled(self):
+        cache = SemanticAnswerCache(max_entries=0, threshold=0.95)
+        cache.set([1.0, 0.0], self.CHUNKS, "v1", "answer")
+        self.assertIsNone(cache.get([1.0, 0.0], self.CHUNKS, "v1"))
+
+
+SAMPLE_ANSWER = (
+    "Here is what I found.\n"
+    "### SOURCE: Acme MSA.pdf\n"
+    "Either party may terminate with 30 days notice. [[REASON: Section 12 sets the notice period.]]\n\n"
+    "### SOURCE: Globex NDA.pdf\n"
+    "[[EMPTY]]\n"
+    "### SOURCE: Initech SOW.pdf\n"
+    "Termination requires 60 days written notice to the vendor.\n"
+)
+
+
+class AnswerParserTests(SimpleTestCase):
+    def test_parse_llm_response(self):
+        answer, reasons = parse_llm_response(SAMPLE_ANSWER)
+        self.assertEqual(reasons, {
+            "Acme MSA.pdf": "Section 12 sets the notice period.",
+            "Initech SOW.pdf": FALLBACK_REASON,
+        })
+        self.assertIn("### SOURCE: Acme MSA.pdf\nEither party may terminate with 30 days notice.", answer)
+        self.assertNotIn("[[REASON", answer)
+        self.assertNotIn("Globex", answer) # Empty sections are dropped with their header
+        self.assertNotIn("Here is what I found", answer)
+
+    def test_any_split_parses_like_the_whole_text(self):
+        expected = parse_llm_response(SAMPLE_ANSWER)
+        for size in (1, 2, 3, 5, 7, 16, 64):
+            with self.subTest(size=size):
+                parser = AnswerParser()
+                closed = []
+                for i in range(0, len(SAMPLE_ANSWER), size):
+                    closed += parser.feed(SAMPLE_ANSWER[i:i + size])
+                closed += parser.close()
+                self.assertEqual((parser.answer, parser.source_reasoning_map), expected)
+                self.assertEqual([title for title, _ in closed], ["Acme MSA.pdf", "Initech SOW.pdf"])
+
+    def test_sections_close_as_soon_as_the_next_header_arrives(self):
+        parser = AnswerParser()
+        self.assertEqual(parser.feed("### SOURCE: Acme MSA.pdf\nThe term is two years. [[REASON: Term clause.]]\n"), [])
+        self.assertEqual(parser.feed("### SOURCE: Glo"), [])
+        self.assertEqual(parser.feed("bex NDA.pdf\n"), [("Acme MSA.pdf", "Term clause.")])
+
+    def test_trailing_header_without_newline(self):
+        parser = AnswerParser()
+        parser.feed("### SOURCE: Acme MSA.pdf\nThe term is two years here.\n### SOURCE: Globex NDA.pdf")
+        self.assertEqual(parser.close(), [("Acme MSA.pdf", FALLBACK_REASON)])
+
+
+PAGE_TEXT = " ".join(
+    f"§ {i}. The Supplier shall deliver the Goods within {i} days — Kündigungsfrist café."
+    for i in range(1, 80)
+)
+
+
+class ChunkingTests(SimpleTestCase):
+    def test_short_page_is_one_chunk(self):
+        self.assertEqual(chunk_page("A short page.", max_tokens=50, overlap=5), [(0, 13, "A short page.")])
+
+    def test_offsets_index_into_the_page(self):
+        windows = chunk_page(PAGE_TEXT, max_tokens=64, overlap=8)
+        self.assertGreater(len(windows), 1)
+        for char_start, char_end, text in windows:
+            self.assertEqual(PAGE_TEXT[char_start:char_end], text)
+        self.assertEqual(windows[0][0], 0)
+        self.assertEqual(windows[-1][1], len(PAGE_TEXT))
+
+    def test_windows_overlap_and_respect_the_budget(self):
+        encoding = get_encoding(settings.CHUNK_TOKENIZER)
+        windows = chunk_page(PAGE_TEXT, max_tokens=64, overlap=8)
+        for (_, prev_end, _), (start, _, _) in zip(windows, windows[1:]):
+            self.assertLess(start, prev_end) # Consecutive windows share text
+        for _, _, text in windows:
+            self.assertLessEqual(count_tokens(text, encoding), 64)
+
+    def test_overlap_must_be_smaller_than_window(self):
+        with self.assertRaises(ValueError):
+            chunk_page(PAGE_TEXT, max_tokens=10, overlap=10)
+
+    def test_chunk_pages_keeps_page_numbers_and_skips_empty_pages(self):
+        pages = [(1, PAGE_TEXT), (2, "x" * MIN_PAGE_CHARS), (3, "Signature page for both parties, dated and witnessed.")]
+        chunks = chunk_pages(pages)
+        self.assertEqual({page for page, _, _, _ in chunks}, {1, 3})
+        self.assertEqual([page for page, _, _, _ in chunks], sorted(page for page, _, _, _ in chunks))
+        for page, char_start, char_end, text in chunks:
+            self.assertEqual(dict(pages)[page][char_start:char_end], text)
+
+
+class MMRSelectTests(SimpleTestCase):
+    QUERY = [1.0, 0.0, 0.0]
+    # Two near-identical chunks of document 1, a slightly less relevant one of document 2
+    EMBEDDINGS = [[1.0, 0.1, 0.0], [1.0, 0.11, 0.0], [0.9, 0.0, 0.4], [0.0, 1.0, 0.0]]
+    GROUPS = [1, 1, 2, 3]
+
+    def test_most_relevant_first_then_diverse(self):
+        self.assertEqual(mmr_select(self.QUERY, self.EMBEDDINGS, self.GROUPS, k=2, lambda_=0.5), [0, 2])
+
+    def test_pure_relevance(self):
+        self.assertEqual(mmr_select(self.QUERY, self.EMBEDDINGS, self.GROUPS, k=3, lambda_=1.0), [0, 1, 2])
+
+    def test_per_group_cap(self):
+        picked = mmr_select(self.QUERY, self.EMBEDDINGS, self.GROUPS, k=4, lambda_=1.0, per_group_cap=1)
+        self.assertEqual(picked, [0, 2, 3])
+
+    def test_duplicates_dropped(self):
+        picked = mmr_select(self.QUERY, self.EMBEDDINGS, self.GROUPS, k=4, lambda_=1.0, duplicate_threshold=0.99)
+        self.assertNotIn(1, picked)
+        self.assertEqual(len(picked), 3)
+
+    def test_edge_cases(self):
+        self.assertEqual(mmr_select(self.QUERY, [], [], k=3), [])
+        self.assertEqual(mmr_select(self.QUERY, self.EMBEDDINGS, self.GROUPS, k=0), [])
+        self.assertEqual(sorted(mmr_select(self.QUERY, self.EMBEDDINGS, self.GROUPS, k=10)), [0, 1, 2, 3])
+
+
+class ReducePartialAnswersTests(SimpleTestCase):
+    def test_merges_a_document_split_across_partitions(self):
+        reduced = reduce_partial_answers([
+            "### SOURCE: Acme MSA.pdf\n[[REASON: Section 12.]]\nThirty days notice.\n",
+            "### SOURCE: Acme MSA.pdf\n[[REASON: Annex B.]]\nSixty days for renewals.\n"
+            "### SOURCE: Globex NDA.pdf\n[[EMPTY]]\n",
+        ])
+        answer, reasons = parse_llm_response(reduced)
+        self.assertEqual(reasons, {"Acme MSA.pdf": "Section 12."})
+        self.assertIn("Thirty days notice.", answer)
+        self.assertIn("Sixty days for renewals.", answer)
+        self.assertNotIn("Globex", answer)
+
+    def test_general_analysis_only_when_nothing_else(self):
+        found = "### SOURCE: Acme MSA.pdf\n[[REASON: Section 12.]]\nThirty days notice.\n"
+        self.assertNotIn(GENERAL_SOURCE, reduce_partial_answers([NOT_FOUND_ANSWER, found]))
+        self.assertIn(GENERAL_SOURCE, reduce_partial_answers([NOT_FOUND_ANSWER, NOT_FOUND_ANSWER]))
+
+    def test_failed_partitions_are_counted(self):
+        found = "### SOURCE: Acme MSA.pdf\n[[REASON: Section 12.]]\nThirty days notice.\n"
+        with mock.patch("api.chat.registry.inc") as inc:
+            reduced = reduce_partial_answers([found, "Error calling AI: System is currently overloaded. 429"])
+        inc.assert_called_once_with(ERRORS, 1, where="map_reduce")
+        self.assertIn("Thirty days notice.", reduced)
+        self.assertNotIn("Error", reduced)
+
+    def test_nothing_found_is_the_standard_answer(self):
+        self.assertEqual(reduce_partial_answers(["### SOURCE: Acme MSA.pdf\n[[EMPTY]]\n"]), NOT_FOUND_ANSWER)
+        self.assertEqual(reduce_partial_answers([]), NOT_FOUND_ANSWER)
+        answer, reasons = parse_llm_response(NOT_FOUND_ANSWER)
+        self.assertIn("couldn't find", answer)
+        self.assertEqual(reasons, {GENERAL_SOURCE: "Context missing"})
+
+    def test_every_partition_failed_returns_the_error(self):
+        error = "Error calling AI: System is currently overloaded. 429"
+        self.assertEqual(reduce_partial_answers([error, ""]), error)
+
+
+def placeholders(sql: str) -> set:
+    return set(re.findall(r"%\((\w+)\)s", sql))
+
+
+class BatchHybridSqlTests(SimpleTestCase):
+    SHARED = {"ts_config", "rrf_k", "filter_document_ids", "filter_title_prefix"}
+
+    def test_per_query_params_get_the_query_index(self):
+        for mode in VECTOR_MODES + ("hot",):
+            with self.subTest(mode=mode):
+                filter_keys = ("document_ids", "title_prefix")
+                single = placeholders(hybrid_sql(mode, filter_keys))
+                batch = placeholders(batch_hybrid_sql(mode, filter_keys, 3))
+                per_query = single - self.SHARED
+                self.assertTrue(per_query)
+                self.assertEqual(
+                    batch,
+                    (single & self.SHARED) | {f"{name}_{i}" for name in per_query for i in range(3)}
+                )
+
+    def test_rows_are_tagged_with_their_query(self):
+        sql = batch_hybrid_sql("full", (), 2)
+        self.assertIn("SELECT 0 AS query_index", sql)
+        self.assertIn("SELECT 1 AS query_index", sql)
+        self.assertEqual(sql.count("UNION ALL"), 1)
+
+    @override_settings(HNSW_ITERATIVE_SCAN="off", HNSW_EF_SEARCH_MIN=40, HNSW_EF_SEARCH_FACTOR=2,
+                       HNSW_EF_SEARCH_MAX=1000)
+    def test_run_hybrid_queries_binds_every_placeholder(self):
+        cursor = mock.MagicMock()
+        cursor.fetchall.return_value = []
+        connection = mock.MagicMock()
+        connection.cursor.return_value.__enter__.return_value = cursor
+        searches = [([0.1, 0.2], "notice period", 30, 30, 20), ([0.3, 0.4], "governing law", 150, 150, 150)]
+        with mock.patch("api.search.connection", connection), mock.patch("api.search.transaction"):
+            self.assertEqual(run_hybrid_queries(searches, mode="full", filters={"document_ids": [7]}), [[], []])
+
+        (_, ef_params), (sql, params) = [c.args for c in cursor.execute.call_args_list]
+        self.assertEqual(ef_params, ["300"]) # Sized for the deepest vector branch
+        self.assertEqual(placeholders(sql) - set(params), set())
+        self.assertEqual((params["vector_k_0"], params["vector_k_1"], params["keyword_k_1"]), (30, 150, 150))
+        self.assertEqual(params["filter_document_ids"], [7])
+
+
+class DeletePartialDocumentTests(SimpleTestCase):
+    def test_only_unfinished_documents_are_deleted(self):
+        job = IngestionJob(pk=1, document_id=5, file_hash="abc")
+        with mock.patch("api.ingest.Document.objects") as documents:
+            _delete_partial_document(job)
+        documents.filter.assert_called_once_with(pk=5, file_hash='')
+        documents.filter.return_value.delete.assert_called_once_with()
+
+    def test_job_without_document(self):
+        with mock.patch("api.ingest.Document.objects") as documents:
+            _delete_partial_document(IngestionJob(pk=1))
+        documents.filter.assert_not_called()
+
+
+@mock.patch("api.ingest.EMBED_BATCH_CHUNKS", 2)
+@mock.patch("api.ingest.connection")
+@mock.patch("api.ingest.transaction")
+@mock.patch("api.ingest._set_progress")
+class ParseEmbedAndInsertTests(SimpleTestCase):
+    PAGES = [
+        (1, [(1, 0, 10, "one a"), (1, 10, 20, "one b"), (1, 20, 30, "one c")]),
+        (2, []),
+        (3, [(3, 0, 10, "three a")]),
+    ]
+
+    def run_pipeline(self, pages, embeddings=None, before_commit=None):
+        embeddings = embeddings or (lambda texts, on_progress=None: [[float(len(t))] for t in texts])
+        with mock.patch("api.ingest.iter_document_chunks", return_value=iter(pages)), \
+                mock.patch("api.ingest._timed_embeddings", side_effect=embeddings), \
+                mock.patch("api.ingest.DocumentChunk.objects.bulk_create") as bulk_create:
+            written = ingest._parse_embed_and_insert(
+                IngestionJob(pk=1, source_path="x.pdf"), Document(pk=9), 3, before_commit or mock.Mock()
+            )
+        return written, [c.args[0] for c in bulk_create.call_args_list]
+
+    def test_batches_are_inserted_in_document_order(self, *mocks):
+        before_commit = mock.Mock()
+        written, inserts = self.run_pipeline(self.PAGES, before_commit=before_commit)
+        self.assertEqual(written, 4)
+        self.assertEqual([len(rows) for rows in inserts], [3, 1]) # One INSERT per embedded batch (whole pages)
+        rows = [row for batch in inserts for row in batch]
+        self.assertEqual([row.chunk_index for row in rows], [1, 2, 3, 4])
+        self.assertEqual([row.text_content for row in rows], ["one a", "one b", "one c", "three a"])
+        self.assertEqual(rows[3].page_number, 3)
+        before_commit.assert_called_once_with()
+
+    def test_embedding_error_fails_before_commit(self, *mocks):
+        before_commit = mock.Mock()
+
+        def fail(texts, on_progress=None):
+            raise RuntimeError("throttled")
+
+        with self.assertRaisesMessage(RuntimeError, "throttled"):
+            self.run_pipeline(self.PAGES, embeddings=fail, before_commit=before_commit)
+        before_commit.assert_not_called()
+
+    def test_extraction_error_stops_the_insert_stage(self, *mocks):
+        def pages():
+            yield self.PAGES[0]
+            raise ValueError("broken xref")
+
+        before_commit = mock.Mock()
+        with self.assertRaisesMessage(ValueError, "broken xref"):
+            self.run_pipeline(pages(), before_commit=before_commit)
+        before_commit.assert_not_called()
+
+
+class FakeResult:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def get(self, timeout=None):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+class FakePool:
+    """Stands in for the spawn pool: page i extracts as PAGE_OUTCOMES(i)"""
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.submitted = []
+        self.terminated = False
+
+    def apply_async(self, func, args):
+        path, index = args
+        self.submitted.append(index)
+        return FakeResult(self.outcomes(index))
+
+    def terminate(self):
+        self.terminated = True
+
+    def join(self):
+        pass
+
+
+class IterPageTextsTests(SimpleTestCase):
+    def setUp(self):
+        self.pools = []
+
+    def tearDown(self):
+        pdf_extract._reset_pool()
+
+    def run_pool(self, page_count, outcomes):
+        def new_pool(processes):
+            self.pools.append(FakePool(outcomes))
+            return self.pools[-1]
+
+        context = mock.Mock()
+        context.Pool.side_effect = new_pool
+        with mock.patch.object(pdf_extract.multiprocessing, "get_context", return_value=context):
+            return list(pdf_extract.iter_page_texts("doc.pdf", page_count, workers=2, page_timeout=5))
+
+    def test_pages_come_back_in_order(self):
+        pages = self.run_pool(20, lambda i: f"page {i + 1}")
+        self.assertEqual(pages, [(i, f"page {i}") for i in range(1, 21)])
+        self.assertEqual(len(self.pools), 1)
+
+    def test_failed_page_yields_empty_text(self):
+        pages = self.run_pool(3, lambda i: ValueError("bad stream") if i == 1 else f"page {i + 1}")
+        self.assertEqual(pages, [(1, "page 1"), (2, ""), (3, "page 3")])
+        self.assertFalse(self.pools[0].terminated)
+
+    def test_timed_out_page_replaces_the_pool(self):
+        pages = self.run_pool(
+            12, lambda i: multiprocessing.TimeoutError() if i == 2 else f"page {i + 1}"
+        )
+        self.assertEqual(pages, [(i, "" if i == 3 else f"page {i}") for i in range(1, 13)])
+        self.assertEqual(len(self.pools), 2)
+        self.assertTrue(self.pools[0].terminated)
+        # Pages that were in flight on the stuck pool run again on the new one
+        self.assertEqual(self.pools[1].submitted, list(range(3, 12)))
+
+    def test_in_process_errors_yield_empty_text(self):
+        class Page:
+            def __init__(self, text):
+                self.text = text
+
+            def extract_text(self):
+                if self.text is None:
+                    raise ValueError("bad stream")
+                return self.text
+
+        reader = mock.Mock(pages=[Page("one"), Page(None), Page("three")])
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as f, \
+                mock.patch("api.pdf_extract.PdfReader", return_value=reader):
+            pages = list(pdf_extract.iter_page_texts(f.name, 3, workers=1, page_timeout=5))
+        self.assertEqual(pages, [(1, "one"), (2, ""), (3, "three")])
+
+
+class PrepareBatchTests(SimpleTestCase):
+    @override_settings(BATCH_LLM_CONCURRENCY=3)
+    def test_intent_analysis_respects_the_llm_concurrency(self):
+        in_flight, peak = 0, 0
+
+        async def depth(query):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+            return 600
+
+        async def summaries(query, k_value, filters, version):
+            return ["summary"]
+
+        with mock.patch("api.batch.adetermine_search_depth", side_effect=depth), \
+                mock.patch("api.batch._broad_summary_candidates", side_effect=summaries), \
+                mock.patch("api.batch.asearch_hybrid_batch", new=mock.AsyncMock(return_value=[])), \
+                mock.patch("api.batch.aget_query_embeddings", new=mock.AsyncMock(return_value=[])), \
+                mock.patch("api.batch.build_context", return_value="context"):
+            prepared = asyncio.run(batch.prepare_batch([f"question {i}" for i in range(10)], version="v1"))
+
+        self.assertEqual(peak, 3)
+        self.assertEqual(prepared, [(600, ["summary"], "context")] * 10)
+
+
+class QuantizedIndexTests(SimpleTestCase):
+    def test_coarse_index_name_follows_its_dimensions(self):
+        with override_settings(VECTOR_COARSE_DIMENSIONS=256):
+            name_256, expression_256 = quantized_index("truncated")
+        with override_settings(VECTOR_COARSE_DIMENSIONS=128):
+            name_128, expression_128 = quantized_index("truncated")
+        self.assertNotEqual(name_256, name_128)
+        self.assertIn("subvector(embedding, 1, 128)::vector(128)", expression_128)
+        self.assertIn("256", name_256)
+
+
+class FakeChunkRows:
+    """
+    The slice of the DocumentChunk queryset API that hot_tier's writer uses.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, id__gt):
+        return FakeChunkRows([row for row in self.rows if row[0] > id__gt])
+
+    def order_by(self, field):
+        return FakeChunkRows(sorted(self.rows))
+
+    def values_list(self, *fields):
+        return self
+
+    def iterator(self, chunk_size):
+        return iter(list(self.rows))
+
+
+class HotTierSyncTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        overrides = override_settings(HOT_TIER_DIR=self.dir, HOT_TIER_DTYPE="float32", HOT_TIER_MAX_ROWS=100)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.chunks = FakeChunkRows([])
+        for patcher in (
+            mock.patch("api.hot_tier.DocumentChunk.objects", self.chunks),
+            mock.patch("api.hot_tier._chunks_up_to", side_effect=self.count_up_to),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def count_up_to(self, max_id=None):
+        return sum(1 for row in self.chunks.rows if max_id is None or row[0] <= max_id)
+
+    def commit(self, *chunk_ids):
+        for chunk_id in chunk_ids:
+            vector = np.zeros(hot_tier.DIMENSIONS)
+            vector[chunk_id] = 2.0 # Stored normalized
+            self.chunks.rows.append((chunk_id, 10 + chunk_id, vector.tolist()))
+
+    def stored_ids(self, meta):
+        return np.fromfile(hot_tier._files(meta["generation"])["ids"], dtype=np.int64).tolist()
+
+    def test_new_chunks_are_appended(self):
+        self.commit(1, 2)
+        first = hot_tier.sync()
+        self.commit(3)
+        meta = hot_tier.sync()
+        self.assertEqual(meta["generation"], first["generation"])
+        self.assertEqual((meta["rows"], meta["max_id"]), (3, 3))
+        self.assertEqual(self.stored_ids(meta), [1, 2, 3])
+
+        query = np.zeros(hot_tier.DIMENSIONS)
+        query[3] = 1.0
+        results = hot_tier.HotTier().top_k(query, 2)
+        self.assertEqual(results[0], (3, 0.0))
+        self.assertEqual(hot_tier.HotTier().top_k(query, 3, {"document_ids": [11]}), [(1, 1.0)])
+
+    def test_interrupted_append_is_dropped(self):
+        self.commit(1)
+        meta = hot_tier.sync()
+        with open(hot_tier._files(meta["generation"])["ids"], "ab") as f:
+            f.write(b"\0" * 8) # Appended, but meta.json never moved
+        self.commit(2)
+        self.assertEqual(self.stored_ids(hot_tier.sync()), [1, 2])
+
+    def test_stale_tier_is_rebuilt(self):
+        self.commit(1, 2)
+        first = hot_tier.sync()
+        self.chunks.rows.pop(0)
+        hot_tier.mark_stale()
+        self.assertIsNone(hot_tier.HotTier().top_k([1.0] * hot_tier.DIMENSIONS, 5))
+
+        meta = hot_tier.sync()
+        self.assertEqual(meta["generation"], first["generation"] + 1)
+        self.assertFalse(meta["stale"])
+        self.assertEqual(self.stored_ids(meta), [2])
+        self.assertFalse(os.path.exists(hot_tier._files(first["generation"])["ids"]))
+
+    def test_ids_committed_out_of_order_trigger_a_rebuild(self):
+        self.commit(1, 3)
+        first = hot_tier.sync()
+        self.commit(2) # A slower ingest commits below max_id
+        meta = hot_tier.sync()
+        self.assertEqual(meta["generation"], first["generation"] + 1)
+        self.assertEqual(self.stored_ids(meta), [1, 2, 3])
+
+    def test_corpus_above_max_rows_stays_on_postgres(self):
+        self.commit(1, 2, 3)
+        with override_settings(HOT_TIER_MAX_ROWS=2):
+            meta = hot_tier.sync()
+        self.assertTrue(meta["stale"])
+        self.assertIsNone(hot_tier.HotTier().top_k([1.0] * hot_tier.DIMENSIONS, 5))
@@ -103,6 +103,140 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION_NAME = os.getenv('AWS_REGION_NAME', 'us-east-1')
 AWS_S3_BUCKET_NAME = os.getenv('AWS_S3_BUCKET_NAME')
+
+# Presigned source URLs (valid 1h) are cached per S3 key for at most this long
+PRESIGNED_URL_CACHE_TTL = int(os.getenv('PRESIGNED_URL_CACHE_TTL', 2700))
+PRESIGNED_URL_CACHE_SIZE = int(os.getenv('PRESIGNED_URL_CACHE_SIZE', 10000))
+PRESIGNED_URL_MIN_REMAINING = int(os.getenv('PRESIGNED_URL_MIN_REMAINING', 900))
+
+# Ingestion text extraction: pypdf runs on a process pool of this many workers (1 = in-process);
+# a page taking longer than PDF_PAGE_TIMEOUT seconds is skipped
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', os.cpu_count() or 1))
+PDF_PAGE_TIMEOUT = float(os.getenv('PDF_PAGE_TIMEOUT', 60))
+
+# Ingestion chunking: token windows per page (tiktoken encoding) and overlap between windows
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', 512))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', 64))
+CHUNK_TOKENIZER = os.getenv('CHUNK_TOKENIZER', 'cl100k_base')
+
+# /chat context packing: token budget for retrieved chunks, counted with the deployment's tokenizer
+LLM_CONTEXT_TOKENS = int(os.getenv('LLM_CONTEXT_TOKENS', 12000))
+LLM_TOKENIZER_FALLBACK = os.getenv('LLM_TOKENIZER_FALLBACK', 'o200k_base')
+
+# Titan v2 output size (256, 512 or 1024). Changing it requires re-embedding the corpus
+# and regenerating the DocumentChunk.embedding column.
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', 1024))
+if EMBEDDING_DIMENSIONS not in (256, 512, 1024):
+    raise ValueError("EMBEDDING_DIMENSIONS must be 256, 512 or 1024 (Titan v2)")
+
+# Ingestion: number of Titan embedding requests kept in flight per upload
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', 8))
+
+# Uploads: files above FILE_UPLOAD_MAX_MEMORY_SIZE are buffered by Django in a temp file,
+# then copied in chunks to the spool dir, so memory stays flat regardless of PDF size
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 200 * 1024 * 1024))
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440 # 2.5 MB (Django default)
+
+# S3 uploads of the original PDF: multipart above the threshold, parts sent in parallel
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', 8))
+
+# Background ingestion: /upload spools files here, `manage.py ingest_worker` picks them up.
+# Must be shared storage if workers run on a different host than the API.
+INGEST_SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', str(BASE_DIR / 'ingest_spool'))
+INGEST_POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', 2.0))
+# Running jobs heartbeat every INGEST_JOB_LEASE / 3 seconds. A job without a heartbeat for
+# INGEST_JOB_LEASE seconds (its worker died) is claimed again, at most INGEST_MAX_ATTEMPTS times.
+INGEST_JOB_LEASE = int(os.getenv('INGEST_JOB_LEASE', 300))
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', 3))
+
+# /chat query cache (query -> embedding, query -> k, (query, k) -> chunk ids).
+# Always an in-process LRU; set QUERY_CACHE_BACKEND to a CACHES alias (e.g. Redis)
+# to share entries and invalidations across workers.
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv('QUERY_CACHE_MAX_ENTRIES', 2048))
+QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 600))
+QUERY_CACHE_BACKEND = os.getenv('QUERY_CACHE_BACKEND') or None
+
+# /chat answer cache: a near-duplicate question (query embedding cosine >= threshold)
+# that retrieves the exact same chunks reuses the stored answer. 0 entries = off.
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 1000))
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+
+# /chat intent analysis: "local" = regex classifier (no round trip),
+# "llm" = GPT call, run concurrently with a speculative retrieval of SEARCH_SPECULATIVE_K * 3 chunks
+SEARCH_DEPTH_MODE = os.getenv('SEARCH_DEPTH_MODE', 'local')
+SEARCH_SPECULATIVE_K = int(os.getenv('SEARCH_SPECULATIVE_K', 50))
+
+# Context diversity (MMR over the k_value * 3 candidates): relevance vs. diversity weight
+# (1.0 = pure relevance), max chunks per document (0 = no cap), and the cosine similarity
+# above which a candidate counts as a near-duplicate of an already selected chunk
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', 0.7))
+MMR_PER_DOCUMENT_CAP = int(os.getenv('MMR_PER_DOCUMENT_CAP', 0))
+MMR_DUPLICATE_THRESHOLD = float(os.getenv('MMR_DUPLICATE_THRESHOLD', 0.95))
+
+# LLM answering: "single" (one call over the packed context), "map_reduce" (per-partition
+# calls, MAP_REDUCE_CONCURRENCY at a time, merged per source) or "auto" (map-reduce for
+# broad queries whose candidates don't fit one LLM_CONTEXT_TOKENS context)
+ANSWER_MODE = os.getenv('ANSWER_MODE', 'auto')
+MAP_REDUCE_CONCURRENCY = int(os.getenv('MAP_REDUCE_CONCURRENCY', 8))
+MAP_REDUCE_MAX_PARTITIONS = int(os.getenv('MAP_REDUCE_MAX_PARTITIONS', 50))
+
+# /chat/batch: questions answered concurrently, and the most one request may ask
+# (larger checklists: `manage.py chat_batch`, which writes results to a file)
+BATCH_LLM_CONCURRENCY = int(os.getenv('BATCH_LLM_CONCURRENCY', 4))
+BATCH_MAX_QUESTIONS = int(os.getenv('BATCH_MAX_QUESTIONS', 100))
+
+# Summary tier for broad ("list all / summarize") queries. Built by the ingest worker:
+# one summary per SUMMARY_SECTION_TOKENS of source text plus one per document.
+# Broad queries read SUMMARY_TOP_K summaries, then drill into the chunks of the best
+# SUMMARY_DRILL_DOCUMENTS documents (SUMMARY_DRILL_CHUNKS chunks in total).
+SUMMARY_TIER_ENABLED = os.getenv('SUMMARY_TIER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SUMMARY_SECTION_TOKENS = int(os.getenv('SUMMARY_SECTION_TOKENS', 4000))
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', 4))
+SUMMARY_TOP_K = int(os.getenv('SUMMARY_TOP_K', 40))
+SUMMARY_DRILL_DOCUMENTS = int(os.getenv('SUMMARY_DRILL_DOCUMENTS', 5))
+SUMMARY_DRILL_CHUNKS = int(os.getenv('SUMMARY_DRILL_CHUNKS', 20))
+
+# Hybrid search: candidate depth of the vector and keyword branches, and the RRF constant
+HYBRID_VECTOR_K = int(os.getenv('HYBRID_VECTOR_K', 20))
+HYBRID_KEYWORD_K = int(os.getenv('HYBRID_KEYWORD_K', 20))
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', 60))
+
+# Async /chat service layer: connection pool size for the shared Azure OpenAI / Bedrock HTTP clients
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', 200))
+
+# Vector branch: "full" (float32 cosine_idx), "halfvec", "binary" or "truncated" (compact HNSW
+# expression index, then exact re-ranking of VECTOR_RERANK_OVERSAMPLE x more candidates on the
+# full vectors). "truncated" searches the first VECTOR_COARSE_DIMENSIONS dimensions.
+VECTOR_SEARCH_MODE = os.getenv('VECTOR_SEARCH_MODE', 'full')
+VECTOR_RERANK_OVERSAMPLE = int(os.getenv('VECTOR_RERANK_OVERSAMPLE', 4))
+# Default: 256, or half the vector when the embeddings are 256-dimensional themselves
+VECTOR_COARSE_DIMENSIONS = int(os.getenv('VECTOR_COARSE_DIMENSIONS', min(256, EMBEDDING_DIMENSIONS // 2)))
+if VECTOR_SEARCH_MODE == 'truncated' and not 0 < VECTOR_COARSE_DIMENSIONS < EMBEDDING_DIMENSIONS:
+    raise ValueError("VECTOR_COARSE_DIMENSIONS must be smaller than EMBEDDING_DIMENSIONS")
+
+# Optional hot tier (api/hot_tier.py): every chunk embedding in a memory-mapped file
+# under HOT_TIER_DIR, searched exactly with NumPy instead of the HNSW round trip.
+# Synced by the ingest worker; corpora above HOT_TIER_MAX_ROWS chunks stay on Postgres.
+# Must be local (or shared) disk of every API worker and ingest worker.
+HOT_TIER_ENABLED = os.getenv('HOT_TIER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+HOT_TIER_DIR = os.getenv('HOT_TIER_DIR', str(BASE_DIR / 'hot_tier'))
+HOT_TIER_DTYPE = os.getenv('HOT_TIER_DTYPE', 'float32')
+if HOT_TIER_DTYPE not in ('float32', 'float16'):
+    raise ValueError("HOT_TIER_DTYPE must be float32 or float16")
+HOT_TIER_MAX_ROWS = int(os.getenv('HOT_TIER_MAX_ROWS', 500000))
+
+# Postgres text search configuration used for search_vector and keyword queries
+SEARCH_TEXT_CONFIG = os.getenv('SEARCH_TEXT_CONFIG', 'english')
+
+# HNSW query-time tuning: ef_search = clamp(index LIMIT * factor, min, max) per query.
+# Iterative scans (pgvector >= 0.8) keep walking the graph until filtered queries have
+# enough rows: "strict_order", "relaxed_order" or "off" (older pgvector).
+HNSW_EF_SEARCH_MIN = int(os.getenv('HNSW_EF_SEARCH_MIN', 40))
+HNSW_EF_SEARCH_FACTOR = int(os.getenv('HNSW_EF_SEARCH_FACTOR', 2))
+HNSW_EF_SEARCH_MAX = int(os.getenv('HNSW_EF_SEARCH_MAX', 1000))
+HNSW_ITERATIVE_SCAN = os.getenv('HNSW_ITERATIVE_SCAN', 'strict_order')
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,20 +1,25 @@
 import axios from 'axios';
-import type{ ChatResponse } from './types';
+import type{ ChatResponse, IngestionJob, SearchFilters } from './types';
 const BASE_URL = import.meta.env.VITE_API_URL
 const api = axios.create({
   baseURL: BASE_URL, // Adjust if your port differs
 });
 
-export const uploadFile = async (file: File) => {
+export const uploadFile = async (file: File): Promise<IngestionJob> => {
   const formData = new FormData();
   formData.append('file', file);
-  const response = await api.post('/upload', formData, {
+  const response = await api.post<IngestionJob>('/upload', formData, {
     headers: { 'Content-Type': 'multipart/form-data' },
   });
   return response.data;
 };
 
-export const sendMessage = async (query: string): Promise<ChatResponse> => {
-  const response = await api.post<ChatResponse>('/chat', { query });
+export const getJob = async (jobId: number): Promise<IngestionJob> => {
+  const response = await api.get<IngestionJob>(`/jobs/${jobId}`);
+  return response.data;
+};
+
+export const sendMessage = async (query: string, filters?: SearchFilters): Promise<ChatResponse> => {
+  const response = await api.post<ChatResponse>('/chat', { query, filters });
   return response.data;
 };
\ No newline at end of file
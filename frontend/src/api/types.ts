@@ -7,10 +7,19 @@ export interface Source {
   reason?: string;
 }
 
+export interface SearchFilters {
+  document_ids?: number[];
+  uploaded_after?: string; // ISO datetime
+  uploaded_before?: string;
+  title_prefix?: string;
+}
+
 export interface ChatResponse {
   answer: string;
   sources: Source[];
   processing_time: number;
+  cached?: boolean;
+  timings?: Record<string, number> | null; // Seconds per stage, when requested
 }
 
 export interface Message {
@@ -19,4 +28,18 @@ export interface Message {
   content: string;
   sources?: Source[];
   timestamp: Date;
+}
+
+export interface IngestionJob {
+  id: number;
+  filename: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  document_id: number | null;
+  pages_total: number;
+  pages_parsed: number;
+  pages_embedded: number;
+  error: string | null;
+  timings: Record<string, number>; // Seconds per ingestion stage
+  created_at: string;
+  finished_at: string | null;
 }
\ No newline at end of file
@@ -1,6 +1,8 @@
 import React, { useState } from 'react';
 import { Upload, Loader2, CheckCircle } from 'lucide-react';
-import { uploadFile } from '../api/client';
+import { uploadFile, getJob } from '../api/client';
+
+const POLL_INTERVAL_MS = 2000;
 
 export const UploadZone = () => {
   const [status, setStatus] = useState<'idle' | 'uploading' | 'success' | 'error'>('idle');
@@ -9,7 +11,13 @@ export const UploadZone = () => {
     if (!e.target.files?.[0]) return;
     setStatus('uploading');
     try {
-      await uploadFile(e.target.files[0]);
+      let job = await uploadFile(e.target.files[0]);
+      // Ingestion runs in the background; wait until the worker finishes it
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+        job = await getJob(job.id);
+      }
+      if (job.status === 'failed') throw new Error(job.error ?? 'Ingestion failed');
       setStatus('success');
       setTimeout(() => setStatus('idle'), 3000); // Reset after 3s
     } catch (err) {